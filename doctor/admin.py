@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Crop, Disease, Treatment, Prediction, CropTip
+from .models import Crop, Disease, Treatment, Prediction, CropTip, DailyPredictionStats, ShadowComparison
+from .stats import record_correction
 
 @admin.register(Crop)
 class CropAdmin(admin.ModelAdmin):
@@ -24,12 +25,29 @@ class TreatmentAdmin(admin.ModelAdmin):
 
 @admin.register(Prediction)
 class PredictionAdmin(admin.ModelAdmin):
-    list_display = ['predicted_crop', 'predicted_disease', 'confidence_score', 'created_at']
-    list_filter = ['predicted_crop', 'confidence_score', 'is_correct', 'created_at']
+    list_display = ['predicted_crop', 'predicted_disease', 'confidence_score', 'model_version', 'created_at']
+    list_filter = ['predicted_crop', 'confidence_score', 'is_correct', 'model_version', 'created_at']
     search_fields = ['predicted_crop', 'predicted_disease']
-    readonly_fields = ['image', 'predicted_crop', 'predicted_disease', 'confidence_score', 'created_at']
+    readonly_fields = ['image', 'predicted_crop', 'predicted_disease', 'confidence_score', 'model_version', 'created_at']
     ordering = ['-created_at']
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'is_correct' in form.changed_data:
+            record_correction(obj, form.initial.get('is_correct'))
+
+@admin.register(DailyPredictionStats)
+class DailyPredictionStatsAdmin(admin.ModelAdmin):
+    list_display = ['date', 'predicted_crop', 'predicted_disease', 'prediction_count', 'correct_count']
+    list_filter = ['date', 'predicted_crop']
+    ordering = ['-date', 'predicted_crop', 'predicted_disease']
+
+@admin.register(ShadowComparison)
+class ShadowComparisonAdmin(admin.ModelAdmin):
+    list_display = ['date', 'primary_version', 'candidate_version', 'primary_class', 'candidate_class', 'count']
+    list_filter = ['date', 'candidate_version', 'primary_version']
+    ordering = ['-date', 'candidate_version', '-count']
+
 @admin.register(CropTip)
 class CropTipAdmin(admin.ModelAdmin):
     list_display = ['title', 'crop', 'tip_type', 'season', 'created_at']
@@ -1,151 +1,264 @@
 from django.core.files.uploadedfile import InMemoryUploadedFile
-from PIL import Image
 import numpy as np
-import tensorflow as tf
+import atexit
+import logging
 import os
+import threading
+import time
+from time import perf_counter
 
-from .models import Disease, Treatment, Crop
+from django.conf import settings
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from .backends import RemoteBackend, get_backend
+from .batching import MicroBatcher
+from .calibration import apply_temperature, load_temperature
+from .labels import build_registry
+from .metrics import observe_stage
+from .model_registry import ModelManifest, load_manifest
+from .model_server import ModelServerError
+from .prediction_cache import model_fingerprint
+from .preprocessing import BatchBuffer, decode_image, resize_image, write_pixels
+from .shadow import get_shadow_evaluator
+from .shm_ring import RingFull, SharedTensorRing
+
+logger = logging.getLogger(__name__)
 
 class AIPredictor:
-    def __init__(self):
-        self.model_path = os.path.join(BASE_DIR, 'plant_model_v5-beta.h5')
-        
-        # Define the class names as dictionary (matching Gradio code)
-        self.class_names = {
-            0: 'Apple___Apple_scab',
-            1: 'Apple___Black_rot',
-            2: 'Apple___Cedar_apple_rust',
-            3: 'Apple___healthy',
-            4: 'Not a plant',
-            5: 'Blueberry___healthy',
-            6: 'Cherry___Powdery_mildew',
-            7: 'Cherry___healthy',
-            8: 'Corn___Cercospora_leaf_spot Gray_leaf_spot',
-            9: 'Corn___Common_rust',
-            10: 'Corn___Northern_Leaf_Blight',
-            11: 'Corn___healthy',
-            12: 'Grape___Black_rot',
-            13: 'Grape___Esca_(Black_Measles)',
-            14: 'Grape___Leaf_blight_(Isariopsis_Leaf_Spot)',
-            15: 'Grape___healthy',
-            16: 'Orange___Haunglongbing_(Citrus_greening)',
-            17: 'Peach___Bacterial_spot',
-            18: 'Peach___healthy',
-            19: 'Pepper,_bell___Bacterial_spot',
-            20: 'Pepper,_bell___healthy',
-            21: 'Potato___Early_blight',
-            22: 'Potato___Late_blight',
-            23: 'Potato___healthy',
-            24: 'Raspberry___healthy',
-            25: 'Soybean___healthy',
-            26: 'Squash___Powdery_mildew',
-            27: 'Strawberry___Leaf_scorch',
-            28: 'Strawberry___healthy',
-            29: 'Tomato___Bacterial_spot',
-            30: 'Tomato___Early_blight',
-            31: 'Tomato___Late_blight',
-            32: 'Tomato___Leaf_Mold',
-            33: 'Tomato___Septoria_leaf_spot',
-            34: 'Tomato___Spider_mites Two-spotted_spider_mite',
-            35: 'Tomato___Target_Spot',
-            36: 'Tomato___Tomato_Yellow_Leaf_Curl_Virus',
-            37: 'Tomato___Tomato_mosaic_virus',
-            38: 'Tomato___healthy'
-        }
-        
-        # Treatment recommendations dictionary
-        self.keras_treatments = {
-            'Apple___Apple_scab': "Remove fallen leaves and prune infected branches. Apply fungicides containing captan or myclobutanil.",
-            'Apple___Black_rot': "Prune out dead branches. Spray copper-based fungicide during early fruit development.",
-            'Apple___Cedar_apple_rust': "Remove nearby juniper trees. Apply fungicides before bud break.",
-            'Apple___healthy': "No action required. The plant is healthy.",
-            'Blueberry___healthy': "No action required. The plant is healthy.",
-            'Cherry___Powdery_mildew': "Apply sulfur-based fungicide. Ensure good air circulation around the plant.",
-            'Cherry___healthy': "No action required. The plant is healthy.",
-            'Corn___Cercospora_leaf_spot Gray_leaf_spot': "Rotate crops to avoid build-up of pathogens. Use resistant hybrids and apply foliar fungicides.",
-            'Corn___Common_rust': "Plant rust-resistant hybrids. Apply fungicides at the first sign of rust.",
-            'Corn___Northern_Leaf_Blight': "Use resistant varieties and apply fungicides when lesions are observed.",
-            'Corn___healthy': "No action required. The plant is healthy.",
-            'Grape___Black_rot': "Remove and destroy infected leaves and fruits. Apply fungicides containing myclobutanil or captan.",
-            'Grape___Esca_(Black_Measles)': "Prune and destroy infected wood. Apply fungicides during the growing season.",
-            'Grape___Leaf_blight_(Isariopsis_Leaf_Spot)': "Maintain good air circulation. Spray protective fungicides like mancozeb.",
-            'Grape___healthy': "No action required. The plant is healthy.",
-            'Orange___Haunglongbing_(Citrus_greening)': "Remove and destroy infected trees. Control psyllid vectors with insecticides.",
-            'Peach___Bacterial_spot': "Apply copper-based bactericides. Use resistant varieties and avoid overhead irrigation.",
-            'Peach___healthy': "No action required. The plant is healthy.",
-            'Pepper,_bell___Bacterial_spot': "Apply copper-based sprays. Use certified seeds and avoid overhead irrigation.",
-            'Pepper,_bell___healthy': "No action required. The plant is healthy.",
-            'Potato___Early_blight': "Use certified seeds and apply preventative fungicides like chlorothalonil.",
-            'Potato___Late_blight': "Plant disease-free tubers and use fungicides containing metalaxyl.",
-            'Potato___healthy': "No action required. The plant is healthy.",
-            'Raspberry___healthy': "No action required. The plant is healthy.",
-            'Soybean___healthy': "No action required. The plant is healthy.",
-            'Squash___Powdery_mildew': "Use sulfur-based fungicides and ensure good ventilation.",
-            'Strawberry___Leaf_scorch': "Remove infected leaves. Apply fungicides containing myclobutanil.",
-            'Strawberry___healthy': "No action required. The plant is healthy.",
-            'Tomato___Bacterial_spot': "Apply copper-based sprays. Avoid overhead watering.",
-            'Tomato___Early_blight': "Prune infected leaves and apply fungicides containing chlorothalonil or mancozeb.",
-            'Tomato___Late_blight': "Remove infected plants. Apply fungicides containing chlorothalonil or metalaxyl.",
-            'Tomato___Leaf_Mold': "Ensure good ventilation and apply fungicides like mancozeb.",
-            'Tomato___Septoria_leaf_spot': "Remove infected leaves and apply fungicides containing chlorothalonil.",
-            'Tomato___Spider_mites Two-spotted_spider_mite': "Spray insecticidal soap or neem oil. Maintain humidity levels.",
-            'Tomato___Target_Spot': "Use resistant varieties. Apply fungicides containing chlorothalonil.",
-            'Tomato___Tomato_Yellow_Leaf_Curl_Virus': "Remove infected plants. Use resistant varieties and control whitefly vectors.",
-            'Tomato___Tomato_mosaic_virus': "Remove infected plants and disinfect tools. Use resistant seed varieties.",
-            'Tomato___healthy': "No action required. The plant is healthy.",
-            'Unknown': "No specific treatment available."
-        }
-        
-        self.model = tf.keras.models.load_model(self.model_path)
-
-    def preprocess_image(self, image: InMemoryUploadedFile):
-        # Convert to numpy array and resize to 256x256 (matching Gradio preprocessing)
-        img = Image.open(image).convert('RGB')
-        img_array = np.array(img)
-        img_array = tf.image.resize(img_array, [256, 256])
-        img_array = tf.expand_dims(img_array, 0) / 255.0
-        return img_array
+    input_shape = (256, 256, 3)
 
-    def predict(self, image: InMemoryUploadedFile):
-        processed_image = self.preprocess_image(image)
-        predictions = self.model.predict(processed_image)
-        predicted_class_idx = tf.argmax(predictions[0], axis=-1).numpy()
-        confidence = float(np.max(predictions[0]))
-        
-        # Get predicted label from dictionary
-        predicted_label = self.class_names.get(predicted_class_idx, "Unknown")
-        
-        # Check confidence threshold (like in Gradio)
-        if confidence < 0.60:
-            class_name = "Uncertain / Not in dataset"
-            crop, disease = "Unknown", "Unknown"
+    def __init__(self, model_path=None, server_socket=None, shm_slots=0, backend='keras', manifest=None):
+        # The model version served: artifact, output classes and input size.
+        # A bare `model_path` is described by settings.CLASS_NAMES
+        if manifest is None:
+            manifest = ModelManifest.legacy(model_path) if model_path else load_manifest()
+        self.manifest = manifest
+        self.version = manifest.version
+        self.model_path = manifest.model_path
+        self.input_shape = manifest.input_shape
+
+        # Client mode: the model lives in a separate `runmodelserver` process and
+        # this process sends it raw uint8 pixels, never importing TensorFlow.
+        # Otherwise `backend` picks the runtime (keras, tflite or onnx, see backends)
+        if server_socket:
+            self.backend = RemoteBackend(server_socket)
+            self.client = self.backend.client
         else:
-            class_name = predicted_label
-            # Split class_name into crop and disease
-            if "___" in class_name:
-                crop, disease = class_name.split("___", 1)
-            else:
-                crop, disease = class_name, ""
+            self.backend = get_backend(backend, self.model_path, self.input_shape)
+            self.client = None
+        self.input_dtype = self.backend.input_dtype
+
+        # With shm_slots, client mode preprocesses straight into a shared-memory
+        # ring and only sends slot indices over the socket
+        self.shm_slots = shm_slots if self.client else 0
+        self._ring = None
+        self._ring_pid = None
+        self._ring_lock = threading.Lock()
+
+        # Crop, disease and treatment of every model output, by index
+        self.labels = build_registry(manifest.class_names)
+
+        # Post-processing: confidence threshold, number of alternatives returned
+        # and the temperature fitted by `manage.py calibrate_model` (1.0 = none)
+        self.confidence_threshold = settings.PREDICTION_CONFIDENCE_THRESHOLD
+        self.top_k = settings.PREDICTION_TOP_K
+        self.temperature = load_temperature(manifest.calibration_file)
+        self.cache_key = self._cache_key()
+
+        # Weights are loaded on first use (see load())
+        self._load_lock = threading.Lock()
+        self.model_load_seconds = None
+
+        # One reusable single-image input buffer per request thread
+        self._buffers = threading.local()
+
+        # Concurrent requests are grouped into one forward pass (in client mode
+        # the model server does the batching)
+        self.batcher = MicroBatcher(
+            self._timed_forward,
+            max_batch_size=1 if self.client else settings.INFERENCE_MAX_BATCH_SIZE,
+            max_wait_ms=settings.INFERENCE_MAX_WAIT_MS,
+            timeout=settings.INFERENCE_TIMEOUT,
+        )
+
+    @property
+    def is_loaded(self):
+        return self.backend.is_loaded
+
+    def load(self):
+        with self._load_lock:
+            if not self.backend.is_loaded:
+                started = time.monotonic()
+                self.backend.load()
+                # The remote backend only learns its output size from the first response
+                if hasattr(self.backend, 'num_classes'):
+                    self.labels.check(self.backend.num_classes)
+                self.model_load_seconds = time.monotonic() - started
+                # The artifact may have been replaced since __init__
+                self.cache_key = self._cache_key()
+                logger.info(
+                    f"Loaded model {self.version} from {self.backend.path} ({self.backend.name}) "
+                    f"in {self.model_load_seconds:.2f}s"
+                )
+        return self.backend
+
+    def _cache_key(self):
+        # Cached results are only reused for the same artifact, runtime and
+        # calibration (int8 TFLite and ONNX outputs differ from Keras)
+        artifact = self.model_path if self.client else self.backend.path
+        return f"{self.version}-{model_fingerprint(artifact)}-{self.backend.name}-{self.temperature:g}"
+
+    def close(self):
+        # Called once a newer version has been swapped in; requests still
+        # running on this predictor finish without the micro-batcher
+        self.batcher.close()
+
+    def warm_up(self):
+        # One dummy forward pass so the first real request doesn't pay for graph setup
+        try:
+            probabilities = self._forward(np.zeros((1,) + self.input_shape, dtype=self.input_dtype))
+            self.labels.check(probabilities.shape[-1])
+        except OSError as e:
+            if not self.client:
+                raise
+            # The model server may still be starting; requests will retry the connection
+            logger.warning(f"Model server not reachable during warm-up: {e}")
+
+    def preprocess_image(self, image: InMemoryUploadedFile, out=None):
+        # Decode, resize to 256x256 and scale to [0, 1] in one pass into a
+        # (1, 256, 256, 3) float32 array that is reused by this thread
+        # (raw uint8 pixels in client mode), or into the (256, 256, 3) `out`
+        if out is None:
+            buffer = getattr(self._buffers, 'input', None)
+            if buffer is None:
+                buffer = self._buffers.input = BatchBuffer(1, self.input_shape[1::-1], self.input_dtype)
+            out = buffer.array[0]
+        size = self.input_shape[1::-1]
+        started = perf_counter()
+        img = decode_image(image, size)
+        decoded = perf_counter()
+        img = resize_image(img, size)
+        resized = perf_counter()
+        write_pixels(img, out)
+        observe_stage('decode', decoded - started)
+        observe_stage('resize', resized - decoded)
+        observe_stage('normalize', perf_counter() - resized)
+        return out[np.newaxis]
 
-        return {
-            "class_name": class_name,
-            "crop": crop,
-            "disease": disease,
-            "confidence": round(confidence * 100, 2)
-        }
+    def _forward(self, batch):
+        if not self.backend.is_loaded:
+            self.load()
+        return self.backend.predict_proba(batch)
+
+    def _timed_forward(self, batch):
+        # Everything but warm_up(): the dummy pass would land in the slowest bucket
+        started = perf_counter()
+        probabilities = self._forward(batch)
+        observe_stage('forward', perf_counter() - started)
+        return probabilities
+
+    def predict_proba(self, batch):
+        """Class probabilities for a preprocessed batch"""
+        return self._timed_forward(batch)
+
+    def predict(self, image: InMemoryUploadedFile):
+        started = time.monotonic()
+        result = None
+        if self.shm_slots:
+            try:
+                result = self.postprocess(self._predict_shared(image))
+            except (RingFull, ModelServerError, TimeoutError, ConnectionError) as e:
+                # Ring full or the slot handoff failed (the server refused the
+                # slots, or timed out): the pixels can still go inline
+                logger.warning(f"Shared memory handoff failed ({e}); sending pixels over the socket instead")
+                if hasattr(image, 'seek'):
+                    image.seek(0)
+
+        if result is None:
+            processed_image = self.preprocess_image(image)
+            submitted = perf_counter()
+            probabilities = self.batcher.submit(processed_image[0])
+            observe_stage('inference', perf_counter() - submitted)
+            result = self.postprocess(probabilities)
+
+        # A sample of uploads also goes through the candidate model, later
+        shadow = get_shadow_evaluator()
+        if shadow is not None:
+            shadow.offer(image, result, time.monotonic() - started)
+        return result
+
+    def _shared_ring(self):
+        # One ring per process; a ring inherited through fork() belongs to the parent
+        if self._ring is None or self._ring_pid != os.getpid():
+            with self._ring_lock:
+                if self._ring is None or self._ring_pid != os.getpid():
+                    self._ring = SharedTensorRing.create(self.shm_slots, self.input_shape)
+                    self._ring_pid = os.getpid()
+                    atexit.register(self._ring.close)
+        return self._ring
+
+    def _predict_shared(self, image):
+        ring = self._shared_ring()
+        # Blocks while every slot is in flight (backpressure), then gives up
+        index = ring.acquire(timeout=5.0)
+        try:
+            self.preprocess_image(image, out=ring.array(index))
+            ring.mark_ready(index)
+            submitted = perf_counter()
+            probabilities = self.client.predict_slots(ring, [index])[0]
+            observe_stage('inference', perf_counter() - submitted)
+            return probabilities
+        finally:
+            ring.release(index)
+
+    def predict_arrays(self, batch):
+        """Run an already preprocessed ``(n, 256, 256, 3)`` batch in one forward pass.
+
+        Large batches go straight to the model instead of through the micro-batcher.
+        """
+        return self.postprocess_batch(self._timed_forward(batch))
+
+    def postprocess(self, probabilities):
+        started = perf_counter()
+        result = self.postprocess_batch(np.asarray(probabilities)[np.newaxis])[0]
+        observe_stage('postprocess', perf_counter() - started)
+        return result
+
+    def postprocess_batch(self, probabilities):
+        """Turn ``(n, classes)`` probabilities into one result dict per row.
+
+        Calibration and top-k selection run on the whole batch at once:
+        ``argpartition`` finds the k best classes per row in linear time and
+        only those k are sorted.
+        """
+        probabilities = apply_temperature(np.asarray(probabilities, dtype=np.float32), self.temperature)
+        k = min(self.top_k, probabilities.shape[1])
+        rows = np.arange(len(probabilities))[:, np.newaxis]
+        top = np.argpartition(probabilities, -k, axis=1)[:, -k:]
+        top = top[rows, np.argsort(-probabilities[rows, top], axis=1)]
+        top_confidences = np.round(probabilities[rows, top].astype(np.float64) * 100, 2).tolist()
+        uncertain = (probabilities[rows[:, 0], top[:, 0]] < self.confidence_threshold).tolist()
+
+        results = []
+        for indices, confidences, is_uncertain in zip(top.tolist(), top_confidences, uncertain):
+            labels = [self.labels[index] for index in indices]
+            top_k = [
+                {"class_name": label.class_name, "crop": label.crop, "disease": label.disease, "confidence": confidence}
+                for label, confidence in zip(labels, confidences)
+            ]
+            if is_uncertain:
+                class_name, crop, disease = "Uncertain / Not in dataset", "Unknown", "Unknown"
+            else:
+                class_name, crop, disease = labels[0].class_name, labels[0].crop, labels[0].disease
+            results.append({
+                "class_name": class_name,
+                "crop": crop,
+                "disease": disease,
+                "confidence": confidences[0],
+                "top_k": top_k,
+                "model_version": self.version,
+            })
+        return results
 
     def get_treatment_recommendations(self, crop, disease):
-        # Use the treatment dictionary from Gradio code
-        class_name = f"{crop}___{disease}" if crop and disease else "Unknown"
-        treatment_text = self.keras_treatments.get(class_name, "No specific treatment available.")
-        
-        # Return as a list with one treatment object (for compatibility with existing code)
-        return [type('Treatment', (), {
-            'title': f"Treatment for {crop} - {disease}",
-            'instructions': treatment_text,
-            'description': treatment_text,
-            'treatment_type': 'General',
-            'effectiveness': 'Medium'
-        })()]
\ No newline at end of file
+        # A list with one treatment record (for compatibility with existing code)
+        return [self.labels.treatment(crop, disease)]
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class DoctorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'doctor'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from .catalogue import invalidate_catalogue
+        from .models import Crop, CropTip, Disease, Treatment
+        from .search import sync_deleted, sync_saved
+
+        for model in (Crop, CropTip, Disease, Treatment):
+            post_save.connect(invalidate_catalogue, sender=model, dispatch_uid=f'catalogue-save-{model.__name__}')
+            post_delete.connect(invalidate_catalogue, sender=model, dispatch_uid=f'catalogue-delete-{model.__name__}')
+            post_save.connect(sync_saved, sender=model, dispatch_uid=f'search-save-{model.__name__}')
+            post_delete.connect(sync_deleted, sender=model, dispatch_uid=f'search-delete-{model.__name__}')
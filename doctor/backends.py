@@ -0,0 +1,195 @@
+import os
+import threading
+
+import numpy as np
+
+from .model_server import ModelClient
+
+INPUT_SHAPE = (256, 256, 3)
+
+
+class KerasBackend:
+    """The original ``.h5`` Keras model.
+
+    ``model.predict()`` builds a tf.data pipeline and a progress-bar callback
+    on every call, which costs more than the forward pass for a single image.
+    Instead the model is traced once into a ``tf.function`` over a fixed
+    ``(None,) + input_shape`` float32 signature, so every batch size reuses the
+    same graph. It returns probabilities only: calibration and top-k run on
+    them afterwards (AIPredictor.postprocess_batch), the same for every backend.
+    """
+
+    name = 'keras'
+    input_dtype = np.float32
+
+    def __init__(self, path, input_shape=INPUT_SHAPE):
+        self.path = path
+        self.input_shape = tuple(input_shape)
+        self.model = None
+        self._infer = None
+
+    @property
+    def is_loaded(self):
+        return self.model is not None
+
+    def load(self):
+        import tensorflow as tf
+
+        model = tf.keras.models.load_model(self.path)
+
+        @tf.function(input_signature=[tf.TensorSpec((None,) + self.input_shape, tf.float32)])
+        def infer(batch):
+            return model(batch, training=False)
+
+        infer.get_concrete_function()
+        self._infer = infer
+        self.model = model
+
+    @property
+    def num_classes(self):
+        return int(self.model.output_shape[-1])
+
+    def predict_proba(self, batch):
+        return self._infer(batch).numpy()
+
+
+class TFLiteBackend:
+    """A ``.tflite`` export, optionally float16 or int8 quantized.
+
+    Uses the standalone ``tflite_runtime`` interpreter when it is installed,
+    otherwise the one bundled with TensorFlow. The interpreter is not thread
+    safe, so calls are serialized.
+    """
+
+    name = 'tflite'
+    input_dtype = np.float32
+
+    def __init__(self, path, input_shape=INPUT_SHAPE):
+        self.path = path
+        self.input_shape = tuple(input_shape)
+        self.interpreter = None
+        self._lock = threading.Lock()
+        self._batch_size = None
+
+    @property
+    def is_loaded(self):
+        return self.interpreter is not None
+
+    def load(self):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=self.path, num_threads=os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+
+    @property
+    def num_classes(self):
+        return int(self._output['shape'][-1])
+
+    def predict_proba(self, batch):
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], list(batch.shape))
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = len(batch)
+
+            self.interpreter.set_tensor(self._input['index'], _quantize(batch, self._input))
+            self.interpreter.invoke()
+            return _dequantize(self.interpreter.get_tensor(self._output['index']), self._output)
+
+
+def _quantize(batch, details):
+    dtype = details['dtype']
+    if np.issubdtype(dtype, np.floating):
+        return batch.astype(dtype, copy=False)
+    scale, zero_point = details['quantization']
+    info = np.iinfo(dtype)
+    return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+
+def _dequantize(output, details):
+    if np.issubdtype(output.dtype, np.floating):
+        return output.astype(np.float32, copy=False)
+    scale, zero_point = details['quantization']
+    return (output.astype(np.float32) - zero_point) * scale
+
+
+class ONNXBackend:
+    """An ``.onnx`` export run with ONNX Runtime on the CPU"""
+
+    name = 'onnx'
+    input_dtype = np.float32
+
+    def __init__(self, path, input_shape=INPUT_SHAPE):
+        self.path = path
+        self.input_shape = tuple(input_shape)
+        self.session = None
+
+    @property
+    def is_loaded(self):
+        return self.session is not None
+
+    def load(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        self._input_name = self.session.get_inputs()[0].name
+
+    @property
+    def num_classes(self):
+        return int(self.session.get_outputs()[0].shape[-1])
+
+    def predict_proba(self, batch):
+        return self.session.run(None, {self._input_name: batch.astype(np.float32, copy=False)})[0]
+
+
+class RemoteBackend:
+    """Forward passes run by a `runmodelserver` process (see model_server)"""
+
+    name = 'remote'
+    input_dtype = np.uint8
+    is_loaded = True
+
+    def __init__(self, socket_path):
+        self.path = socket_path
+        self.client = ModelClient(socket_path)
+
+    def load(self):
+        pass
+
+    def predict_proba(self, batch):
+        return self.client.predict_proba(batch)
+
+
+BACKENDS = {
+    'keras': KerasBackend,
+    'tflite': TFLiteBackend,
+    'onnx': ONNXBackend,
+}
+
+ARTIFACT_EXTENSIONS = {
+    'keras': '.h5',
+    'tflite': '.tflite',
+    'onnx': '.onnx',
+}
+
+
+def artifact_path(model_path, backend):
+    """Where `export_model` writes, and the backend loads, the ``backend`` variant of ``model_path``"""
+    return os.path.splitext(model_path)[0] + ARTIFACT_EXTENSIONS[backend]
+
+
+def get_backend(name, model_path, input_shape=INPUT_SHAPE):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}; expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](artifact_path(model_path, name), input_shape)
@@ -0,0 +1,112 @@
+import hashlib
+import io
+import posixpath
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+
+class BatchUploadError(ValueError):
+    pass
+
+
+class BatchItem:
+    __slots__ = ('index', 'name', 'data', 'digest')
+
+    def __init__(self, index, name, data):
+        self.index = index
+        self.name = name
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+
+
+def read_uploads(files):
+    """Collect the images of a batch request.
+
+    Accepts any number of files under ``images`` (or ``image``); zip archives
+    among them are expanded. Enforces BATCH_CLASSIFY['MAX_IMAGES'] and
+    ['MAX_ARCHIVE_BYTES'] (total of the files and the uncompressed archive
+    members) before anything is read or decompressed.
+    """
+    config = settings.BATCH_CLASSIFY
+    max_images = config['MAX_IMAGES']
+    max_bytes = config['MAX_ARCHIVE_BYTES']
+    uploads = files.getlist('images') + files.getlist('image')
+
+    entries = []
+    size = 0
+    for upload in uploads:
+        if upload.name.lower().endswith('.zip') or upload.content_type in ('application/zip', 'application/x-zip-compressed'):
+            members = _read_archive(upload, max_bytes - size, max_images - len(entries))
+            size += sum(len(data) for _, data in members)
+            entries.extend(members)
+        else:
+            size += upload.size
+            if size > max_bytes:
+                raise BatchUploadError("The batch is too large")
+            entries.append((upload.name, upload.read()))
+        if len(entries) > max_images:
+            raise BatchUploadError(f"A batch may contain at most {max_images} images")
+
+    return [BatchItem(index, name, data) for index, (name, data) in enumerate(entries)]
+
+
+def _read_archive(upload, max_bytes, max_images):
+    try:
+        archive = zipfile.ZipFile(upload)
+    except zipfile.BadZipFile:
+        raise BatchUploadError(f"{upload.name} is not a valid zip archive")
+
+    with archive:
+        # Both limits are checked from the central directory, before any member is read
+        members = []
+        size = 0
+        for info in archive.infolist():
+            if (info.is_dir()
+                    or posixpath.splitext(info.filename)[1].lower() not in IMAGE_EXTENSIONS
+                    or posixpath.basename(info.filename).startswith('.')):
+                continue
+            members.append(info)
+            size += info.file_size
+            if len(members) > max_images:
+                raise BatchUploadError(f"A batch may contain at most {settings.BATCH_CLASSIFY['MAX_IMAGES']} images")
+            if size > max_bytes:
+                raise BatchUploadError(f"{upload.name} is too large once extracted")
+        return [(info.filename, archive.read(info)) for info in members]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def preprocess_pool():
+    """Thread pool for decoding batch images (PIL releases the GIL while decoding)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=settings.BATCH_CLASSIFY['PREPROCESS_THREADS'],
+                    thread_name_prefix='batch-preprocess',
+                )
+    return _pool
+
+
+def preprocess_parallel(buffer, items):
+    """Decode ``items`` into rows ``0..len(items)-1`` of ``buffer`` in parallel.
+
+    Returns ``{row: error message}`` for images that could not be decoded.
+    """
+    futures = {
+        preprocess_pool().submit(buffer.fill, row, io.BytesIO(item.data)): row
+        for row, item in enumerate(items)
+    }
+    errors = {}
+    for future in as_completed(futures):
+        if future.exception() is not None:
+            errors[futures[future]] = 'Could not read image'
+    return errors
@@ -0,0 +1,188 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+_STOP = object()
+
+
+class BatcherClosed(RuntimeError):
+    pass
+
+
+class BatchTimeout(TimeoutError):
+    pass
+
+
+class _Request:
+    __slots__ = ('tensor', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Groups single-image requests from concurrent threads into one forward pass.
+
+    ``forward`` receives a stacked ``(n, ...)`` array and must return an array
+    whose first dimension is ``n``; every caller gets back its own row. The
+    worker thread waits at most ``max_wait_ms`` after the first request of a
+    batch for more requests to arrive, and never builds batches larger than
+    ``max_batch_size``. A caller gives up with ``BatchTimeout`` after
+    ``timeout`` seconds without a result.
+    """
+
+    def __init__(self, forward, max_batch_size=16, max_wait_ms=5.0, timeout=60.0):
+        self.forward = forward
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.timeout = timeout
+        self.batch_size_histogram = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_histogram = Histogram(QUEUE_WAIT_BUCKETS)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._buffer = None
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    def submit(self, tensor):
+        """Run ``tensor`` (a single example, no batch axis) through the model"""
+        request = None
+        if self.max_batch_size > 1:
+            with self._close_lock:
+                if not self._closed:
+                    request = _Request(tensor)
+                    self._ensure_worker()
+                    self._queue.put(request)
+        if request is None:
+            self.queue_wait_histogram.observe(0.0)
+            self.batch_size_histogram.observe(1)
+            return self.forward(tensor[np.newaxis])[0]
+
+        if not request.done.wait(self.timeout):
+            raise BatchTimeout(f"No inference result within {self.timeout:g}s")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self):
+        """Stop the worker thread once the queued requests are done; later calls run unbatched"""
+        with self._close_lock:
+            self._closed = True
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                self._queue.put(_STOP)
+            else:
+                # No worker will ever pick these up
+                self._fail_pending()
+
+    def _fail_pending(self):
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if request is not _STOP:
+                request.error = BatcherClosed("The micro-batcher was closed before this request ran")
+                request.done.set()
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self._queue.qsize(),
+            'batch_size': self.batch_size_histogram.snapshot(),
+            'queue_wait_seconds': self.queue_wait_histogram.snapshot(),
+        }
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a batcher created in the gunicorn
+        # master has to start its own worker thread inside each worker process.
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        # Returns the batch and whether close() was called behind it
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # The window is over, but anything already queued still rides along
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _stack(self, batch):
+        sample = batch[0].tensor
+        shape = (self.max_batch_size,) + sample.shape
+        if self._buffer is None or self._buffer.shape != shape or self._buffer.dtype != sample.dtype:
+            self._buffer = np.empty(shape, dtype=sample.dtype)
+        for index, request in enumerate(batch):
+            np.copyto(self._buffer[index], request.tensor)
+        return self._buffer[:len(batch)]
+
+    def _run(self):
+        try:
+            while True:
+                batch, stop = self._collect()
+                if batch:
+                    self._run_batch(batch)
+                if stop:
+                    return
+        finally:
+            # Normally empty; requests must not outlive the thread that would answer them
+            self._fail_pending()
+
+    def _run_batch(self, batch):
+        started = time.monotonic()
+        for request in batch:
+            self.queue_wait_histogram.observe(started - request.enqueued_at)
+        self.batch_size_histogram.observe(len(batch))
+
+        try:
+            outputs = self.forward(self._stack(batch))
+        except Exception as exc:
+            logger.error(f"Batched inference failed for {len(batch)} request(s): {exc}")
+            for request in batch:
+                request.error = exc
+                request.done.set()
+            return
+
+        for index, request in enumerate(batch):
+            request.result = outputs[index]
+            request.done.set()
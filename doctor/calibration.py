@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_EPSILON = 1e-7
+
+
+def apply_temperature(probabilities, temperature):
+    """Rescale softmax outputs ``(n, classes)`` as if the logits were divided by ``temperature``.
+
+    The model only exposes probabilities, but ``log(p)`` differs from the
+    logits by a per-row constant, which softmax ignores.
+    """
+    if temperature == 1.0:
+        return probabilities
+    logits = np.log(np.maximum(probabilities, _EPSILON)) / np.float32(temperature)
+    logits -= logits.max(axis=1, keepdims=True)
+    np.exp(logits, out=logits)
+    logits /= logits.sum(axis=1, keepdims=True)
+    return logits
+
+
+def negative_log_likelihood(probabilities, labels, temperature=1.0):
+    calibrated = apply_temperature(probabilities, temperature)
+    return float(-np.mean(np.log(np.maximum(calibrated[np.arange(len(labels)), labels], _EPSILON))))
+
+
+def fit_temperature(probabilities, labels, low=0.05, high=20.0, iterations=60):
+    """Temperature minimizing the NLL of ``labels``, by golden-section search on log(T)"""
+    ratio = (np.sqrt(5) - 1) / 2
+    a, b = np.log(low), np.log(high)
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    nll_c = negative_log_likelihood(probabilities, labels, np.exp(c))
+    nll_d = negative_log_likelihood(probabilities, labels, np.exp(d))
+    for _ in range(iterations):
+        if nll_c < nll_d:
+            b, d, nll_d = d, c, nll_c
+            c = b - ratio * (b - a)
+            nll_c = negative_log_likelihood(probabilities, labels, np.exp(c))
+        else:
+            a, c, nll_c = c, d, nll_d
+            d = a + ratio * (b - a)
+            nll_d = negative_log_likelihood(probabilities, labels, np.exp(d))
+    return float(np.exp((a + b) / 2))
+
+
+def load_temperature(path):
+    """Temperature stored by `manage.py calibrate_model`, or 1.0 (no calibration)"""
+    if not path or not os.path.exists(path):
+        return 1.0
+    try:
+        with open(path) as f:
+            return float(json.load(f)['temperature'])
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable calibration file {path}: {e}")
+        return 1.0
+
+
+def save_calibration(path, temperature, **details):
+    with open(path, 'w') as f:
+        json.dump({'temperature': temperature, **details}, f, indent=2)
@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .labels import normalize
+from .models import Crop, Disease, Treatment
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_treatments(treatments):
+    return [{
+        'title': t.title,
+        'description': getattr(t, 'description', ''),  # Safe for missing field
+        'treatment_type': getattr(t, 'treatment_type', ''),
+        'effectiveness': getattr(t, 'effectiveness', ''),
+        'instructions': t.instructions,
+    } for t in treatments]
+
+
+def serialize_tips(tips):
+    return [{
+        'title': tip.title,
+        'content': tip.content,
+        'tip_type': tip.tip_type,
+        'season': tip.season
+    } for tip in tips]
+
+
+class CatalogueCache:
+    """Read-through cache of the serialized treatments and crop tips sent with predictions.
+
+    The first lookup loads the catalogue in five queries: the tips of every
+    crop, the Treatment rows of every disease, and the Crop, Disease and
+    Treatment ids of every model class, which are bound to the predictor's
+    label registry. After that a fragment or the ids of a class are a dict
+    or list lookup. A class whose Disease has no Treatment rows gets the
+    built-in advice of its label instead. Saving or deleting a Crop, CropTip, Disease
+    or Treatment clears the cache of that process (see ``apps.ready``); other
+    processes pick the change up within ``ttl`` seconds.
+
+    Fragments are shared between requests and must not be modified.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tips = None
+        self._treatments = {}
+        self._loaded_at = None
+        self._fragments = {}
+        self._generation = 0
+        self.loads = 0
+
+    def fragment(self, crop, disease):
+        """``{'treatments': [...], 'crop_tips': [...]}`` for a predicted class"""
+        from .model_registry import get_predictor
+
+        tips = self._tips_by_crop()
+        treatments_by_disease = self._treatments
+        predictor = get_predictor()
+        # Versions may label the same (crop, disease) with other catalogue rows
+        key = (predictor.version, crop, disease)
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            label = predictor.labels.lookup(crop, disease)
+            treatments = treatments_by_disease.get(label.disease_id) if label is not None else None
+            if treatments is None:
+                treatments = serialize_treatments(predictor.get_treatment_recommendations(crop, disease))
+            fragment = {
+                'treatments': treatments,
+                'crop_tips': tips.get(crop.strip().lower(), []),
+            }
+            with self._lock:
+                # Only keep it if the catalogue wasn't reloaded meanwhile
+                if tips is self._tips:
+                    self._fragments[key] = fragment
+        return fragment
+
+    def ids(self, class_name):
+        """``(crop_id, disease_id, treatment_id)`` of a model class; each may be None"""
+        from .model_registry import get_predictor
+
+        self._tips_by_crop()
+        label = get_predictor().labels.get(class_name)
+        if label is None:
+            return None, None, None
+        return label.crop_id, label.disease_id, label.treatment_id
+
+    def crop_tips(self, crop):
+        return self._tips_by_crop().get(crop.strip().lower(), [])
+
+    def warm(self):
+        self._tips_by_crop()
+
+    def bind(self, labels):
+        """Resolve the catalogue ids of ``labels``, e.g. of a model version about to be swapped in"""
+        crop_ids = {}
+        for crop_id, name in Crop.objects.order_by('id').values_list('id', 'name'):
+            crop_ids.setdefault(normalize(name), crop_id)
+        labels.bind(label_ids(labels, crop_ids))
+
+    def invalidate(self):
+        with self._lock:
+            self._tips = None
+            self._treatments = {}
+            self._fragments = {}
+            self._generation += 1
+
+    def stats(self):
+        return {
+            'loaded': self._tips is not None,
+            'crops': len(self._tips or ()),
+            'fragments': len(self._fragments),
+            'loads': self.loads,
+        }
+
+    def _tips_by_crop(self):
+        tips = self._tips
+        if tips is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return tips
+
+        from .model_registry import get_predictor
+
+        generation = self._generation
+        tips = {}
+        crop_ids = {}
+        for crop in Crop.objects.prefetch_related('tips').order_by('id'):
+            # Matches the old Crop.objects.get(name__iexact=...) lookup
+            tips.setdefault(crop.name.strip().lower(), serialize_tips(crop.tips.all()))
+            crop_ids.setdefault(normalize(crop.name), crop.id)
+        treatments = {}
+        for treatment in Treatment.objects.order_by('id'):
+            treatments.setdefault(treatment.disease_id, []).append(treatment)
+        treatments = {disease_id: serialize_treatments(rows) for disease_id, rows in treatments.items()}
+        labels = get_predictor().labels
+        ids = label_ids(labels, crop_ids)
+        with self._lock:
+            # A change saved while loading means this snapshot may already be stale
+            if generation == self._generation:
+                labels.bind(ids)
+                self._tips = tips
+                self._treatments = treatments
+                self._loaded_at = time.monotonic()
+                self._fragments = {}
+            self.loads += 1
+        logger.info(f"Loaded catalogue tips for {len(tips)} crops")
+        return tips
+
+
+def label_ids(labels, crop_ids):
+    """``(crop_id, disease_id, treatment_id)`` for every label, from two queries.
+
+    Disease rows are named after the model class; a class without one still
+    gets the id of a Crop with the same name.
+    """
+    diseases = {}
+    for disease_id, name, crop_id in Disease.objects.order_by('id').values_list('id', 'name', 'crop_id'):
+        diseases.setdefault(normalize(name), (crop_id, disease_id))
+    treatments = {}
+    for treatment_id, disease_id in Treatment.objects.order_by('id').values_list('id', 'disease_id'):
+        treatments.setdefault(disease_id, treatment_id)
+
+    ids = []
+    for label in labels:
+        crop_id, disease_id = diseases.get(normalize(label.class_name), (crop_ids.get(normalize(label.crop)), None))
+        ids.append((crop_id, disease_id, treatments.get(disease_id)))
+    return ids
+
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+
+def get_catalogue():
+    global _catalogue
+    if _catalogue is None:
+        with _catalogue_lock:
+            if _catalogue is None:
+                _catalogue = CatalogueCache(ttl=settings.CATALOGUE_CACHE_TTL)
+    return _catalogue
+
+
+def invalidate_catalogue(sender, **kwargs):
+    """post_save/post_delete receiver for the catalogue models"""
+    get_catalogue().invalidate()
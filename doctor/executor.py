@@ -0,0 +1,102 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+class InferenceExecutor:
+    """Bounded thread pool that async views hand preprocessing and inference to.
+
+    At most ``max_workers`` jobs run at once and at most ``max_pending`` more
+    may wait for a thread; beyond that ``run()`` raises ExecutorBusy straight
+    away so the view can answer 503 instead of queueing without limit. The
+    event loop itself never blocks on the model, so pages that don't predict
+    keep being served while inference is saturated.
+    """
+
+    def __init__(self, max_workers=4, max_pending=32):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        # Notified whenever the last running job finishes (see wait_idle())
+        self._idle = threading.Condition(self._lock)
+        self._pool = None
+        self._pid = None
+        self._in_flight = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args, admit=True):
+        """Run ``fn(*args)`` on the pool and await its result.
+
+        ``admit=False`` skips the admission check, for follow-up work of a job
+        that was already admitted (e.g. the next chunk of a streamed batch).
+        """
+        with self._lock:
+            if admit and self._in_flight >= self.max_workers + self.max_pending:
+                self.rejected += 1
+                raise ExecutorBusy()
+            self._in_flight += 1
+            pool = self._get_pool()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, self._call, fn, args)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                if not self._in_flight:
+                    self._idle.notify_all()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def wait_idle(self, timeout=None):
+        """Block until no job is running or waiting; False if ``timeout`` passed first"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._in_flight, timeout)
+
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'in_flight': self._in_flight,
+            'rejected': self.rejected,
+        }
+
+    def _get_pool(self):
+        if self._pool is None or self._pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='inference')
+            self._pid = os.getpid()
+        return self._pool
+
+    @staticmethod
+    def _call(fn, args):
+        # Pool threads outlive requests, so they look after their own DB connections
+        close_old_connections()
+        try:
+            return fn(*args)
+        finally:
+            close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                config = settings.INFERENCE_EXECUTOR
+                _executor = InferenceExecutor(
+                    max_workers=config['MAX_WORKERS'],
+                    max_pending=config['MAX_PENDING'],
+                )
+    return _executor
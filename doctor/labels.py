@@ -0,0 +1,137 @@
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Treatment advice per model class (matching the Gradio app)
+TREATMENTS = {
+    'Apple___Apple_scab': "Remove fallen leaves and prune infected branches. Apply fungicides containing captan or myclobutanil.",
+    'Apple___Black_rot': "Prune out dead branches. Spray copper-based fungicide during early fruit development.",
+    'Apple___Cedar_apple_rust': "Remove nearby juniper trees. Apply fungicides before bud break.",
+    'Apple___healthy': "No action required. The plant is healthy.",
+    'Blueberry___healthy': "No action required. The plant is healthy.",
+    'Cherry___Powdery_mildew': "Apply sulfur-based fungicide. Ensure good air circulation around the plant.",
+    'Cherry___healthy': "No action required. The plant is healthy.",
+    'Corn___Cercospora_leaf_spot Gray_leaf_spot': "Rotate crops to avoid build-up of pathogens. Use resistant hybrids and apply foliar fungicides.",
+    'Corn___Common_rust': "Plant rust-resistant hybrids. Apply fungicides at the first sign of rust.",
+    'Corn___Northern_Leaf_Blight': "Use resistant varieties and apply fungicides when lesions are observed.",
+    'Corn___healthy': "No action required. The plant is healthy.",
+    'Grape___Black_rot': "Remove and destroy infected leaves and fruits. Apply fungicides containing myclobutanil or captan.",
+    'Grape___Esca_(Black_Measles)': "Prune and destroy infected wood. Apply fungicides during the growing season.",
+    'Grape___Leaf_blight_(Isariopsis_Leaf_Spot)': "Maintain good air circulation. Spray protective fungicides like mancozeb.",
+    'Grape___healthy': "No action required. The plant is healthy.",
+    'Orange___Haunglongbing_(Citrus_greening)': "Remove and destroy infected trees. Control psyllid vectors with insecticides.",
+    'Peach___Bacterial_spot': "Apply copper-based bactericides. Use resistant varieties and avoid overhead irrigation.",
+    'Peach___healthy': "No action required. The plant is healthy.",
+    'Pepper,_bell___Bacterial_spot': "Apply copper-based sprays. Use certified seeds and avoid overhead irrigation.",
+    'Pepper,_bell___healthy': "No action required. The plant is healthy.",
+    'Potato___Early_blight': "Use certified seeds and apply preventative fungicides like chlorothalonil.",
+    'Potato___Late_blight': "Plant disease-free tubers and use fungicides containing metalaxyl.",
+    'Potato___healthy': "No action required. The plant is healthy.",
+    'Raspberry___healthy': "No action required. The plant is healthy.",
+    'Soybean___healthy': "No action required. The plant is healthy.",
+    'Squash___Powdery_mildew': "Use sulfur-based fungicides and ensure good ventilation.",
+    'Strawberry___Leaf_scorch': "Remove infected leaves. Apply fungicides containing myclobutanil.",
+    'Strawberry___healthy': "No action required. The plant is healthy.",
+    'Tomato___Bacterial_spot': "Apply copper-based sprays. Avoid overhead watering.",
+    'Tomato___Early_blight': "Prune infected leaves and apply fungicides containing chlorothalonil or mancozeb.",
+    'Tomato___Late_blight': "Remove infected plants. Apply fungicides containing chlorothalonil or metalaxyl.",
+    'Tomato___Leaf_Mold': "Ensure good ventilation and apply fungicides like mancozeb.",
+    'Tomato___Septoria_leaf_spot': "Remove infected leaves and apply fungicides containing chlorothalonil.",
+    'Tomato___Spider_mites Two-spotted_spider_mite': "Spray insecticidal soap or neem oil. Maintain humidity levels.",
+    'Tomato___Target_Spot': "Use resistant varieties. Apply fungicides containing chlorothalonil.",
+    'Tomato___Tomato_Yellow_Leaf_Curl_Virus': "Remove infected plants. Use resistant varieties and control whitefly vectors.",
+    'Tomato___Tomato_mosaic_virus': "Remove infected plants and disinfect tools. Use resistant seed varieties.",
+    'Tomato___healthy': "No action required. The plant is healthy.",
+    'Unknown': "No specific treatment available."
+}
+
+DEFAULT_TREATMENT = "No specific treatment available."
+
+
+def normalize(name):
+    """Compare class and catalogue names ignoring case and separators ('Pepper,_bell' == 'Pepper__bell')"""
+    return re.sub(r'[^a-z0-9]+', ' ', name.lower()).strip()
+
+
+class TreatmentAdvice:
+    __slots__ = ('title', 'instructions', 'description', 'treatment_type', 'effectiveness')
+
+    def __init__(self, crop, disease, instructions):
+        self.title = f"Treatment for {crop} - {disease}"
+        self.instructions = instructions
+        self.description = instructions
+        self.treatment_type = 'General'
+        self.effectiveness = 'Medium'
+
+
+class Label:
+    """Everything post-processing needs to know about one model output"""
+
+    __slots__ = ('index', 'class_name', 'crop', 'disease', 'treatment', 'crop_id', 'disease_id', 'treatment_id')
+
+    def __init__(self, index, class_name):
+        self.index = index
+        self.class_name = class_name
+        if "___" in class_name:
+            self.crop, self.disease = class_name.split("___", 1)
+        else:
+            self.crop, self.disease = class_name, ""
+        self.treatment = TreatmentAdvice(
+            self.crop, self.disease, TREATMENTS.get(class_name if self.disease else "Unknown", DEFAULT_TREATMENT))
+        # Catalogue rows for this class, when the database has them
+        self.crop_id = self.disease_id = self.treatment_id = None
+
+
+class LabelRegistry:
+    """Index-aligned labels of the model's outputs.
+
+    Built once from ``settings.CLASS_NAMES`` so that turning a class index
+    into a crop, disease and treatment is a single list lookup.
+    """
+
+    def __init__(self, class_names):
+        self.labels = [Label(index, class_name) for index, class_name in enumerate(class_names)]
+        self._by_name = {label.class_name: label for label in self.labels}
+        self._by_pair = {(label.crop, label.disease): label for label in self.labels}
+        self._unknown = TreatmentAdvice("Unknown", "Unknown", DEFAULT_TREATMENT)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        return self.labels[index]
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def get(self, class_name):
+        return self._by_name.get(class_name)
+
+    def lookup(self, crop, disease):
+        return self._by_pair.get((crop, disease))
+
+    def treatment(self, crop, disease):
+        label = self._by_pair.get((crop, disease))
+        if label is not None:
+            return label.treatment
+        if (crop, disease) == ("Unknown", "Unknown"):
+            return self._unknown
+        class_name = f"{crop}___{disease}" if crop and disease else "Unknown"
+        return TreatmentAdvice(crop, disease, TREATMENTS.get(class_name, DEFAULT_TREATMENT))
+
+    def bind(self, ids):
+        """Attach catalogue ids: ``ids[index]`` is ``(crop_id, disease_id, treatment_id)``"""
+        for label, (crop_id, disease_id, treatment_id) in zip(self.labels, ids):
+            label.crop_id, label.disease_id, label.treatment_id = crop_id, disease_id, treatment_id
+
+    def check(self, num_classes):
+        """Fail fast if the model's output doesn't line up with the labels"""
+        if num_classes != len(self.labels):
+            raise ImproperlyConfigured(
+                f"Model has {num_classes} outputs but settings.CLASS_NAMES has {len(self.labels)} labels"
+            )
+
+
+def build_registry(class_names=None):
+    return LabelRegistry(settings.CLASS_NAMES if class_names is None else class_names)
@@ -0,0 +1,33 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from doctor import model_registry
+
+
+class Command(BaseCommand):
+    help = "Switch the model version every worker serves, or list the registered versions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('version', nargs='?', help="Registered version to serve (omit to list versions)")
+
+    def handle(self, *args, **options):
+        if not options['version']:
+            active = model_registry.active_version()
+            for version in model_registry.versions():
+                try:
+                    manifest = model_registry.load_manifest(version)
+                    details = f"{len(manifest.class_names)} classes, input {manifest.input_size[0]}x{manifest.input_size[1]}"
+                except ImproperlyConfigured as e:
+                    details = f"invalid: {e}"
+                self.stdout.write(f"{'*' if version == active else ' '} {version}  {details}")
+            if active is None:
+                self.stdout.write(f"No active version; serving {model_registry.DEFAULT_MODEL_PATH}")
+            return
+
+        try:
+            model_registry.activate(options['version'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Activated {options['version']}; workers swap it in within MODEL_RELOAD_INTERVAL seconds"
+        ))
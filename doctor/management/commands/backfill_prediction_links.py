@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from doctor.catalogue import label_ids
+from doctor.labels import build_registry, normalize
+from doctor.model_registry import load_manifest
+from doctor.models import Crop, Prediction
+
+
+class Command(BaseCommand):
+    help = "Fill the crop, disease and treatment foreign keys of existing predictions from their predicted class"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--overwrite', action='store_true', help="Also update rows that already have a crop")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        # The classes of the version being served, which may differ from settings.CLASS_NAMES
+        labels = build_registry(load_manifest().class_names)
+        crop_ids = {}
+        for crop_id, name in Crop.objects.order_by('id').values_list('id', 'name'):
+            crop_ids.setdefault(normalize(name), crop_id)
+        ids_by_class = {
+            normalize(f"{label.crop} {label.disease}"): ids
+            for label, ids in zip(labels, label_ids(labels, crop_ids))
+        }
+
+        queryset = Prediction.objects.order_by('pk')
+        if not options['overwrite']:
+            queryset = queryset.filter(crop__isnull=True)
+
+        last_pk = 0
+        scanned = updated = 0
+        while True:
+            # Keyset pagination keeps every chunk an index range scan
+            chunk = list(
+                queryset.filter(pk__gt=last_pk)
+                .only('pk', 'predicted_crop', 'predicted_disease', 'crop_id', 'disease_id', 'treatment_id')
+                [:options['chunk_size']]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            scanned += len(chunk)
+
+            changed = []
+            for prediction in chunk:
+                ids = ids_by_class.get(normalize(f"{prediction.predicted_crop} {prediction.predicted_disease}"))
+                if ids is None or ids[0] is None:
+                    continue
+                if (prediction.crop_id, prediction.disease_id, prediction.treatment_id) != ids:
+                    prediction.crop_id, prediction.disease_id, prediction.treatment_id = ids
+                    changed.append(prediction)
+
+            if changed and not options['dry_run']:
+                with transaction.atomic():
+                    Prediction.objects.bulk_update(changed, ['crop', 'disease', 'treatment'])
+            updated += len(changed)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Scanned {scanned} predictions, {updated} linked")
+
+        verb = "Would link" if options['dry_run'] else "Linked"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {updated} of {scanned} scanned predictions"))
@@ -0,0 +1,86 @@
+import multiprocessing
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from doctor.shm_ring import SharedTensorRing
+
+SHAPE = (256, 256, 3)
+_SCALE = np.float32(1.0 / 255.0)
+
+
+def _pickle_consumer(conn):
+    batch = np.empty(SHAPE, dtype=np.float32)
+    while True:
+        image = conn.recv()
+        if image is None:
+            return
+        np.copyto(batch, image)
+        conn.send(True)
+
+
+def _shm_consumer(conn, name, slots):
+    ring = SharedTensorRing.attach(name, slots, SHAPE, track=True)
+    batch = np.empty(SHAPE, dtype=np.float32)
+    views = None
+    while True:
+        index = conn.recv()
+        if index is None:
+            break
+        views = ring.read([index])
+        np.multiply(views[0], _SCALE, out=batch, casting='unsafe')
+        ring.finish([index])
+        conn.send(True)
+    del views
+    ring.close()
+
+
+class Command(BaseCommand):
+    help = "Compare handing preprocessed images to another process via pickle vs the shared-memory ring"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500)
+        parser.add_argument('--slots', type=int, default=16)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        pixels = np.random.default_rng(0).integers(0, 256, SHAPE, dtype=np.uint8)
+
+        # Baseline: the float32 tensor (~786 KB) is pickled through a pipe
+        image = pixels.astype(np.float32) * _SCALE
+        parent, child = multiprocessing.Pipe()
+        consumer = multiprocessing.Process(target=_pickle_consumer, args=(child,))
+        consumer.start()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            parent.send(image)
+            parent.recv()
+        pickle_seconds = time.perf_counter() - started
+        parent.send(None)
+        consumer.join()
+
+        # Shared memory: uint8 pixels are written into a slot; only its index is sent
+        ring = SharedTensorRing.create(options['slots'], SHAPE)
+        parent, child = multiprocessing.Pipe()
+        consumer = multiprocessing.Process(target=_shm_consumer, args=(child, ring.name, ring.slots))
+        consumer.start()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            index = ring.acquire(timeout=5.0)
+            np.copyto(ring.array(index), pixels)
+            ring.mark_ready(index)
+            parent.send(index)
+            parent.recv()
+            ring.release(index)
+        shm_seconds = time.perf_counter() - started
+        parent.send(None)
+        consumer.join()
+        ring.close()
+
+        for label, seconds in (('pickle (float32)', pickle_seconds), ('shared memory (uint8)', shm_seconds)):
+            self.stdout.write(
+                f"{label:>22}: {seconds / iterations * 1e6:8.1f} us/image, "
+                f"{iterations / seconds:8.0f} images/s"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Shared memory handoff is {pickle_seconds / shm_seconds:.1f}x faster"))
@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from doctor.backends import KerasBackend
+from doctor.model_registry import ModelManifest, load_manifest
+
+
+def per_call_ms(fn, batch, iterations):
+    fn(batch)  # warm-up (tracing, allocations)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(batch)
+    return (time.perf_counter() - started) / iterations * 1e3
+
+
+class Command(BaseCommand):
+    help = "Compare per-call latency of Keras model.predict() with the traced tf.function inference path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', help="Keras model file (default: the active model version)")
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--batch-sizes', default='1,4,16', help="Comma separated batch sizes")
+
+    def handle(self, *args, **options):
+        try:
+            import tensorflow  # noqa: F401
+        except ImportError:
+            raise CommandError("This benchmark requires tensorflow")
+
+        manifest = ModelManifest.legacy(options['model']) if options['model'] else load_manifest()
+        backend = KerasBackend(manifest.model_path, manifest.input_shape)
+        backend.load()
+        rng = np.random.default_rng(0)
+        paths = (
+            ('model.predict()', lambda batch: backend.model.predict(batch, verbose=0)),
+            ('model(batch)', lambda batch: backend.model(batch, training=False).numpy()),
+            ('tf.function', backend.predict_proba),
+        )
+
+        self.stdout.write(f"{'batch':>5}  " + "  ".join(f"{label:>16}" for label, _ in paths) + "   speedup")
+        for batch_size in (int(size) for size in options['batch_sizes'].split(',')):
+            batch = rng.random((batch_size,) + manifest.input_shape, dtype=np.float32)
+            timings = [per_call_ms(fn, batch, options['iterations']) for _, fn in paths]
+            self.stdout.write(
+                f"{batch_size:>5}  " + "  ".join(f"{ms:>13.2f} ms" for ms in timings)
+                + f"   {timings[0] / timings[-1]:6.1f}x"
+            )
@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from doctor import search
+from doctor.models import Crop, Disease, SearchDocument
+
+
+class Rollback(Exception):
+    pass
+
+
+def legacy_search(query):
+    # The query diseases_list used to run (minus the removed description column)
+    return list(
+        Disease.objects.select_related('crop')
+        .filter(Q(name__icontains=query) | Q(crop__name__icontains=query))
+        .order_by('crop__name', 'name')[:100]
+    )
+
+
+def per_query_ms(fn, queries, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for query in queries:
+            fn(query)
+    return (time.perf_counter() - started) / (iterations * len(queries)) * 1e3
+
+
+class Command(BaseCommand):
+    help = "Compare the full-text disease search with the old icontains query"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--queries', default='tomato,blight,late blight,bacterial spot,mildew,pep')
+        parser.add_argument(
+            '--synthetic', type=int, default=0,
+            help="Temporarily add this many generated diseases (rolled back afterwards)",
+        )
+
+    def handle(self, *args, **options):
+        queries = [query.strip() for query in options['queries'].split(',') if query.strip()]
+        try:
+            with transaction.atomic():
+                if options['synthetic']:
+                    self.generate(options['synthetic'])
+                self.run(queries, options['iterations'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def generate(self, count):
+        words = ['leaf', 'spot', 'blight', 'rust', 'mosaic', 'virus', 'rot', 'wilt', 'mildew', 'canker', 'scab']
+        crops = [Crop.objects.create(name=f"Synthetic crop {index}") for index in range(max(1, count // 50))]
+        diseases = Disease.objects.bulk_create([
+            Disease(
+                crop=crops[index % len(crops)],
+                name=f"{words[index % len(words)]}_{words[(index // 7) % len(words)]}_{index}",
+            )
+            for index in range(count)
+        ], batch_size=500)
+        search.rebuild()
+        self.stdout.write(f"Added {len(diseases)} synthetic diseases")
+
+    def run(self, queries, iterations):
+        kinds = [SearchDocument.KIND_DISEASE, SearchDocument.KIND_TREATMENT]
+        legacy_ms = per_query_ms(legacy_search, queries, iterations)
+        fts_ms = per_query_ms(lambda query: search.search(query, limit=100, kinds=kinds), queries, iterations)
+        self.stdout.write(f"{Disease.objects.count()} diseases, {len(queries)} queries x {iterations}")
+        self.stdout.write(f"  icontains: {legacy_ms:8.3f} ms/query")
+        self.stdout.write(f"  full-text: {fts_ms:8.3f} ms/query ({legacy_ms / fts_ms:.1f}x)")
+        for query in queries:
+            hits = search.search(query, limit=3, kinds=kinds)
+            self.stdout.write(f"  {query!r}: " + ', '.join(hit.title for hit in hits))
@@ -0,0 +1,267 @@
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from doctor.management.commands.export_model import find_images
+from doctor.preprocessing import BatchBuffer, decode_image, resize_image, write_pixels
+
+STAGES = ('decode', 'resize', 'normalize', 'forward', 'postprocess', 'total')
+
+# For the baseline diff: +1 when a larger value is better, -1 when smaller is
+HIGHER_IS_BETTER, LOWER_IS_BETTER = 1, -1
+
+
+def summarize(seconds):
+    ms = np.asarray(seconds, dtype=np.float64) * 1e3
+    return {
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def flatten(report):
+    """``{metric name: (value, direction)}`` of the numbers worth comparing between runs"""
+    metrics = {}
+    for stage, summary in report['stages'].items():
+        for name in ('p50_ms', 'p95_ms', 'p99_ms'):
+            metrics[f"{stage}.{name}"] = (summary[name], LOWER_IS_BETTER)
+    for run in report['throughput']:
+        metrics[f"throughput.batch{run['batch_size']}.threads{run['threads']}"] = (
+            run['images_per_second'], HIGHER_IS_BETTER)
+    metrics['peak_rss_mb'] = (report['peak_rss_mb'], LOWER_IS_BETTER)
+    for name, value in (report.get('accuracy') or {}).items():
+        if name.startswith('top1'):
+            metrics[f"accuracy.{name}"] = (value, HIGHER_IS_BETTER)
+    return metrics
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a directory of images through preprocessing, inference and post-processing and report "
+        "per-stage latency, throughput, peak RSS and accuracy; optionally compare with a baseline JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--images', default=os.path.join(settings.MEDIA_ROOT, 'predictions'),
+            help="Directory of images; sub-folders named after a model class count towards accuracy",
+        )
+        parser.add_argument('--limit', type=int, default=500, help="Maximum number of images")
+        parser.add_argument('--repeat', type=int, default=3, help="Passes over the images for the latency runs")
+        parser.add_argument('--batch-sizes', default='1,8,32')
+        parser.add_argument('--threads', default='1,2,4')
+        parser.add_argument('--min-images', type=int, default=256,
+                            help="Images per throughput run (the corpus is cycled to reach it)")
+        parser.add_argument('--preprocess-only', action='store_true',
+                            help="Skip the model: benchmark decode, resize and normalize only")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--baseline', help="JSON file of an earlier run to compare with")
+        parser.add_argument('--tolerance', type=float, default=0.10,
+                            help="Relative change beyond which a metric counts as a regression (default 0.10)")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        paths = find_images(options['images'], options['limit'])
+        if not paths:
+            raise CommandError(f"No images in {options['images']}")
+        # Replayed from memory, so disk speed doesn't show up in the numbers
+        corpus = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                corpus.append((path, f.read()))
+
+        predictor = None
+        if not options['preprocess_only']:
+            from doctor.model_registry import get_predictor
+
+            predictor = get_predictor()
+            predictor.load()
+            predictor.warm_up()
+        input_shape = predictor.input_shape if predictor else (256, 256, 3)
+        dtype = predictor.input_dtype if predictor else np.float32
+
+        report = {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'images': len(corpus),
+            'model': {
+                'version': predictor.version,
+                'backend': predictor.backend.name,
+                'path': predictor.backend.path,
+            } if predictor else None,
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+        }
+        report['stages'] = self.stage_latency(corpus, predictor, input_shape, dtype, options['repeat'])
+        report['throughput'] = self.throughput(
+            corpus, predictor, input_shape, dtype,
+            [int(size) for size in options['batch_sizes'].split(',')],
+            [int(count) for count in options['threads'].split(',')],
+            options['min_images'],
+        )
+        report['accuracy'] = self.accuracy(corpus, predictor, input_shape, dtype) if predictor else None
+        report['peak_rss_mb'] = peak_rss_mb()
+        self.print_report(report)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline, report, options['tolerance'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} metric(s) regressed: {', '.join(regressions)}")
+
+    def stage_latency(self, corpus, predictor, input_shape, dtype, repeat):
+        size = input_shape[1::-1]
+        out = np.empty((1,) + input_shape, dtype=dtype)
+        timings = {stage: [] for stage in STAGES}
+        # The first pass only warms up caches and allocations
+        for pass_ in range(repeat + 1):
+            if pass_ == 1:
+                timings = {stage: [] for stage in STAGES}
+            for _, data in corpus:
+                t0 = time.perf_counter()
+                img = decode_image(io.BytesIO(data), size)
+                t1 = time.perf_counter()
+                img = resize_image(img, size)
+                t2 = time.perf_counter()
+                write_pixels(img, out[0])
+                t3 = time.perf_counter()
+                timings['decode'].append(t1 - t0)
+                timings['resize'].append(t2 - t1)
+                timings['normalize'].append(t3 - t2)
+                if predictor is not None:
+                    probabilities = predictor.predict_proba(out)
+                    t4 = time.perf_counter()
+                    predictor.postprocess_batch(probabilities)
+                    t5 = time.perf_counter()
+                    timings['forward'].append(t4 - t3)
+                    timings['postprocess'].append(t5 - t4)
+                timings['total'].append(time.perf_counter() - t0)
+        return {stage: summarize(values) for stage, values in timings.items() if values}
+
+    def throughput(self, corpus, predictor, input_shape, dtype, batch_sizes, thread_counts, min_images):
+        runs = []
+        count = max(min_images, len(corpus))
+        for batch_size in batch_sizes:
+            for threads in thread_counts:
+                per_thread = -(-count // threads)
+
+                def work(offset):
+                    buffer = BatchBuffer(batch_size, input_shape[1::-1], dtype)
+                    done = 0
+                    while done < per_thread:
+                        n = min(batch_size, per_thread - done)
+                        for row in range(n):
+                            buffer.fill(row, io.BytesIO(corpus[(offset + done + row) % len(corpus)][1]))
+                        if predictor is not None:
+                            predictor.predict_arrays(buffer.batch(n))
+                        done += n
+
+                workers = [threading.Thread(target=work, args=(index * per_thread,)) for index in range(threads)]
+                started = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                seconds = time.perf_counter() - started
+                runs.append({
+                    'batch_size': batch_size,
+                    'threads': threads,
+                    'images': per_thread * threads,
+                    'images_per_second': per_thread * threads / seconds,
+                })
+        return runs
+
+    def accuracy(self, corpus, predictor, input_shape, dtype):
+        # Images filed in folders named after a class (e.g. Tomato___healthy/)
+        class_index = {label.class_name: label.index for label in predictor.labels}
+        labelled = [(data, class_index[os.path.basename(os.path.dirname(path))])
+                    for path, data in corpus if os.path.basename(os.path.dirname(path)) in class_index]
+        if not labelled:
+            return {'labelled': 0}
+
+        buffer = BatchBuffer(32, input_shape[1::-1], dtype)
+        served = argmax = 0
+        for start in range(0, len(labelled), buffer.capacity):
+            chunk = labelled[start:start + buffer.capacity]
+            for row, (data, _) in enumerate(chunk):
+                buffer.fill(row, io.BytesIO(data))
+            probabilities = predictor.predict_proba(buffer.batch(len(chunk)))
+            results = predictor.postprocess_batch(probabilities)
+            for (_, target), result, row in zip(chunk, results, probabilities):
+                served += result['class_name'] == predictor.labels[target].class_name
+                argmax += int(np.argmax(row)) == target
+        return {
+            'labelled': len(labelled),
+            # As served: predictions below the confidence threshold count as wrong
+            'top1': served / len(labelled),
+            'top1_argmax': argmax / len(labelled),
+        }
+
+    def print_report(self, report):
+        model = report['model']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{report['images']} images, " + (f"model {model['version']} ({model['backend']})" if model else "preprocessing only")
+        ))
+        self.stdout.write(f"  {'stage':<12}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+        for stage, summary in report['stages'].items():
+            self.stdout.write(
+                f"  {stage:<12}{summary['mean_ms']:>10.3f}{summary['p50_ms']:>10.3f}"
+                f"{summary['p95_ms']:>10.3f}{summary['p99_ms']:>10.3f}"
+            )
+        self.stdout.write(f"  {'batch':>5} {'threads':>7} {'images/s':>10}")
+        for run in report['throughput']:
+            self.stdout.write(f"  {run['batch_size']:>5} {run['threads']:>7} {run['images_per_second']:>10.1f}")
+        self.stdout.write(f"  peak RSS {report['peak_rss_mb']:.1f} MB")
+        accuracy = report['accuracy']
+        if accuracy and accuracy['labelled']:
+            self.stdout.write(
+                f"  top-1 accuracy on {accuracy['labelled']} labelled images: {accuracy['top1']:.2%} "
+                f"(argmax {accuracy['top1_argmax']:.2%})"
+            )
+
+    def compare(self, baseline, report, tolerance):
+        """Print every metric next to its baseline value; returns the names of the regressions"""
+        before, after = flatten(baseline), flatten(report)
+        regressions = []
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Compared with baseline from {baseline.get('created', '?')}"))
+        for name, (value, direction) in after.items():
+            if name not in before:
+                continue
+            previous = before[name][0]
+            change = (value - previous) / previous if previous else 0.0
+            line = f"  {name:<34}{previous:>12.3f}{value:>12.3f}{change:>+9.1%}"
+            if change * direction < -tolerance:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line + "  regression"))
+            elif change * direction > tolerance:
+                self.stdout.write(self.style.SUCCESS(line + "  improvement"))
+            else:
+                self.stdout.write(line)
+        return regressions
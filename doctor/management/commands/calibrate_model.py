@@ -0,0 +1,80 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from doctor.calibration import fit_temperature, negative_log_likelihood, save_calibration
+from doctor.model_registry import get_predictor
+from doctor.models import Prediction
+from doctor.preprocessing import BatchBuffer
+
+
+def labelled_predictions(class_index):
+    """Yield ``(prediction, class index)`` for predictions whose true class is known"""
+    queryset = (
+        Prediction.objects.exclude(image='')
+        .filter(Q(is_correct__isnull=False) | ~Q(actual_crop=''))
+        .only('image', 'predicted_crop', 'predicted_disease', 'actual_crop', 'actual_disease', 'is_correct')
+    )
+    for prediction in queryset.iterator():
+        if prediction.actual_crop and prediction.actual_disease:
+            label = f"{prediction.actual_crop}___{prediction.actual_disease}"
+        elif prediction.is_correct:
+            label = f"{prediction.predicted_crop}___{prediction.predicted_disease}"
+        else:
+            continue
+        if label in class_index:
+            yield prediction, class_index[label]
+
+
+class Command(BaseCommand):
+    help = "Fit the temperature used to calibrate prediction confidences on labelled Prediction rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Calibration file (default: the one the model version is served with)")
+        parser.add_argument('--min-samples', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=32)
+
+    def handle(self, *args, **options):
+        predictor = get_predictor()
+        output = options['output'] or predictor.manifest.calibration_file
+        class_index = {label.class_name: label.index for label in predictor.labels}
+        buffer = BatchBuffer(options['batch_size'], predictor.input_shape[1::-1], predictor.input_dtype)
+
+        probabilities, labels, pending = [], [], []
+
+        def flush():
+            if pending:
+                probabilities.append(predictor.predict_proba(buffer.batch(len(pending))))
+                labels.extend(pending)
+                pending.clear()
+
+        for prediction, label in labelled_predictions(class_index):
+            try:
+                with prediction.image.open('rb') as image:
+                    buffer.fill(len(pending), image)
+            except (OSError, ValueError):
+                continue
+            pending.append(label)
+            if len(pending) == buffer.capacity:
+                flush()
+        flush()
+
+        if len(labels) < options['min_samples']:
+            raise CommandError(f"Only {len(labels)} labelled predictions with images; need {options['min_samples']}")
+
+        probabilities = np.concatenate(probabilities).astype(np.float32)
+        labels = np.asarray(labels)
+        temperature = fit_temperature(probabilities, labels)
+        nll_before = negative_log_likelihood(probabilities, labels)
+        nll_after = negative_log_likelihood(probabilities, labels, temperature)
+        save_calibration(
+            output,
+            temperature,
+            samples=len(labels),
+            nll_before=nll_before,
+            nll_after=nll_after,
+            model=predictor.backend.path,
+            version=predictor.version,
+        )
+        self.stdout.write(f"Fitted on {len(labels)} predictions: NLL {nll_before:.4f} -> {nll_after:.4f}")
+        self.stdout.write(self.style.SUCCESS(f"Temperature {temperature:.3f} written to {output}"))
@@ -0,0 +1,182 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from doctor.backends import BACKENDS, artifact_path, get_backend
+from doctor.batch import IMAGE_EXTENSIONS
+from doctor.labels import build_registry
+from doctor.model_registry import ModelManifest, load_manifest
+from doctor.preprocessing import BatchBuffer
+
+
+def find_images(root, limit):
+    paths = []
+    for directory, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(directory, name))
+                if len(paths) >= limit:
+                    return paths
+    return paths
+
+
+def load_samples(paths, input_shape):
+    """Preprocess ``paths`` into one float32 ``(n,) + input_shape`` batch, skipping unreadable files"""
+    buffer = BatchBuffer(len(paths), input_shape[1::-1])
+    kept = []
+    for path in paths:
+        try:
+            buffer.fill(len(kept), path)
+        except OSError:
+            continue
+        kept.append(path)
+    return kept, buffer.batch(len(kept))
+
+
+class Command(BaseCommand):
+    help = "Convert the Keras model to TFLite or ONNX, optionally quantized, and compare it with the original"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('tflite', 'onnx'), required=True)
+        parser.add_argument('--quantize', choices=('none', 'float16', 'int8'), default='none')
+        parser.add_argument('--model', help="Keras model to convert (default: the active model version)")
+        parser.add_argument('--output', help="Output file (default: next to the model, where the backend looks for it)")
+        parser.add_argument(
+            '--calibration-dir',
+            default=os.path.join(settings.MEDIA_ROOT, 'predictions'),
+            help="Images used to calibrate int8 quantization and to compare the exported model",
+        )
+        parser.add_argument('--samples', type=int, default=200, help="Maximum number of sample images")
+
+    def handle(self, *args, **options):
+        try:
+            import tensorflow as tf
+        except ImportError:
+            raise CommandError("Exporting requires tensorflow")
+
+        self.manifest = ModelManifest.legacy(options['model']) if options['model'] else load_manifest()
+        options['model'] = self.manifest.model_path
+        output = options['output'] or artifact_path(options['model'], options['format'])
+        paths, samples = load_samples(
+            find_images(options['calibration_dir'], options['samples']), self.manifest.input_shape)
+        if not len(samples):
+            if options['quantize'] == 'int8':
+                raise CommandError(f"int8 quantization needs calibration images in {options['calibration_dir']}")
+            self.stderr.write(self.style.WARNING(f"No sample images in {options['calibration_dir']}; skipping comparison"))
+
+        model = tf.keras.models.load_model(options['model'])
+        if options['format'] == 'tflite':
+            self.export_tflite(tf, model, samples, options['quantize'], output)
+        else:
+            self.export_onnx(tf, model, samples, options['quantize'], output)
+        self.stdout.write(f"Wrote {output} ({os.path.getsize(output) / 1e6:.1f} MB, "
+                          f"Keras model {os.path.getsize(options['model']) / 1e6:.1f} MB)")
+
+        if len(samples):
+            self.compare(options['model'], output, options['format'], paths, samples)
+
+    def export_tflite(self, tf, model, samples, quantize, output):
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if quantize == 'float16':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantize == 'int8':
+            # Full integer quantization, including the input and output tensors
+            # (TFLiteBackend converts to and from their scale/zero point)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = lambda: ([sample[np.newaxis]] for sample in samples)
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+
+        with open(output, 'wb') as f:
+            f.write(converter.convert())
+
+    def export_onnx(self, tf, model, samples, quantize, output):
+        try:
+            import onnx
+            import tf2onnx
+        except ImportError:
+            raise CommandError("ONNX export requires tf2onnx and onnx")
+
+        signature = [tf.TensorSpec((None,) + self.manifest.input_shape, tf.float32, name='input')]
+        onnx_model, _ = tf2onnx.convert.from_keras(model, input_signature=signature, opset=13)
+
+        if quantize == 'float16':
+            try:
+                from onnxconverter_common import float16
+            except ImportError:
+                raise CommandError("float16 ONNX export requires onnxconverter-common")
+            onnx_model = float16.convert_float_to_float16(onnx_model, keep_io_types=True)
+
+        if quantize != 'int8':
+            onnx.save(onnx_model, output)
+            return
+
+        try:
+            from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_static
+        except ImportError:
+            raise CommandError("int8 ONNX export requires onnxruntime")
+
+        class SampleReader(CalibrationDataReader):
+            def __init__(self):
+                self.rows = iter(samples)
+
+            def get_next(self):
+                row = next(self.rows, None)
+                return None if row is None else {'input': row[np.newaxis]}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            float_path = os.path.join(tmp, 'model.onnx')
+            onnx.save(onnx_model, float_path)
+            quantize_static(float_path, output, SampleReader(),
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+    def compare(self, model_path, output, backend_name, paths, samples):
+        reference = get_backend('keras', model_path, self.manifest.input_shape)
+        candidate = BACKENDS[backend_name](output, self.manifest.input_shape)
+        reference.load()
+        candidate.load()
+        if candidate.num_classes != reference.num_classes:
+            raise CommandError(f"Exported model has {candidate.num_classes} outputs, expected {reference.num_classes}")
+
+        results = {}
+        for backend in (reference, candidate):
+            backend.predict_proba(samples[:1])  # warm-up
+            probabilities = []
+            started = time.perf_counter()
+            for sample in samples:
+                probabilities.append(backend.predict_proba(sample[np.newaxis])[0])
+            seconds = (time.perf_counter() - started) / len(samples)
+            results[backend] = (seconds, np.asarray(probabilities, dtype=np.float32))
+
+        keras_seconds, keras_probabilities = results[reference]
+        seconds, probabilities = results[candidate]
+        agreement = float(np.mean(keras_probabilities.argmax(axis=1) == probabilities.argmax(axis=1)))
+        delta = np.abs(keras_probabilities - probabilities)
+
+        self.stdout.write(f"Compared on {len(samples)} images:")
+        self.stdout.write(f"  latency   keras {keras_seconds * 1e3:7.2f} ms/image, "
+                          f"{backend_name} {seconds * 1e3:7.2f} ms/image ({keras_seconds / seconds:.1f}x)")
+        self.stdout.write(f"  top-1 agreement with keras: {agreement:.2%}")
+        self.stdout.write(f"  probability delta: mean {delta.mean():.4f}, max {delta.max():.4f}")
+        self._report_accuracy(paths, keras_probabilities, probabilities, backend_name)
+
+    def _report_accuracy(self, paths, keras_probabilities, probabilities, backend_name):
+        # Images filed in folders named after a class (e.g. Tomato___healthy/)
+        # also give an accuracy for both models
+        class_index = {label.class_name: label.index for label in build_registry(self.manifest.class_names)}
+        labelled = [(row, class_index[os.path.basename(os.path.dirname(path))])
+                    for row, path in enumerate(paths)
+                    if os.path.basename(os.path.dirname(path)) in class_index]
+        if not labelled:
+            return
+        rows, targets = map(np.array, zip(*labelled))
+        keras_accuracy = float(np.mean(keras_probabilities[rows].argmax(axis=1) == targets))
+        accuracy = float(np.mean(probabilities[rows].argmax(axis=1) == targets))
+        self.stdout.write(f"  accuracy on {len(rows)} labelled images: keras {keras_accuracy:.2%}, "
+                          f"{backend_name} {accuracy:.2%} ({(accuracy - keras_accuracy) * 100:+.2f} pts)")
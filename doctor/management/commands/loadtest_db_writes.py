@@ -0,0 +1,209 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+
+from doctor.catalogue import get_catalogue
+from doctor.labels import build_registry
+from doctor.model_registry import load_manifest
+from doctor.models import DailyPredictionStats, Prediction
+from doctor.persistence import PredictionWriter
+from doctor.stats import record_predictions
+
+# Rows written by the load test carry this crop name so they can be removed afterwards
+LOAD_TEST_CROP = 'Load test'
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay only the database work of parallel /predict/ requests (catalogue lookup, "
+        "prediction insert, daily statistics update, status poll; no HTTP and no model) "
+        "and report write throughput, against the configured database or side by side "
+        "against every --database-url. loadtest_http measures the whole request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=250, help="Requests per thread")
+        parser.add_argument(
+            '--async-writes', action='store_true',
+            help="Hand rows to a background PredictionWriter instead of saving them in the request",
+        )
+        parser.add_argument('--keep', action='store_true', help="Leave the generated predictions in the database")
+        parser.add_argument(
+            '--database-url', action='append', dest='database_urls', metavar='URL',
+            help="Run against this (migrated) database instead; repeat to compare several side by side",
+        )
+        parser.add_argument('--json', action='store_true', help="Print the result as one JSON object")
+
+    def handle(self, *args, **options):
+        if options['database_urls']:
+            self.compare(options)
+            return
+
+        result = self.run(options)
+        if options['json']:
+            self.stdout.write(json.dumps(result))
+        else:
+            self.report(result)
+
+    def compare(self, options):
+        # Settings are fixed once Django starts, so each database gets its own process
+        arguments = [f"--threads={options['threads']}", f"--requests={options['requests']}", '--json']
+        arguments += ['--async-writes'] * options['async_writes'] + ['--keep'] * options['keep']
+        results = []
+        for url in options['database_urls']:
+            self.stdout.write(f"Running against {url} ...")
+            process = subprocess.run(
+                [sys.executable, 'manage.py', 'loadtest_db_writes', *arguments],
+                cwd=settings.BASE_DIR, env=dict(os.environ, DATABASE_URL=url),
+                capture_output=True, text=True,
+            )
+            if process.returncode:
+                raise CommandError(f"Load test against {url} failed:\n{process.stderr.strip()}")
+            results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+        rows = [
+            ('database', lambda result: f"{result['vendor']} {result['name']}"),
+            ('connections', lambda result: result['connections']),
+            ('rows written', lambda result: str(result['written'])),
+            ('rows/s', lambda result: f"{result['rows_per_second']:.0f}"),
+            ('latency p50 ms', lambda result: f"{result['latency_ms']['p50']:.2f}"),
+            ('latency p95 ms', lambda result: f"{result['latency_ms']['p95']:.2f}"),
+            ('latency p99 ms', lambda result: f"{result['latency_ms']['p99']:.2f}"),
+            ('errors', lambda result: str(result['errors'])),
+        ]
+        mode = 'background writer' if options['async_writes'] else 'in request'
+        self.stdout.write(f"{options['threads']} threads x {options['requests']} requests, writes {mode}")
+        width = max(24, *(len(row(result)) + 2 for _, row in rows for result in results))
+        for title, row in rows:
+            self.stdout.write(f"  {title:<16}" + ''.join(f"{row(result):<{width}}" for result in results))
+
+    def run(self, options):
+        labels = [label for label in build_registry(load_manifest().class_names) if label.crop != 'Not a plant']
+        catalogue = get_catalogue()
+        catalogue.warm()
+        writer = PredictionWriter() if options['async_writes'] else None
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        start = threading.Barrier(options['threads'] + 1)
+
+        def client(worker):
+            timings = []
+            start.wait()
+            for index in range(options['requests']):
+                label = labels[(worker + index) % len(labels)]
+                started = time.perf_counter()
+                try:
+                    crop_id, disease_id, treatment_id = catalogue.ids(label.class_name)
+                    reference = uuid.uuid4()
+                    prediction = Prediction(
+                        predicted_crop=LOAD_TEST_CROP,
+                        predicted_disease=label.disease,
+                        confidence_score=50 + (index % 50),
+                        crop_id=crop_id,
+                        disease_id=disease_id,
+                        treatment_id=treatment_id,
+                        reference=reference,
+                    )
+                    if writer is not None:
+                        writer.enqueue(prediction)
+                    else:
+                        # save_prediction() with PREDICTION_ASYNC_WRITES=0
+                        with transaction.atomic():
+                            prediction.save()
+                            record_predictions([prediction])
+                        # The client polls /predict/status/ once the response arrives
+                        Prediction.objects.filter(reference=reference).values_list('id', flat=True).first()
+                    timings.append(time.perf_counter() - started)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                finally:
+                    # What request_finished does: honours CONN_MAX_AGE and returns pooled connections
+                    close_old_connections()
+            connection.close()
+            with lock:
+                latencies.extend(timings)
+
+        threads = [threading.Thread(target=client, args=(worker,)) for worker in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        if writer is not None:
+            writer.shutdown(timeout=60)
+        elapsed = time.perf_counter() - started
+
+        written = Prediction.objects.filter(predicted_crop=LOAD_TEST_CROP).count()
+        result = self.describe_database()
+        ms = [latency * 1e3 for latency in latencies]
+        result.update({
+            'threads': options['threads'],
+            'requests': options['requests'],
+            'async_writes': options['async_writes'],
+            'seconds': elapsed,
+            'written': written,
+            'rows_per_second': written / elapsed if elapsed else 0.0,
+            'latency_ms': {
+                'mean': statistics.mean(ms) if ms else 0.0,
+                'p50': percentile(ms, 50),
+                'p95': percentile(ms, 95),
+                'p99': percentile(ms, 99),
+            },
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+        })
+
+        if not options['keep']:
+            Prediction.objects.filter(predicted_crop=LOAD_TEST_CROP).delete()
+            DailyPredictionStats.objects.filter(predicted_crop=LOAD_TEST_CROP).delete()
+        return result
+
+    def describe_database(self):
+        database = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+            connections = f"journal_mode={journal_mode}"
+        elif database['OPTIONS'].get('pool'):
+            connections = f"pool max_size={database['OPTIONS']['pool']['max_size']}"
+        else:
+            connections = f"CONN_MAX_AGE={database['CONN_MAX_AGE']}"
+        return {'vendor': connection.vendor, 'name': str(database['NAME']), 'connections': connections}
+
+    def report(self, result):
+        self.stdout.write(f"Database: {result['vendor']} {result['name']} ({result['connections']})")
+        mode = 'background writer' if result['async_writes'] else 'in request'
+        self.stdout.write(f"{result['threads']} threads x {result['requests']} requests, writes {mode}")
+        self.stdout.write(
+            f"  rows written: {result['written']} in {result['seconds']:.2f} s ({result['rows_per_second']:.0f} rows/s)"
+        )
+        if result['written']:
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"  request latency ms: mean {latency['mean']:.2f}  p50 {latency['p50']:.2f}  "
+                f"p95 {latency['p95']:.2f}  p99 {latency['p99']:.2f}"
+            )
+        if result['errors']:
+            self.stdout.write(self.style.ERROR(f"  {result['errors']} failed requests, e.g. {result['first_error']}"))
+
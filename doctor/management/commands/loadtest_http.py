@@ -0,0 +1,298 @@
+import http.client
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from doctor.management.commands.export_model import find_images
+from doctor.metrics import Histogram
+
+ENDPOINTS = {
+    'classify': '/classify/',
+    'predict': '/predict/',
+}
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    content_type = 'image/png' if filename.lower().endswith('.png') else 'image/jpeg'
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode(),
+        f'Content-Type: {content_type}\r\n\r\n'.encode(),
+        data,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """One keep-alive connection, like one browser tab posting uploads"""
+
+    def __init__(self, host, port, timeout):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.connection = None
+        self.csrf_token = None
+
+    def _request(self, method, path, body=None, headers=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.connection.request(method, path, body=body, headers=headers or {})
+            response = self.connection.getresponse()
+            response.read()
+            return response
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+
+    def post_image(self, path, filename, data):
+        if self.csrf_token is None:
+            # /classify/ is CSRF protected; the home page hands out the cookie
+            cookie = SimpleCookie(self._request('GET', '/').getheader('Set-Cookie') or '')
+            self.csrf_token = cookie['csrftoken'].value if 'csrftoken' in cookie else ''
+        body, content_type = multipart('image', filename, data)
+        return self._request('POST', path, body, {
+            'Content-Type': content_type,
+            'Cookie': f'csrftoken={self.csrf_token}',
+            'X-CSRFToken': self.csrf_token,
+        }).status
+
+
+class Step:
+    """Outcome of one load level"""
+
+    def __init__(self, mode, load, endpoint):
+        self.mode, self.load, self.endpoint = mode, load, endpoint
+        self.histogram = Histogram(LATENCY_BUCKETS)
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, status=None):
+        self.histogram.observe(seconds)
+        with self._lock:
+            self.latencies.append(seconds)
+            if status is None:
+                self.errors += 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+                self.errors += status >= 400
+
+    def summary(self):
+        total = len(self.latencies)
+        ok = total - self.errors
+        ms = np.asarray(self.latencies or [0.0]) * 1e3
+        return {
+            'mode': self.mode,
+            'load': self.load,
+            'endpoint': self.endpoint,
+            'requests': total,
+            'errors': self.errors,
+            'error_rate': self.errors / total if total else 0.0,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'throughput': ok / self.seconds if self.seconds else 0.0,
+            'latency_ms': {
+                'p50': float(np.percentile(ms, 50)),
+                'p90': float(np.percentile(ms, 90)),
+                'p95': float(np.percentile(ms, 95)),
+                'p99': float(np.percentile(ms, 99)),
+                'max': float(ms.max()),
+            },
+            'histogram': self.histogram.snapshot()['buckets'],
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test /classify/ and /predict/ over HTTP with sample images, closed loop (fixed concurrency) "
+        "or open loop (fixed arrival rate), against a running server or one started per worker/thread setup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Server to test (default: %(default)s)")
+        parser.add_argument('--start', choices=('runserver', 'gunicorn'),
+                            help="Start this server on --url's port for each configuration, then stop it")
+        parser.add_argument('--workers', default='2', help="gunicorn worker counts to try, e.g. 1,2,4")
+        parser.add_argument('--threads', default='4', help="Inference threads per worker to try, e.g. 2,4,8")
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS) + ['both'], default='classify')
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, 'predictions'))
+        parser.add_argument('--mode', choices=('closed', 'open'), default='closed')
+        parser.add_argument('--concurrency', default='1,2,4,8,16', help="Closed loop: concurrent clients per step")
+        parser.add_argument('--rates', default='1,2,5,10,20', help="Open loop: requests per second per step")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds per step")
+        parser.add_argument('--max-in-flight', type=int, default=256,
+                            help="Open loop: client connections available to send arrivals")
+        parser.add_argument('--timeout', type=float, default=60.0)
+        parser.add_argument('--seed', type=int, default=0, help="Seed for image order and arrival times")
+        parser.add_argument('--output', help="Write every step (with its latency histogram) to this JSON file")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        host, port = url.hostname or '127.0.0.1', url.port or 80
+        corpus = []
+        for path in find_images(options['images'], 1000):
+            with open(path, 'rb') as f:
+                corpus.append((os.path.basename(path), f.read()))
+        if not corpus:
+            raise CommandError(f"No images in {options['images']}")
+        endpoints = sorted(ENDPOINTS) if options['endpoint'] == 'both' else [options['endpoint']]
+        levels = [float(value) for value in options['rates' if options['mode'] == 'open' else 'concurrency'].split(',')]
+
+        if options['start']:
+            configurations = [
+                {'server': options['start'], 'workers': int(workers), 'threads': int(threads)}
+                for workers in options['workers'].split(',')
+                for threads in options['threads'].split(',')
+            ]
+            if options['start'] == 'runserver':
+                configurations = configurations[:1]
+        else:
+            configurations = [{'server': options['url']}]
+
+        runs = []
+        for configuration in configurations:
+            server = self.start_server(configuration, port) if options['start'] else None
+            try:
+                self.wait_until_ready(host, port)
+                steps = []
+                for endpoint in endpoints:
+                    for level in levels:
+                        step = self.run_step(host, port, endpoint, options['mode'], level, corpus, options)
+                        steps.append(step.summary())
+                        self.print_step(steps[-1])
+                runs.append({'configuration': configuration, 'steps': steps})
+                self.print_curve(configuration, steps, endpoints)
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait(timeout=30)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'url': options['url'], 'mode': options['mode'], 'images': len(corpus), 'runs': runs}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def start_server(self, configuration, port):
+        env = dict(os.environ, PORT=str(port), INFERENCE_MAX_WORKERS=str(configuration['threads']))
+        if configuration['server'] == 'gunicorn':
+            env.update(WEB_CONCURRENCY=str(configuration['workers']), GUNICORN_THREADS=str(configuration['threads']))
+            command = [sys.executable, '-m', 'gunicorn', 'agrodoctor.asgi:application', '--config', 'gunicorn.conf.py']
+        else:
+            command = [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Starting {configuration['server']} with {configuration['workers']} worker(s) x "
+            f"{configuration['threads']} thread(s)"
+        ))
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait_until_ready(self, host, port, timeout=180.0):
+        # Workers warm the model up before they answer (the home page, as the
+        # stats endpoints may refuse a remote load generator)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                connection = http.client.HTTPConnection(host, port, timeout=5)
+                connection.request('GET', '/')
+                if connection.getresponse().status == 200:
+                    return
+            except (OSError, http.client.HTTPException):
+                pass
+            time.sleep(0.5)
+        raise CommandError(f"Server on {host}:{port} did not become ready within {timeout:.0f}s")
+
+    def run_step(self, host, port, endpoint, mode, level, corpus, options):
+        step = Step(mode, level, endpoint)
+        path = ENDPOINTS[endpoint]
+        rng = random.Random(options['seed'])
+        started = time.monotonic()
+        deadline = started + options['duration']
+
+        def send(client, scheduled):
+            filename, data = corpus[rng.randrange(len(corpus))]
+            try:
+                status = client.post_image(path, filename, data)
+            except (OSError, http.client.HTTPException):
+                status = None
+            # Measured from when the request was due, so a backed-up client
+            # doesn't hide server slowness (coordinated omission)
+            step.record(time.monotonic() - scheduled, status)
+
+        if mode == 'closed':
+            def closed_client():
+                client = Client(host, port, options['timeout'])
+                while time.monotonic() < deadline:
+                    send(client, time.monotonic())
+
+            threads = [threading.Thread(target=closed_client) for _ in range(int(level))]
+        else:
+            arrivals = queue.Queue()
+
+            def open_client():
+                client = Client(host, port, options['timeout'])
+                while True:
+                    scheduled = arrivals.get()
+                    if scheduled is None:
+                        return
+                    send(client, scheduled)
+
+            threads = [threading.Thread(target=open_client) for _ in range(options['max_in_flight'])]
+
+        for thread in threads:
+            thread.start()
+        if mode == 'open':
+            # Poisson arrivals at `level` requests per second, whether or not
+            # earlier requests have been answered
+            arrival = started
+            while True:
+                arrival += rng.expovariate(level)
+                if arrival >= deadline:
+                    break
+                time.sleep(max(0.0, arrival - time.monotonic()))
+                arrivals.put(arrival)
+            for _ in threads:
+                arrivals.put(None)
+        for thread in threads:
+            thread.join()
+        step.seconds = time.monotonic() - started
+        return step
+
+    def print_step(self, step):
+        unit = 'req/s' if step['mode'] == 'open' else 'clients'
+        latency = step['latency_ms']
+        self.stdout.write(
+            f"  {step['endpoint']:<9}{step['load']:>7g} {unit:<8}{step['throughput']:>8.2f} req/s  "
+            f"err {step['error_rate']:>6.1%}  p50 {latency['p50']:>8.1f}  p95 {latency['p95']:>8.1f}  "
+            f"p99 {latency['p99']:>8.1f} ms"
+        )
+
+    def print_curve(self, configuration, steps, endpoints):
+        for endpoint in endpoints:
+            curve = [step for step in steps if step['endpoint'] == endpoint and step['error_rate'] < 0.01]
+            if not curve:
+                self.stdout.write(self.style.WARNING(f"  {endpoint}: every step had errors"))
+                continue
+            # The knee: the lightest load that already gets 95% of the best throughput
+            best = max(step['throughput'] for step in curve)
+            knee = next(step for step in curve if step['throughput'] >= 0.95 * best)
+            self.stdout.write(self.style.SUCCESS(
+                f"  {endpoint}: peak {best:.2f} req/s; knee at {knee['load']:g} "
+                f"({knee['throughput']:.2f} req/s, p95 {knee['latency_ms']['p95']:.0f} ms)"
+            ))
@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from doctor import stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily prediction statistics from the Prediction table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help="Only rebuild days from this date (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        stats.rebuild(since=options['since'])
+        total, correct = stats.totals()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt daily statistics: {total} predictions, {correct} correct"))
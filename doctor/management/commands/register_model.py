@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from doctor import model_registry
+from doctor.backends import ARTIFACT_EXTENSIONS, artifact_path
+
+
+class Command(BaseCommand):
+    help = "Copy a model artifact into the model registry as a new version with its manifest"
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Version name, e.g. v6")
+        parser.add_argument('model', help="Keras model file (.h5); TFLite/ONNX exports next to it are copied too")
+        parser.add_argument(
+            '--class-names',
+            help="JSON file with the output classes in index order (default: those of the active version)",
+        )
+        parser.add_argument('--input-size', type=int, nargs=2, metavar=('HEIGHT', 'WIDTH'))
+        parser.add_argument('--activate', action='store_true', help="Serve this version once registered")
+
+    def handle(self, *args, **options):
+        version = options['name']
+        if not version or os.sep in version or version.startswith('.') or version == model_registry.CURRENT_FILE:
+            raise CommandError(f"Invalid version name {version!r}")
+        if not os.path.isfile(options['model']):
+            raise CommandError(f"No model file at {options['model']}")
+        directory = model_registry.version_directory(version)
+        if os.path.exists(directory):
+            raise CommandError(f"Version {version} is already registered; versions are never overwritten")
+
+        current = model_registry.load_manifest()
+        if options['class_names']:
+            with open(options['class_names']) as f:
+                class_names = json.load(f)
+        else:
+            class_names = current.class_names
+        try:
+            manifest = model_registry.ModelManifest(
+                version,
+                os.path.join(directory, f"model{ARTIFACT_EXTENSIONS['keras']}"),
+                class_names,
+                input_size=options['input_size'] or current.input_size,
+            )
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        # Assembled next to the registry and renamed into place, so workers
+        # never see a half-copied version
+        os.makedirs(settings.MODEL_PATH, exist_ok=True)
+        staging = os.path.join(settings.MODEL_PATH, f".{version}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for backend in ARTIFACT_EXTENSIONS:
+            source = artifact_path(options['model'], backend)
+            if os.path.isfile(source):
+                shutil.copy2(source, artifact_path(os.path.join(staging, 'model'), backend))
+                self.stdout.write(f"  {backend}: {source}")
+        with open(os.path.join(staging, model_registry.MANIFEST_FILE), 'w') as f:
+            json.dump(manifest.to_dict(), f, indent=2)
+        os.rename(staging, directory)
+        self.stdout.write(self.style.SUCCESS(f"Registered model version {version} in {directory}"))
+
+        if options['activate']:
+            model_registry.activate(version)
+            self.stdout.write(self.style.SUCCESS(f"Activated {version}"))
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from doctor.ai_service import AIPredictor
+from doctor.backends import BACKENDS
+from doctor.model_registry import PredictorSlot
+from doctor.model_server import ModelServer
+
+
+class Command(BaseCommand):
+    help = "Load the model once and serve predictions to web workers over a Unix domain socket"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            default=settings.MODEL_SERVER_SOCKET or '/tmp/agrodoctor-model.sock',
+            help="Path of the Unix socket to listen on (default: MODEL_SERVER_SOCKET)",
+        )
+        parser.add_argument(
+            '--model',
+            help="Model file to serve (default: the active model version, swapped when another is activated)",
+        )
+        parser.add_argument(
+            '--max-batch-size',
+            type=int,
+            default=max(settings.INFERENCE_MAX_BATCH_SIZE, settings.BATCH_CLASSIFY['CHUNK_SIZE']),
+            help="Largest batch a client may send (default: the larger of INFERENCE_MAX_BATCH_SIZE "
+                 "and the batch classification chunk size)",
+        )
+        parser.add_argument(
+            '--backend',
+            default=settings.INFERENCE_BACKEND,
+            choices=sorted(BACKENDS),
+            help="Inference backend (default: INFERENCE_BACKEND)",
+        )
+
+    def handle(self, *args, **options):
+        # Always a local predictor, even if this process has MODEL_SERVER_SOCKET set
+        slot = None
+        if options['model']:
+            predictor = AIPredictor(options['model'], backend=options['backend'])
+        else:
+            slot = PredictorSlot(
+                lambda manifest: AIPredictor(manifest=manifest, backend=options['backend']),
+                prepare=lambda predictor: setattr(server, 'predictor', predictor),
+            )
+            predictor = slot.get()
+        predictor.load()
+        predictor.warm_up()
+        self.stdout.write(f"Loaded {predictor.version} from {predictor.backend.path} in {predictor.model_load_seconds:.2f}s")
+
+        server = ModelServer(options['socket'], predictor, max_batch_size=options['max_batch_size'])
+        if slot is not None and settings.MODEL_RELOAD_INTERVAL:
+            threading.Thread(
+                target=self.follow_registry, args=(slot, settings.MODEL_RELOAD_INTERVAL),
+                name='model-registry', daemon=True,
+            ).start()
+
+        self.stdout.write(self.style.SUCCESS(f"Model server listening on {options['socket']}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    def follow_registry(self, slot, interval):
+        # Requests don't go through the slot here, so poll for a newly activated version
+        while True:
+            time.sleep(interval)
+            slot.check()
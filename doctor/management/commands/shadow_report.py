@@ -0,0 +1,67 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from doctor.models import ShadowComparison
+
+
+class Command(BaseCommand):
+    help = "Summarize how a shadow (candidate) model compares with the served model on live uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Report on the last N days (default 7)")
+        parser.add_argument('--candidate', help="Only this candidate version")
+        parser.add_argument('--top', type=int, default=10, help="Number of most frequent disagreements to list")
+
+    def handle(self, *args, **options):
+        rows = ShadowComparison.objects.filter(
+            date__gte=timezone.localdate() - datetime.timedelta(days=options['days'] - 1),
+        )
+        if options['candidate']:
+            rows = rows.filter(candidate_version=options['candidate'])
+
+        pairs = (
+            rows.values('primary_version', 'candidate_version')
+            .annotate(
+                total=Sum('count'),
+                agreed=Sum('count', filter=Q(primary_class=F('candidate_class'))),
+                primary_confidence=Sum('primary_confidence_sum'),
+                candidate_confidence=Sum('candidate_confidence_sum'),
+                primary_seconds=Sum('primary_seconds_sum'),
+                candidate_seconds=Sum('candidate_seconds_sum'),
+            )
+            .order_by('candidate_version', 'primary_version')
+        )
+        if not pairs:
+            self.stdout.write(f"No shadow comparisons in the last {options['days']} days")
+            return
+
+        for pair in pairs:
+            total = pair['total']
+            agreed = pair['agreed'] or 0
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{pair['candidate_version']} (candidate) vs {pair['primary_version']} (served): {total} uploads"
+            ))
+            self.stdout.write(f"  disagreement rate: {(total - agreed) / total:.2%}")
+            self.stdout.write(
+                f"  mean confidence:   served {pair['primary_confidence'] / total:6.2f}%  "
+                f"candidate {pair['candidate_confidence'] / total:6.2f}%"
+            )
+            self.stdout.write(
+                f"  latency per image: served {pair['primary_seconds'] / total * 1e3:7.2f} ms (in request)  "
+                f"candidate {pair['candidate_seconds'] / total * 1e3:7.2f} ms (batched)"
+            )
+
+            confusions = (
+                rows.filter(primary_version=pair['primary_version'], candidate_version=pair['candidate_version'])
+                .exclude(primary_class=F('candidate_class'))
+                .values('primary_class', 'candidate_class')
+                .annotate(total=Sum('count'))
+                .order_by('-total')[:options['top']]
+            )
+            for confusion in confusions:
+                self.stdout.write(
+                    f"  {confusion['total']:6d}  {confusion['primary_class']} -> {confusion['candidate_class']}"
+                )
@@ -0,0 +1,159 @@
+import bisect
+import threading
+from time import perf_counter
+
+# Where a prediction request spends its time; see timed()
+STAGES = (
+    'upload',       # multipart parsing of the request body
+    'cache',        # hashing the upload and the prediction cache lookup
+    'decode',       # PIL decode (JPEG draft downscaling included)
+    'resize',
+    'normalize',    # copying or scaling pixels into the input buffer
+    'inference',    # from submitting to the micro-batcher until the result is back
+    'forward',      # one model forward pass (per batch, not per request)
+    'postprocess',
+    'db',           # catalogue lookups and saving the prediction
+    'serialize',    # building the JSON response
+)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram (cumulative counts, Prometheus style)"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+
+        cumulative = []
+        running = 0
+        for upper, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            running += bucket_count
+            cumulative.append(('+Inf' if upper == float('inf') else upper, running))
+
+        return {
+            'buckets': cumulative,
+            'count': count,
+            'sum': total,
+            'mean': (total / count) if count else 0.0,
+        }
+
+
+class Counter:
+    """Thread-safe counters keyed by a tuple of label values"""
+
+    def __init__(self, labelnames):
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.started)
+
+
+# Per-process aggregates, reported by the /metrics view. Recording one
+# observation costs a perf_counter() call and an uncontended lock
+stage_seconds = {stage: Histogram(STAGE_BUCKETS) for stage in STAGES}
+request_seconds = {endpoint: Histogram(REQUEST_BUCKETS) for endpoint in ('classify', 'predict')}
+requests_total = Counter(('endpoint', 'status'))
+predictions_total = Counter(('model_version', 'class_name'))
+
+
+def timed(stage):
+    """``with timed('db'): ...`` adds the block's duration to that stage's histogram"""
+    return _Timer(stage_seconds[stage])
+
+
+def observe_stage(stage, seconds):
+    stage_seconds[stage].observe(seconds)
+
+
+def observe_request(endpoint, status, seconds):
+    request_seconds[endpoint].observe(seconds)
+    requests_total.inc(endpoint, str(status))
+
+
+def count_prediction(result):
+    predictions_total.inc(result.get('model_version', ''), result['class_name'])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Exposition:
+    """Builds a response body in the Prometheus text format (version 0.0.4).
+
+    Call ``family()`` once per metric name, then add its samples.
+    """
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix='agrodoctor_'):
+        self.prefix = prefix
+        self._lines = []
+
+    def family(self, name, kind, help_text):
+        self._lines.append(f'# HELP {self.prefix}{name} {help_text}')
+        self._lines.append(f'# TYPE {self.prefix}{name} {kind}')
+
+    def sample(self, name, value, labels=None):
+        if value is None:
+            return
+        self._lines.append(f'{self.prefix}{name}{_labels(labels)} {float(value)!r}')
+
+    def histogram(self, name, histogram, labels=None):
+        snapshot = histogram.snapshot()
+        labels = labels or {}
+        for upper, count in snapshot['buckets']:
+            self.sample(f'{name}_bucket', count, {**labels, 'le': upper})
+        self.sample(f'{name}_sum', snapshot['sum'], labels)
+        self.sample(f'{name}_count', snapshot['count'], labels)
+
+    def counter(self, name, counter):
+        for labels, value in sorted(counter.snapshot().items()):
+            self.sample(name, value, dict(zip(counter.labelnames, labels)))
+
+    def render(self):
+        return '\n'.join(self._lines) + '\n'
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:02
+
+import doctor.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0003_remove_disease_causes_remove_disease_description_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='prediction',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=doctor.storage.prediction_storage, upload_to='predictions/'),
+        ),
+    ]
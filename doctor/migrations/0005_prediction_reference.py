@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0004_prediction_image_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='reference',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:17
+
+from django.db import migrations, models
+
+
+def build_daily_stats(apps, schema_editor):
+    from doctor.stats import rebuild
+
+    rebuild(apps.get_model('doctor', 'Prediction'), apps.get_model('doctor', 'DailyPredictionStats'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0005_prediction_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPredictionStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('predicted_crop', models.CharField(max_length=100)),
+                ('predicted_disease', models.CharField(max_length=200)),
+                ('prediction_count', models.PositiveIntegerField(default=0)),
+                ('correct_count', models.PositiveIntegerField(default=0)),
+                ('confidence_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Daily Prediction Statistics',
+                'verbose_name_plural': 'Daily Prediction Statistics',
+                'ordering': ['-date', 'predicted_crop', 'predicted_disease'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['created_at'], name='prediction_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['is_correct', 'created_at'], name='prediction_correct_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['predicted_crop', 'created_at'], name='prediction_crop_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailypredictionstats',
+            constraint=models.UniqueConstraint(fields=('date', 'predicted_crop', 'predicted_disease'), name='daily_prediction_stats_unique'),
+        ),
+        migrations.RunPython(build_daily_stats, migrations.RunPython.noop),
+    ]
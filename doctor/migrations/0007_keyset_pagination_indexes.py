@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0006_prediction_indexes_daily_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='prediction',
+            name='prediction_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='crop',
+            index=models.Index(fields=['name', 'id'], name='crop_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disease',
+            index=models.Index(fields=['crop', 'name', 'id'], name='disease_crop_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['created_at', 'id'], name='prediction_created_id_idx'),
+        ),
+    ]
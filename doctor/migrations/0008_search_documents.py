@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    from doctor import search
+
+    search.install(schema_editor)
+    search.rebuild(
+        apps.get_model('doctor', 'Disease'),
+        apps.get_model('doctor', 'Treatment'),
+        apps.get_model('doctor', 'CropTip'),
+        apps.get_model('doctor', 'SearchDocument'),
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    from doctor import search
+
+    search.install(schema_editor, drop=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0007_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('disease', 'Disease'), ('treatment', 'Treatment'), ('tip', 'Crop tip')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('disease_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('crop_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('title', models.CharField(max_length=200)),
+                ('body', models.TextField(blank=True)),
+                ('crop_name', models.CharField(blank=True, max_length=100)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['crop_id'], name='search_document_crop_idx'), models.Index(fields=['disease_id'], name='search_document_disease_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='search_document_unique')],
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
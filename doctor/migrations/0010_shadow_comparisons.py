@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0009_prediction_model_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShadowComparison',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('primary_version', models.CharField(max_length=100)),
+                ('candidate_version', models.CharField(max_length=100)),
+                ('primary_class', models.CharField(max_length=200)),
+                ('candidate_class', models.CharField(max_length=200)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('primary_confidence_sum', models.FloatField(default=0)),
+                ('candidate_confidence_sum', models.FloatField(default=0)),
+                ('primary_seconds_sum', models.FloatField(default=0)),
+                ('candidate_seconds_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'ordering': ['-date', 'candidate_version', '-count'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'primary_version', 'candidate_version', 'primary_class', 'candidate_class'), name='shadow_comparison_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,313 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# The bare model file used when MODEL_PATH holds no registered versions
+DEFAULT_MODEL_PATH = os.path.join(settings.BASE_DIR, settings.MODEL_FILE)
+LEGACY_VERSION = os.path.splitext(os.path.basename(DEFAULT_MODEL_PATH))[0]
+
+MANIFEST_FILE = 'manifest.json'
+CURRENT_FILE = 'CURRENT'
+CALIBRATION_FILE = 'calibration.json'
+
+# The only preprocessing preprocess_into() and the model server implement;
+# a manifest asking for anything else is rejected before it can be served
+SUPPORTED_PREPROCESSING = {'color_mode': 'rgb', 'resize': 'bilinear', 'scale': 1 / 255}
+
+
+class ModelManifest:
+    """One version of the model: its artifact, output classes and input spec.
+
+    Registered versions live in ``MODEL_PATH/<version>/`` as the Keras
+    artifact (plus any ``export_model`` variants next to it), a
+    ``manifest.json`` and optionally the ``calibration.json`` fitted for
+    that version. ``MODEL_PATH/CURRENT`` names the version to serve.
+    """
+
+    def __init__(self, version, model_path, class_names, input_size=(256, 256), preprocessing=None,
+                 calibration_file=None):
+        self.version = version
+        self.model_path = model_path
+        self.class_names = list(class_names)
+        self.input_size = tuple(int(size) for size in input_size)
+        self.preprocessing = {**SUPPORTED_PREPROCESSING, **(preprocessing or {})}
+        self.calibration_file = calibration_file
+        self.validate()
+
+    @property
+    def input_shape(self):
+        return self.input_size + (3,)
+
+    def validate(self):
+        if not self.class_names:
+            raise ImproperlyConfigured(f"Model {self.version} has no class names")
+        if len(self.input_size) != 2 or min(self.input_size) <= 0:
+            raise ImproperlyConfigured(f"Model {self.version} has an invalid input size {self.input_size}")
+        for key, value in self.preprocessing.items():
+            expected = SUPPORTED_PREPROCESSING.get(key)
+            if isinstance(expected, float) and isinstance(value, (int, float)) and math.isclose(value, expected):
+                continue
+            if value != expected:
+                raise ImproperlyConfigured(f"Model {self.version} needs unsupported preprocessing {key}={value!r}")
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'artifact': os.path.basename(self.model_path),
+            'class_names': self.class_names,
+            'input_size': list(self.input_size),
+            'preprocessing': self.preprocessing,
+        }
+
+    @classmethod
+    def from_directory(cls, directory):
+        path = os.path.join(directory, MANIFEST_FILE)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            version = os.path.basename(os.path.normpath(directory))
+            if data.get('version', version) != version:
+                raise ValueError(f"version {data['version']!r} does not match its directory")
+            return cls(
+                version,
+                os.path.join(directory, data['artifact']),
+                data['class_names'],
+                input_size=data.get('input_size', (256, 256)),
+                preprocessing=data.get('preprocessing'),
+                calibration_file=os.path.join(directory, CALIBRATION_FILE),
+            )
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise ImproperlyConfigured(f"Cannot read model manifest {path}: {e}")
+
+    @classmethod
+    def legacy(cls, model_path=DEFAULT_MODEL_PATH):
+        """A bare model file outside the registry, described by settings.CLASS_NAMES"""
+        return cls(
+            os.path.splitext(os.path.basename(model_path))[0],
+            model_path,
+            settings.CLASS_NAMES,
+            calibration_file=settings.PREDICTION_CALIBRATION_FILE,
+        )
+
+
+def version_directory(version):
+    return os.path.join(settings.MODEL_PATH, version)
+
+
+def versions():
+    """Names of the registered model versions"""
+    try:
+        names = os.listdir(settings.MODEL_PATH)
+    except OSError:
+        return []
+    return sorted(name for name in names if os.path.isfile(os.path.join(version_directory(name), MANIFEST_FILE)))
+
+
+def active_version():
+    """The version pinned by MODEL_VERSION, else the one named in MODEL_PATH/CURRENT, else None"""
+    if settings.MODEL_VERSION:
+        return settings.MODEL_VERSION
+    try:
+        with open(os.path.join(settings.MODEL_PATH, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def load_manifest(version=None):
+    """The manifest of ``version``, by default the active one (the legacy model file without a registry)"""
+    version = version or active_version()
+    if version is None:
+        return ModelManifest.legacy()
+    directory = version_directory(version)
+    if not os.path.isdir(directory):
+        raise ImproperlyConfigured(f"Model version {version!r} is not registered in {settings.MODEL_PATH}")
+    return ModelManifest.from_directory(directory)
+
+
+def activate(version):
+    """Make ``version`` the one every worker serves; workers swap it in within MODEL_RELOAD_INTERVAL"""
+    load_manifest(version)
+    path = os.path.join(settings.MODEL_PATH, CURRENT_FILE)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        f.write(f"{version}\n")
+    # Readers see either the old or the new file, never a partial one
+    os.replace(temporary, path)
+
+
+class PredictorSlot:
+    """Holds the predictor of the active model version and replaces it without downtime.
+
+    ``reload()`` builds the predictor of another version on a background
+    thread, loads and warms it, and only then swaps it in; a request sees
+    either the old or the new predictor, and requests already running on the
+    old one finish on it. ``get()`` also notices when ``MODEL_PATH/CURRENT``
+    has changed (checked at most every ``reload_interval`` seconds) and
+    starts that reload itself. ``prepare(predictor)`` runs on the warmed
+    predictor just before it is swapped in. Both models are in memory while
+    swapping.
+    """
+
+    def __init__(self, factory, reload_interval=0, prepare=None):
+        self.factory = factory
+        self.reload_interval = reload_interval
+        self.prepare = prepare
+        self._lock = threading.Lock()
+        self._predictor = None
+        self._thread = None
+        self._next_check = 0.0
+        self._failed_version = None
+        self.swaps = 0
+
+    def get(self):
+        predictor = self._predictor
+        if predictor is None:
+            with self._lock:
+                if self._predictor is None:
+                    self._predictor = self.factory(load_manifest())
+                    self._next_check = time.monotonic() + self.reload_interval
+                predictor = self._predictor
+        elif self.reload_interval and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.reload_interval
+            self.check()
+        return predictor
+
+    @property
+    def current(self):
+        return self._predictor
+
+    def check(self):
+        """Start a reload if the active version differs from the one being served"""
+        wanted = active_version() or LEGACY_VERSION
+        predictor = self._predictor
+        if predictor is not None and wanted != predictor.version and wanted != self._failed_version:
+            self.reload(wanted)
+
+    def reload(self, version=None, wait=False):
+        """Load ``version`` (default: the active one) in the background and swap it in once warm"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._load_and_swap, args=(version,), name='model-reload', daemon=True,
+                )
+                self._thread.start()
+            thread = self._thread
+        if wait:
+            thread.join()
+        return thread
+
+    def _load_and_swap(self, version):
+        started = time.monotonic()
+        version = version or active_version() or LEGACY_VERSION
+        try:
+            manifest = ModelManifest.legacy() if version == LEGACY_VERSION else load_manifest(version)
+            if self._predictor is not None and manifest.version == self._predictor.version:
+                return
+            logger.info(f"Loading model version {manifest.version} in process {os.getpid()}")
+            predictor = self.factory(manifest)
+            predictor.load()
+            predictor.warm_up()
+            if self.prepare is not None:
+                self.prepare(predictor)
+        except Exception as e:
+            # Keep serving the current version; retried once CURRENT names another one
+            self._failed_version = version
+            logger.error(f"Could not load model version {version}, keeping the current one: {e}")
+            return
+        finally:
+            connections.close_all()
+
+        with self._lock:
+            previous, self._predictor = self._predictor, predictor
+            self._failed_version = None
+            self.swaps += 1
+        if previous is not None:
+            previous.close()
+        logger.info(
+            f"Swapped in model version {manifest.version} "
+            f"(was {previous.version if previous else None}) after {time.monotonic() - started:.2f}s"
+        )
+
+    def stats(self):
+        predictor = self._predictor
+        return {
+            'version': predictor.version if predictor else None,
+            'active_version': active_version() or LEGACY_VERSION,
+            'reloading': self._thread is not None and self._thread.is_alive(),
+            'failed_version': self._failed_version,
+            'swaps': self.swaps,
+        }
+
+
+def _create_predictor(manifest):
+    from .ai_service import AIPredictor
+    return AIPredictor(
+        manifest=manifest,
+        server_socket=settings.MODEL_SERVER_SOCKET,
+        shm_slots=settings.MODEL_SERVER_SHM_SLOTS,
+        backend=settings.INFERENCE_BACKEND,
+    )
+
+
+def _bind_catalogue(predictor):
+    # Resolve the new labels' catalogue ids before any request can see them,
+    # and drop the fragments built for the outgoing version
+    from .catalogue import get_catalogue
+    catalogue = get_catalogue()
+    catalogue.bind(predictor.labels)
+    catalogue.invalidate()
+
+
+_slot = PredictorSlot(_create_predictor, settings.MODEL_RELOAD_INTERVAL, prepare=_bind_catalogue)
+
+
+def get_predictor():
+    """Return the process-wide AIPredictor of the active model version, creating it on first use.
+
+    Importing this module never imports TensorFlow; that only happens once a
+    view actually needs the model.
+    """
+    return _slot.get()
+
+
+def current_predictor():
+    """Return the AIPredictor if one was created in this process, else None"""
+    return _slot.current
+
+
+def reload(version=None, wait=False):
+    return _slot.reload(version, wait=wait)
+
+
+def stats():
+    return _slot.stats()
+
+
+def is_loaded():
+    predictor = _slot.current
+    return predictor is not None and predictor.is_loaded
+
+
+def load_model():
+    """Load the model weights now instead of on the first request"""
+    predictor = get_predictor()
+    predictor.load()
+    return predictor
+
+
+def warm_up():
+    """Load the model and run one dummy forward pass"""
+    predictor = load_model()
+    predictor.warm_up()
+    logger.info(f"Model {predictor.version} warmed up in process {os.getpid()}")
+    return predictor
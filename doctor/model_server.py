@@ -0,0 +1,266 @@
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+
+import numpy as np
+
+from .shm_ring import SharedTensorRing
+
+logger = logging.getLogger(__name__)
+
+# Wire format (all integers big-endian):
+#   request:  magic, op, count, height, width, channels, then
+#               OP_PREDICT:     count*h*w*c uint8 pixels
+#               OP_ATTACH:      uint16 name length + name of a SharedTensorRing
+#                               with `count` slots of (h, w, c)
+#               OP_PREDICT_SHM: count uint32 indices of READY ring slots
+#   response: magic, status, count, classes, then count*classes little-endian
+#             float32 probabilities, or a UTF-8 error message when status != 0
+MAGIC = b'AGR1'
+REQUEST_HEADER = struct.Struct('!4sBIHHH')
+RESPONSE_HEADER = struct.Struct('!4sBII')
+NAME_LENGTH = struct.Struct('!H')
+OP_PREDICT = 1
+OP_ATTACH = 2
+OP_PREDICT_SHM = 3
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_PROBABILITY_DTYPE = np.dtype('<f4')
+_SLOT_INDEX_DTYPE = np.dtype('>u4')
+
+
+class ModelServerError(RuntimeError):
+    pass
+
+
+def recv_exact(sock, size):
+    """Read exactly ``size`` bytes, or return None if the peer closed first"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return buffer
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.ring = None
+
+    def finish(self):
+        if self.ring is not None:
+            self.ring.close()
+
+    def handle(self):
+        # One connection carries many requests from the same web worker thread
+        while True:
+            header = recv_exact(self.request, REQUEST_HEADER.size)
+            if header is None:
+                return
+            magic, op, count, height, width, channels = REQUEST_HEADER.unpack(header)
+            if magic != MAGIC or op not in (OP_PREDICT, OP_ATTACH, OP_PREDICT_SHM):
+                logger.warning("Dropping model server connection after a malformed request")
+                return
+            # Checked before the payload is read, so a bad header can't make
+            # the server allocate an arbitrarily large buffer
+            error = self.server.check_request(op, count, (height, width, channels))
+            if error is not None:
+                logger.warning(f"Rejecting model server request: {error}")
+                self._send_error(error)
+                # The payload that follows can't be skipped safely
+                return
+
+            if op == OP_PREDICT:
+                payload = recv_exact(self.request, count * height * width * channels)
+                if payload is None:
+                    return
+                pixels = np.frombuffer(payload, dtype=np.uint8).reshape(count, height, width, channels)
+                self._respond(self.server.predict_pixels, pixels)
+            elif op == OP_ATTACH:
+                length = recv_exact(self.request, NAME_LENGTH.size)
+                name = length and recv_exact(self.request, NAME_LENGTH.unpack(length)[0])
+                if name is None:
+                    return
+                self._respond(self._attach, name.decode('utf-8'), count, (height, width, channels))
+            else:
+                payload = recv_exact(self.request, count * _SLOT_INDEX_DTYPE.itemsize)
+                if payload is None:
+                    return
+                indices = np.frombuffer(payload, dtype=_SLOT_INDEX_DTYPE).tolist()
+                self._respond(self._predict_slots, indices)
+
+    def _attach(self, name, slots, shape):
+        if self.ring is not None:
+            self.ring.close()
+        self.ring = SharedTensorRing.attach(name, slots, shape)
+        return np.empty((0, 0), dtype=_PROBABILITY_DTYPE)
+
+    def _predict_slots(self, indices):
+        if self.ring is None:
+            raise ModelServerError("No shared memory ring attached to this connection")
+        views = self.ring.read(indices)
+        try:
+            return self.server.predict_pixels(views)
+        finally:
+            self.ring.finish(indices)
+
+    def _respond(self, fn, *args):
+        try:
+            probabilities = fn(*args)
+        except Exception as e:
+            logger.error(f"Model server prediction error: {e}")
+            self._send_error(str(e))
+            return
+
+        probabilities = np.ascontiguousarray(probabilities, dtype=_PROBABILITY_DTYPE)
+        self.request.sendall(RESPONSE_HEADER.pack(MAGIC, STATUS_OK, *probabilities.shape))
+        self.request.sendall(probabilities.data)
+
+    def _send_error(self, message):
+        message = message.encode('utf-8')
+        self.request.sendall(RESPONSE_HEADER.pack(MAGIC, STATUS_ERROR, len(message), 0) + message)
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Owns the model and serves forward passes to web workers over a Unix socket.
+
+    Single-image requests from all connected workers go through the
+    predictor's micro-batcher, so they are batched together across processes.
+    Requests for more than ``max_batch_size`` images, or images of another
+    shape than the model's input, are refused with an error response.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, predictor, max_batch_size=64):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def check_request(self, op, count, shape):
+        """Why a request with this header can't be served, or None if it can"""
+        if op != OP_ATTACH and not 0 < count <= self.max_batch_size:
+            return f"Batch of {count} images; this server accepts 1 to {self.max_batch_size}"
+        input_shape = tuple(self.predictor.input_shape)
+        if op != OP_PREDICT_SHM and shape != input_shape:
+            return f"Images of shape {shape}; the model expects {input_shape}"
+        return None
+
+    def predict_pixels(self, images):
+        """Normalize uint8 ``images`` (an array or a list of slot views) and run them"""
+        batch = np.empty((len(images),) + tuple(images[0].shape), dtype=np.float32)
+        for row, image in enumerate(images):
+            np.multiply(image, np.float32(1.0 / 255.0), out=batch[row], casting='unsafe')
+        if len(batch) == 1:
+            return self.predictor.batcher.submit(batch[0])[np.newaxis]
+        return self.predictor.predict_proba(batch)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+class ModelClient:
+    """Client for ModelServer with one persistent connection per thread"""
+
+    def __init__(self, socket_path, timeout=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def predict_proba(self, pixels):
+        """Send a ``(n, h, w, c)`` uint8 batch and return ``(n, classes)`` probabilities"""
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        header = REQUEST_HEADER.pack(MAGIC, OP_PREDICT, *pixels.shape)
+        return self._with_retry(lambda: self._call(header, pixels.data))
+
+    def predict_slots(self, ring, indices):
+        """Run READY slots of ``ring`` (created by this process) through the model.
+
+        Only the slot indices cross the socket; the server reads the pixels
+        straight out of shared memory.
+        """
+        header = REQUEST_HEADER.pack(MAGIC, OP_PREDICT_SHM, len(indices), 0, 0, 0)
+        payload = np.asarray(indices, dtype=_SLOT_INDEX_DTYPE).tobytes()
+
+        def request():
+            # A retry resends slots the server may already have started
+            # reading; they are still ours until released, so mark them again
+            for index in indices:
+                ring.mark_ready(index)
+            if getattr(self._local, 'ring', None) != ring.name:
+                name = ring.name.encode('utf-8')
+                attach = REQUEST_HEADER.pack(MAGIC, OP_ATTACH, ring.slots, *ring.shape)
+                self._call(attach, NAME_LENGTH.pack(len(name)) + name)
+                self._local.ring = ring.name
+            return self._call(header, payload)
+
+        return self._with_retry(request)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+        self._local.ring = None
+
+    def _with_retry(self, request):
+        try:
+            return request()
+        except OSError:
+            # The server may have restarted since this connection was opened
+            self.close()
+            return request()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, header, payload):
+        conn = self._connection()
+        conn.sendall(header)
+        try:
+            conn.sendall(payload)
+            refused = False
+        except (BrokenPipeError, ConnectionResetError):
+            # The server refuses some requests from the header alone and hangs
+            # up without reading the payload; its error response is still there
+            refused = True
+
+        response = recv_exact(conn, RESPONSE_HEADER.size)
+        if response is None:
+            raise ConnectionResetError("Model server closed the connection")
+        magic, status, count, classes = RESPONSE_HEADER.unpack(response)
+        if magic != MAGIC:
+            self.close()
+            raise ModelServerError("Unexpected response from model server")
+
+        if status != STATUS_OK:
+            message = recv_exact(conn, count) or b''
+            if refused:
+                self.close()
+            raise ModelServerError(message.decode('utf-8', 'replace'))
+
+        payload = recv_exact(conn, count * classes * _PROBABILITY_DTYPE.itemsize)
+        if payload is None:
+            raise ConnectionResetError("Model server closed the connection")
+        return np.frombuffer(payload, dtype=_PROBABILITY_DTYPE).reshape(count, classes)
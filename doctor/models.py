@@ -2,6 +2,8 @@ from django.db import models
 # from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .storage import prediction_storage
+
 class Crop(models.Model):
     """Model to store crop information"""
     name = models.CharField(max_length=100)
@@ -16,6 +18,9 @@ class Crop(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name', 'id'], name='crop_name_id_idx'),
+        ]
 
 class Disease(models.Model):
     """Model to store disease information"""
@@ -39,6 +44,12 @@ class Disease(models.Model):
 
     class Meta:
         ordering = ['crop__name', 'name']
+        indexes = [
+            # A crop's diseases by (name, id). The diseases list orders by the
+            # crop's *name*, which is on another table, so that page still sorts
+            # (a catalogue-sized table, so that is cheap)
+            models.Index(fields=['crop', 'name', 'id'], name='disease_crop_name_id_idx'),
+        ]
 
 class Treatment(models.Model):
     """Model to store treatment recommendations"""
@@ -70,8 +81,8 @@ class Treatment(models.Model):
 class Prediction(models.Model):
     """Model to store prediction results"""
     # user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
-    image = models.ImageField(upload_to='predictions/', null=True, blank=True)
-    
+    image = models.ImageField(upload_to='predictions/', storage=prediction_storage, null=True, blank=True)
+
     predicted_crop = models.CharField(max_length=100)
     predicted_disease = models.CharField(max_length=200)
     confidence_score = models.FloatField()
@@ -84,15 +95,93 @@ class Prediction(models.Model):
     actual_disease = models.CharField(max_length=200, blank=True)
     is_correct = models.BooleanField(null=True, blank=True)
 
+    # Registry version of the model that made the prediction (blank before versioning)
+    model_version = models.CharField(max_length=100, blank=True)
+
+    # Handed to the client before the row is written by the background writer
+    reference = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.predicted_crop} - {self.predicted_disease} ({self.confidence_score:.2f}%)"
 
+    @property
+    def thumbnail_url(self):
+        """URL of the downscaled copy written at upload time, falling back to the image"""
+        if not self.image:
+            return ''
+        thumbnail_name = getattr(self.image.storage, 'thumbnail_name', lambda name: None)(self.image.name)
+        if thumbnail_name:
+            return self.image.storage.url(thumbnail_name)
+        return self.image.url
+
     class Meta:
         ordering = ['-created_at']
         verbose_name = "Prediction Result"
         verbose_name_plural = "Prediction Results"
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='prediction_created_id_idx'),
+            models.Index(fields=['is_correct', 'created_at'], name='prediction_correct_created_idx'),
+            models.Index(fields=['predicted_crop', 'created_at'], name='prediction_crop_created_idx'),
+        ]
+
+
+class DailyPredictionStats(models.Model):
+    """Per-day prediction counts for each predicted class, kept up to date as predictions are written"""
+    date = models.DateField()
+    predicted_crop = models.CharField(max_length=100)
+    predicted_disease = models.CharField(max_length=200)
+    prediction_count = models.PositiveIntegerField(default=0)
+    correct_count = models.PositiveIntegerField(default=0)
+    confidence_sum = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.date} {self.predicted_crop} - {self.predicted_disease}: {self.prediction_count}"
+
+    @property
+    def mean_confidence(self):
+        return self.confidence_sum / self.prediction_count if self.prediction_count else 0
+
+    class Meta:
+        ordering = ['-date', 'predicted_crop', 'predicted_disease']
+        verbose_name = "Daily Prediction Statistics"
+        verbose_name_plural = "Daily Prediction Statistics"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'predicted_crop', 'predicted_disease'], name='daily_prediction_stats_unique',
+            ),
+        ]
+
+
+class ShadowComparison(models.Model):
+    """Daily counts of how a candidate model classified the live uploads the served model classified (see shadow.py)"""
+    date = models.DateField()
+    primary_version = models.CharField(max_length=100)
+    candidate_version = models.CharField(max_length=100)
+    primary_class = models.CharField(max_length=200)
+    candidate_class = models.CharField(max_length=200)
+    count = models.PositiveIntegerField(default=0)
+    primary_confidence_sum = models.FloatField(default=0)
+    candidate_confidence_sum = models.FloatField(default=0)
+    primary_seconds_sum = models.FloatField(default=0)
+    candidate_seconds_sum = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.date} {self.primary_class} -> {self.candidate_class}: {self.count}"
+
+    @property
+    def agrees(self):
+        return self.primary_class == self.candidate_class
+
+    class Meta:
+        ordering = ['-date', 'candidate_version', '-count']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'primary_version', 'candidate_version', 'primary_class', 'candidate_class'],
+                name='shadow_comparison_unique',
+            ),
+        ]
 
 
 class CropTip(models.Model):
@@ -123,3 +212,34 @@ class CropTip(models.Model):
 
     class Meta:
         ordering = ['crop__name', 'tip_type', 'title']
+
+
+class SearchDocument(models.Model):
+    """Denormalized text of a disease, treatment or crop tip, indexed for full-text search (see search.py)"""
+    KIND_DISEASE = 'disease'
+    KIND_TREATMENT = 'treatment'
+    KIND_TIP = 'tip'
+
+    kind = models.CharField(max_length=20, choices=[
+        (KIND_DISEASE, 'Disease'),
+        (KIND_TREATMENT, 'Treatment'),
+        (KIND_TIP, 'Crop tip'),
+    ])
+    object_id = models.PositiveBigIntegerField()
+    disease_id = models.PositiveBigIntegerField(null=True, blank=True)
+    crop_id = models.PositiveBigIntegerField(null=True, blank=True)
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+    crop_name = models.CharField(max_length=100, blank=True)
+
+    def __str__(self):
+        return f"{self.kind}: {self.title}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_document_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['crop_id'], name='search_document_crop_idx'),
+            models.Index(fields=['disease_id'], name='search_document_disease_idx'),
+        ]
@@ -0,0 +1,140 @@
+from datetime import date, datetime
+from functools import reduce
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+_SALT = 'doctor.pagination'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, direction):
+    """Opaque, tamper-proof token for the position after (or before) ``values``"""
+    payload = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return signing.dumps([direction, payload], salt=_SALT, compress=True)
+
+
+def decode_cursor(token):
+    try:
+        direction, values = signing.loads(token, salt=_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor(token)
+    return direction, values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+class KeysetPaginator:
+    """Cursor pagination over a unique ``ordering`` such as ``('-created_at', '-id')``.
+
+    Each page is one ``WHERE (key) > (cursor) ORDER BY key LIMIT n + 1`` query
+    that an index on the ordering columns answers directly, so page 1000
+    costs the same as page 1 and no ``COUNT(*)`` is needed. The last field of
+    ``ordering`` must make it unique (normally the primary key).
+    """
+
+    def __init__(self, queryset, ordering, per_page=20):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self._converters = [self._converter(field) for field in self.fields]
+
+    def page(self, cursor=None):
+        """The page after/before ``cursor``; the first page for a missing or invalid cursor"""
+        direction, values = 'next', None
+        if cursor:
+            try:
+                direction, values = decode_cursor(cursor)
+                values = [convert(value) for convert, value in zip(self._converters, values)]
+            except (InvalidCursor, ValidationError, ValueError, TypeError):
+                direction, values = 'next', None
+            if values is not None and len(values) != len(self.fields):
+                direction, values = 'next', None
+
+        backwards = direction == 'prev'
+        ordering = [self._flip(field) for field in self.ordering] if backwards else list(self.ordering)
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._after(ordering, values))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        # Going forwards there is a previous page whenever we started from a
+        # cursor; going backwards there is always a next page
+        more_after = has_more if not backwards else True
+        more_before = values is not None if not backwards else has_more
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(self._key(rows[-1]), 'next') if more_after else None,
+            previous_cursor=encode_cursor(self._key(rows[0]), 'prev') if more_before else None,
+        )
+
+    def _key(self, obj):
+        return [reduce(getattr, field.split('__'), obj) for field in self.fields]
+
+    def _after(self, ordering, values):
+        # (a, b, c) > (x, y, z)  ==  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z),
+        # with < for descending fields
+        clauses = []
+        for position, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f"{name}__{lookup}": values[position]})
+            for previous, value in zip(self.fields[:position], values):
+                clause &= Q(**{previous: value})
+            clauses.append(clause)
+        # The OR alone is not sargable; bounding the leading column as well
+        # lets the database seek into the index instead of scanning it from the start
+        leading = ordering[0]
+        bound = Q(**{f"{leading.lstrip('-')}__{'lte' if leading.startswith('-') else 'gte'}": values[0]})
+        return bound & reduce(lambda left, right: left | right, clauses)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f"-{field}"
+
+    def _converter(self, path):
+        model = self.queryset.model
+        parts = path.split('__')
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+        field = model._meta.pk if parts[-1] == 'pk' else model._meta.get_field(parts[-1])
+        return field.to_python
@@ -0,0 +1,164 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Prediction
+from .stats import record_predictions
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class PredictionWriter:
+    """Saves Prediction rows from a background thread in bulk transactions.
+
+    Views hand over unsaved instances with ``enqueue()``; the writer collects
+    rows for up to ``flush_interval`` seconds after the first one arrives and
+    inserts them with one ``bulk_create`` of at most ``batch_size`` rows. The
+    queue is bounded: when it is full the caller saves its row itself, so a
+    slow database slows requests down instead of losing predictions.
+    """
+
+    def __init__(self, maxsize=1000, batch_size=100, flush_interval=0.2):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.failed = 0
+
+    def enqueue(self, prediction):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(prediction)
+        except queue.Full:
+            logger.warning("Prediction write queue is full, saving synchronously")
+            self.write([prediction])
+
+    def write(self, predictions):
+        """Insert ``predictions`` in one transaction, isolating bad rows on failure"""
+        try:
+            with transaction.atomic():
+                Prediction.objects.bulk_create(predictions)
+                record_predictions(predictions)
+            self.written += len(predictions)
+            return
+        except Exception as e:
+            if len(predictions) == 1:
+                self.failed += 1
+                logger.error(f"Could not save prediction: {e}")
+                return
+            logger.error(f"Bulk insert of {len(predictions)} predictions failed, retrying one by one: {e}")
+
+        for prediction in predictions:
+            self.write([prediction])
+
+    def shutdown(self, timeout=10.0):
+        """Stop the worker thread and save everything still queued"""
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+        self._thread = None
+
+        pending = self._drain()
+        if pending:
+            self.write(pending)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'written': self.written,
+            'failed': self.failed,
+        }
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Rows queued before fork() belong to the parent process
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                atexit.register(self.shutdown)
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+            self._thread.start()
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+
+            # Give concurrent requests a moment to join the same transaction
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self.write(batch)
+                    return
+                batch.append(item)
+            self.write(batch)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_prediction_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = settings.PREDICTION_WRITER
+                _writer = PredictionWriter(
+                    maxsize=config['QUEUE_SIZE'],
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                )
+    return _writer
+
+
+def save_prediction(prediction):
+    """Persist ``prediction`` off the request path when async writes are enabled"""
+    if settings.PREDICTION_WRITER['ASYNC']:
+        get_prediction_writer().enqueue(prediction)
+    else:
+        with transaction.atomic():
+            prediction.save()
+            record_predictions([prediction])
+
+
+def shutdown():
+    """Flush queued predictions; called from gunicorn's worker_exit hook"""
+    if _writer is not None:
+        _writer.shutdown()
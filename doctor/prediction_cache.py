@@ -0,0 +1,104 @@
+import hashlib
+import os
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+
+
+def hash_upload(upload):
+    """Return ``(sha256 hex digest, bytes)`` of an uploaded file"""
+    if hasattr(upload, 'seek'):
+        upload.seek(0)
+    data = upload.read()
+    return hashlib.sha256(data).hexdigest(), data
+
+
+def model_fingerprint(path):
+    """mtime and size of a model artifact, so a file replaced in place gets new keys"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 'missing'
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+class PredictionCache:
+    """Bounded LRU/TTL cache of prediction results keyed by image content hash.
+
+    Keys carry the ``model_key`` of the predictor that produced the result
+    (see AIPredictor.cache_key: version, artifact fingerprint, backend and
+    calibration), so results of a previous model, an artifact overwritten in
+    place or another runtime are never served.
+    When ``backend`` names a Django cache alias, results are shared between
+    workers through it too.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, backend=None):
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._shared = caches[backend] if backend else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(digest, model_key):
+        return f"prediction:{model_key}:{digest}"
+
+    def get(self, digest, model_key):
+        key = self._key(digest, model_key)
+        with self._lock:
+            result = self._local.get(key)
+
+        if result is None and self._shared is not None:
+            result = self._shared.get(key)
+            if result is not None:
+                with self._lock:
+                    self._local[key] = result
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        # Callers get their own copy to decorate
+        return dict(result) if result is not None else None
+
+    def set(self, digest, result, model_key):
+        key = self._key(digest, model_key)
+        with self._lock:
+            self._local[key] = dict(result)
+        if self._shared is not None:
+            self._shared.set(key, dict(result), self.ttl)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+                'size': len(self._local),
+                'maxsize': self._local.maxsize,
+                'shared_backend': self._shared is not None,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = settings.PREDICTION_CACHE
+                _cache = PredictionCache(
+                    maxsize=config['MAXSIZE'],
+                    ttl=config['TTL'],
+                    backend=config['BACKEND'],
+                )
+    return _cache
@@ -0,0 +1,69 @@
+import numpy as np
+from PIL import Image
+
+# (width, height) the model was trained on
+TARGET_SIZE = (256, 256)
+
+_SCALE = np.float32(1.0 / 255.0)
+
+
+def load_image(fp, size=TARGET_SIZE):
+    """Decode ``fp`` straight to an RGB image of ``size``.
+
+    For JPEGs ``draft()`` lets libjpeg shrink the image by 1/2, 1/4 or 1/8 in
+    the DCT domain while decoding, so a 12 MP photo is never materialised at
+    full resolution. The remaining resize uses ``reducing_gap`` so PIL does
+    another cheap integer ``reduce()`` before the final bilinear pass.
+    """
+    return resize_image(decode_image(fp, size), size)
+
+
+def decode_image(fp, size=TARGET_SIZE):
+    """The decode half of load_image(): an RGB image, already downscaled towards ``size``"""
+    img = Image.open(fp)
+    img.draft('RGB', size)
+    return img.convert('RGB')
+
+
+def resize_image(img, size=TARGET_SIZE):
+    """The resize half of load_image()"""
+    if img.size != size:
+        img = img.resize(size, Image.BILINEAR, reducing_gap=3.0)
+    return img
+
+
+def preprocess_into(fp, out, size=TARGET_SIZE):
+    """Write the pixels of ``fp`` into the preallocated ``(h, w, 3)`` array ``out``.
+
+    A float32 ``out`` receives values normalized to [0, 1]; a uint8 ``out``
+    receives the raw pixels, leaving normalization to the model side.
+    """
+    return write_pixels(load_image(fp, size), out)
+
+
+def write_pixels(img, out):
+    """The last step of preprocess_into(): copy or normalize ``img`` into ``out``"""
+    pixels = np.asarray(img)
+    if out.dtype == np.uint8:
+        np.copyto(out, pixels)
+    else:
+        np.multiply(pixels, _SCALE, out=out, casting='unsafe')
+    return out
+
+
+class BatchBuffer:
+    """Reusable ``(capacity, h, w, 3)`` array that images are preprocessed into"""
+
+    def __init__(self, capacity, size=TARGET_SIZE, dtype=np.float32):
+        self.size = size
+        self.array = np.empty((capacity, size[1], size[0], 3), dtype=dtype)
+
+    @property
+    def capacity(self):
+        return self.array.shape[0]
+
+    def fill(self, index, fp):
+        return preprocess_into(fp, self.array[index], self.size)
+
+    def batch(self, count):
+        return self.array[:count]
@@ -0,0 +1,205 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import CropTip, Disease, SearchDocument, Treatment
+
+# SQLite: an FTS5 index over doctor_searchdocument that triggers keep in step
+# with the table. Prefix indexes make "tom*" as cheap as a full-word match.
+SQLITE_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS doctor_search_fts USING fts5(
+        title, body, crop_name,
+        content='doctor_searchdocument', content_rowid='id',
+        tokenize='porter unicode61', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS doctor_search_ai AFTER INSERT ON doctor_searchdocument BEGIN
+        INSERT INTO doctor_search_fts(rowid, title, body, crop_name)
+        VALUES (new.id, new.title, new.body, new.crop_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS doctor_search_ad AFTER DELETE ON doctor_searchdocument BEGIN
+        INSERT INTO doctor_search_fts(doctor_search_fts, rowid, title, body, crop_name)
+        VALUES ('delete', old.id, old.title, old.body, old.crop_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS doctor_search_au AFTER UPDATE ON doctor_searchdocument BEGIN
+        INSERT INTO doctor_search_fts(doctor_search_fts, rowid, title, body, crop_name)
+        VALUES ('delete', old.id, old.title, old.body, old.crop_name);
+        INSERT INTO doctor_search_fts(rowid, title, body, crop_name)
+        VALUES (new.id, new.title, new.body, new.crop_name);
+    END
+    """,
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS doctor_search_au",
+    "DROP TRIGGER IF EXISTS doctor_search_ad",
+    "DROP TRIGGER IF EXISTS doctor_search_ai",
+    "DROP TABLE IF EXISTS doctor_search_fts",
+]
+
+# PostgreSQL: a GIN index on the same tsvector expression the query uses
+_PG_VECTOR = (
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', crop_name), 'B') || "
+    "setweight(to_tsvector('english', body), 'C')"
+)
+POSTGRES_SCHEMA = [f"CREATE INDEX IF NOT EXISTS doctor_search_vector_idx ON doctor_searchdocument USING GIN (({_PG_VECTOR}))"]
+POSTGRES_DROP = ["DROP INDEX IF EXISTS doctor_search_vector_idx"]
+
+# bm25() weights for title, body, crop_name
+_SQLITE_WEIGHTS = (10.0, 1.0, 5.0)
+
+
+def install(schema_editor, drop=False):
+    """Create (or drop) the full-text index for the current database vendor"""
+    vendor = schema_editor.connection.vendor
+    statements = {
+        'sqlite': SQLITE_DROP if drop else SQLITE_SCHEMA,
+        'postgresql': POSTGRES_DROP if drop else POSTGRES_SCHEMA,
+    }.get(vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def terms(query):
+    """Lowercase word tokens of a search box query"""
+    return re.findall(r'\w+', query.lower())[:10]
+
+
+def readable(name):
+    # Class-style names ('Tomato___Early_blight') become plain words
+    return re.sub(r'_+', ' ', name).strip()
+
+
+def search(query, limit=20, kinds=None):
+    """Ranked documents matching every word of ``query`` as a prefix ("tom lat" finds "Tomato Late blight").
+
+    Returns SearchDocument instances, best match first.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    kinds = list(kinds or ())
+
+    if connection.vendor == 'sqlite':
+        # Quoted so FTS5 treats user input as plain terms, not query syntax
+        match = ' '.join(f'"{word}"*' for word in words)
+        sql = (
+            "SELECT d.id FROM doctor_search_fts f JOIN doctor_searchdocument d ON d.id = f.rowid "
+            "WHERE doctor_search_fts MATCH %s"
+        )
+        params = [match]
+        order = "ORDER BY bm25(doctor_search_fts, %s, %s, %s)"
+        order_params = list(_SQLITE_WEIGHTS)
+    elif connection.vendor == 'postgresql':
+        tsquery = ' & '.join(f"{word}:*" for word in words)
+        sql = f"SELECT d.id FROM doctor_searchdocument d WHERE ({_PG_VECTOR}) @@ to_tsquery('english', %s)"
+        params = [tsquery]
+        order = f"ORDER BY ts_rank({_PG_VECTOR}, to_tsquery('english', %s)) DESC"
+        order_params = [tsquery]
+    else:
+        documents = SearchDocument.objects.all()
+        for word in words:
+            documents = documents.filter(Q(title__icontains=word) | Q(body__icontains=word))
+        if kinds:
+            documents = documents.filter(kind__in=kinds)
+        return list(documents.order_by('title')[:limit])
+
+    if kinds:
+        sql += f" AND d.kind IN ({', '.join(['%s'] * len(kinds))})"
+        params += kinds
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} {order} LIMIT %s", params + order_params + [limit])
+        ids = [row[0] for row in cursor.fetchall()]
+
+    documents = SearchDocument.objects.in_bulk(ids)
+    return [documents[pk] for pk in ids if pk in documents]
+
+
+def _upsert(kind, object_id, **fields):
+    SearchDocument.objects.update_or_create(kind=kind, object_id=object_id, defaults=fields)
+
+
+def index_disease(disease):
+    _upsert(
+        SearchDocument.KIND_DISEASE, disease.pk,
+        disease_id=disease.pk, crop_id=disease.crop_id,
+        title=readable(disease.name), body='', crop_name=disease.crop.name,
+    )
+
+
+def index_treatment(treatment):
+    disease = treatment.disease
+    _upsert(
+        SearchDocument.KIND_TREATMENT, treatment.pk,
+        disease_id=disease.pk, crop_id=disease.crop_id,
+        title=treatment.title, body=f"{readable(disease.name)} {treatment.instructions}", crop_name=disease.crop.name,
+    )
+
+
+def index_tip(tip):
+    _upsert(
+        SearchDocument.KIND_TIP, tip.pk,
+        disease_id=None, crop_id=tip.crop_id,
+        title=tip.title, body=tip.content, crop_name=tip.crop.name,
+    )
+
+
+def rebuild(disease_model=Disease, treatment_model=Treatment, tip_model=CropTip, document_model=SearchDocument):
+    """Re-create every search document from the catalogue tables (models are swappable for migrations)"""
+    documents = []
+    for disease in disease_model.objects.select_related('crop'):
+        documents.append(document_model(
+            kind=SearchDocument.KIND_DISEASE, object_id=disease.pk, disease_id=disease.pk,
+            crop_id=disease.crop_id, title=readable(disease.name), crop_name=disease.crop.name,
+        ))
+    for treatment in treatment_model.objects.select_related('disease__crop'):
+        disease = treatment.disease
+        documents.append(document_model(
+            kind=SearchDocument.KIND_TREATMENT, object_id=treatment.pk, disease_id=disease.pk,
+            crop_id=disease.crop_id, title=treatment.title,
+            body=f"{readable(disease.name)} {treatment.instructions}", crop_name=disease.crop.name,
+        ))
+    for tip in tip_model.objects.select_related('crop'):
+        documents.append(document_model(
+            kind=SearchDocument.KIND_TIP, object_id=tip.pk, crop_id=tip.crop_id,
+            title=tip.title, body=tip.content, crop_name=tip.crop.name,
+        ))
+    with transaction.atomic():
+        document_model.objects.all().delete()
+        document_model.objects.bulk_create(documents, batch_size=500)
+    return len(documents)
+
+
+# Signal receivers, connected in DoctorConfig.ready()
+
+def sync_saved(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    if sender is Disease:
+        index_disease(instance)
+        # The crop of its treatments may have changed with it
+        for treatment in instance.treatments.select_related('disease__crop'):
+            index_treatment(treatment)
+    elif sender is Treatment:
+        index_treatment(instance)
+    elif sender is CropTip:
+        index_tip(instance)
+    else:
+        SearchDocument.objects.filter(crop_id=instance.pk).update(crop_name=instance.name)
+
+
+def sync_deleted(sender, instance, **kwargs):
+    kind = {
+        Disease: SearchDocument.KIND_DISEASE,
+        Treatment: SearchDocument.KIND_TREATMENT,
+        CropTip: SearchDocument.KIND_TIP,
+    }.get(sender)
+    if kind is not None:
+        SearchDocument.objects.filter(kind=kind, object_id=instance.pk).delete()
@@ -0,0 +1,259 @@
+import atexit
+import io
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ShadowComparison
+from .preprocessing import BatchBuffer
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ShadowEvaluator:
+    """Runs a sample of live uploads through a candidate model version, off the response path.
+
+    ``offer()`` is called after the served model has answered: with
+    probability ``sample_rate`` it queues the upload's bytes and the served
+    result without blocking, and drops them if the bounded queue is full. A
+    background thread decodes queued uploads at the candidate's input size,
+    runs them through the candidate ``batch_size`` at a time, and only once
+    ``wait_idle(timeout)`` reports that no live inference is running, so
+    shadow work yields to user requests. Agreement counts per (served class, candidate
+    class) pair and the latency of both models are added up in memory and
+    written to ShadowComparison every ``flush_interval`` seconds.
+    """
+
+    def __init__(self, version, sample_rate=0.05, maxsize=256, batch_size=16, flush_interval=30.0,
+                 wait_idle=None, max_idle_wait=5.0):
+        self.version = version
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.wait_idle = wait_idle or (lambda timeout: True)
+        self.max_idle_wait = max_idle_wait
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._candidate = None
+        self._buffer = None
+        self._pending = defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0.0])
+        self.sampled = 0
+        self.dropped = 0
+        self.compared = 0
+        self.disagreed = 0
+        self.failed = 0
+
+    def offer(self, image, result, seconds):
+        """Maybe queue ``image`` (served as ``result`` in ``seconds``) for the candidate; never blocks"""
+        if random.random() >= self.sample_rate or result.get('model_version') == self.version:
+            return
+        if hasattr(image, 'seek'):
+            image.seek(0)
+        data = image.read()
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((data, result['model_version'], result['class_name'], result['confidence'], seconds))
+            self.sampled += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self, timeout=10.0):
+        """Stop the worker and write out the counts gathered so far (queued uploads are dropped)"""
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                self._drain()
+                self._queue.put_nowait(_STOP)
+            thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def stats(self):
+        return {
+            'candidate_version': self.version,
+            'sample_rate': self.sample_rate,
+            'queue_depth': self._queue.qsize(),
+            'sampled': self.sampled,
+            'dropped': self.dropped,
+            'compared': self.compared,
+            'disagreement_rate': (self.disagreed / self.compared) if self.compared else 0.0,
+            'failed': self.failed,
+        }
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Uploads queued before fork() belong to the parent process
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._pending = defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0.0])
+                atexit.register(self.shutdown)
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='shadow-evaluator', daemon=True)
+            self._thread.start()
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _load_candidate(self):
+        from .ai_service import AIPredictor
+        from .model_registry import load_manifest
+
+        # Always in this process: the model server only runs the served version
+        candidate = AIPredictor(manifest=load_manifest(self.version), backend=settings.INFERENCE_BACKEND)
+        candidate.load()
+        self._buffer = BatchBuffer(self.batch_size, candidate.input_shape[1::-1], candidate.input_dtype)
+        return candidate
+
+    def _run(self):
+        try:
+            self._candidate = self._load_candidate()
+        except Exception as e:
+            logger.error(f"Could not load shadow model {self.version}; shadow evaluation is off: {e}")
+            self.sample_rate = 0.0
+            self._drain()
+            return
+
+        flush_at = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                first = self._queue.get(timeout=max(0.0, flush_at - time.monotonic()))
+            except queue.Empty:
+                first = None
+            if first is _STOP:
+                return
+            if first is not None:
+                batch = [first]
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        self._evaluate(batch)
+                        return
+                    batch.append(item)
+                self._evaluate(batch)
+            if time.monotonic() >= flush_at:
+                self.flush()
+                flush_at = time.monotonic() + self.flush_interval
+
+    def _evaluate(self, batch):
+        if not self.wait_idle(self.max_idle_wait):
+            # Live traffic never let up; these samples are not worth slowing it down for
+            self.dropped += len(batch)
+            return
+
+        items = []
+        for data, *served in batch:
+            try:
+                self._buffer.fill(len(items), io.BytesIO(data))
+            except (OSError, ValueError):
+                continue
+            items.append(served)
+        if not items:
+            return
+
+        started = time.monotonic()
+        try:
+            results = self._candidate.predict_arrays(self._buffer.batch(len(items)))
+        except Exception as e:
+            self.failed += len(items)
+            logger.error(f"Shadow inference failed for {len(items)} upload(s): {e}")
+            return
+        seconds = (time.monotonic() - started) / len(items)
+
+        with self._lock:
+            for (primary_version, primary_class, primary_confidence, primary_seconds), result in zip(items, results):
+                key = (timezone.localdate(), primary_version, primary_class, result['class_name'])
+                totals = self._pending[key]
+                totals[0] += 1
+                totals[1] += primary_confidence
+                totals[2] += result['confidence']
+                totals[3] += primary_seconds
+                totals[4] += seconds
+                self.compared += 1
+                self.disagreed += primary_class != result['class_name']
+
+    def flush(self):
+        """Add the counts gathered since the last flush to ShadowComparison"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0.0])
+        if not pending:
+            return
+        close_old_connections()
+        try:
+            with transaction.atomic():
+                for (date, primary_version, primary_class, candidate_class), totals in pending.items():
+                    row, _ = ShadowComparison.objects.get_or_create(
+                        date=date, primary_version=primary_version, candidate_version=self.version,
+                        primary_class=primary_class, candidate_class=candidate_class,
+                    )
+                    # Incremented in SQL: every worker adds to the same rows
+                    ShadowComparison.objects.filter(pk=row.pk).update(
+                        count=F('count') + totals[0],
+                        primary_confidence_sum=F('primary_confidence_sum') + totals[1],
+                        candidate_confidence_sum=F('candidate_confidence_sum') + totals[2],
+                        primary_seconds_sum=F('primary_seconds_sum') + totals[3],
+                        candidate_seconds_sum=F('candidate_seconds_sum') + totals[4],
+                    )
+        except Exception as e:
+            logger.error(f"Could not save shadow comparisons: {e}")
+
+
+def _wait_for_idle_inference(timeout):
+    from .executor import get_inference_executor
+    return get_inference_executor().wait_idle(timeout)
+
+
+_evaluator = None
+_evaluator_lock = threading.Lock()
+
+
+def get_shadow_evaluator():
+    """The process-wide ShadowEvaluator, or None when SHADOW_MODEL['VERSION'] is unset"""
+    global _evaluator
+    config = settings.SHADOW_MODEL
+    if _evaluator is None and config['VERSION'] and config['SAMPLE_RATE'] > 0:
+        with _evaluator_lock:
+            if _evaluator is None:
+                if settings.MODEL_SERVER_SOCKET:
+                    logger.warning("SHADOW_MODEL loads the candidate model in every web worker, next to the model server")
+                _evaluator = ShadowEvaluator(
+                    config['VERSION'],
+                    sample_rate=config['SAMPLE_RATE'],
+                    maxsize=config['QUEUE_SIZE'],
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    wait_idle=_wait_for_idle_inference,
+                )
+    return _evaluator
+
+
+def shutdown():
+    """Write out pending comparisons; called from gunicorn's worker_exit hook"""
+    if _evaluator is not None:
+        _evaluator.shutdown()
@@ -0,0 +1,121 @@
+import os
+import secrets
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Slot lifecycle: the owner acquires a FREE slot (WRITING), fills it and marks
+# it READY; the model process only reads READY slots (READING, then DONE);
+# the owner releases the slot back to FREE once it has the answer.
+SLOT_FREE = 0
+SLOT_WRITING = 1
+SLOT_READY = 2
+SLOT_READING = 3
+SLOT_DONE = 4
+
+_HEADER_ALIGN = 64
+
+
+class RingFull(Exception):
+    pass
+
+
+class SlotNotReady(RuntimeError):
+    pass
+
+
+class SharedTensorRing:
+    """Ring of preallocated shared-memory slots holding one uint8 image each.
+
+    The segment starts with one state byte per slot, followed by the slot
+    arrays. The process that ``create()``s the ring (a web worker) owns slot
+    allocation: its threads ``acquire()`` a slot, blocking for up to
+    ``timeout`` seconds when all are in use, write pixels into
+    ``array(index)``, and ``release()`` the slot once the model process has
+    answered. The model process ``attach()``es by name and reads READY slots
+    as zero-copy NumPy views.
+    """
+
+    def __init__(self, shm, slots, shape, owner):
+        self.shm = shm
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.owner = owner
+        header_size = -(-slots // _HEADER_ALIGN) * _HEADER_ALIGN
+        self.states = np.ndarray((slots,), dtype=np.uint8, buffer=shm.buf)
+        self.arrays = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=header_size)
+        self._free = list(range(slots))
+        self._available = threading.Condition()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @staticmethod
+    def segment_size(slots, shape):
+        header_size = -(-slots // _HEADER_ALIGN) * _HEADER_ALIGN
+        return header_size + slots * int(np.prod(shape))
+
+    @classmethod
+    def create(cls, slots, shape):
+        name = f"agrodoctor-{os.getpid()}-{secrets.token_hex(4)}"
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.segment_size(slots, shape))
+        ring = cls(shm, slots, shape, owner=True)
+        ring.states[:] = SLOT_FREE
+        return ring
+
+    @classmethod
+    def attach(cls, name, slots, shape, track=False):
+        shm = shared_memory.SharedMemory(name=name)
+        if not track:
+            # Only the creating process may unlink the segment; stop this
+            # process's resource tracker from doing so when it exits. Children
+            # of the creator share its tracker and must pass track=True.
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        if shm.size < cls.segment_size(slots, shape):
+            shm.close()
+            raise ValueError(f"Shared memory segment {name} is too small")
+        return cls(shm, slots, shape, owner=False)
+
+    def array(self, index):
+        return self.arrays[index]
+
+    def acquire(self, timeout=None):
+        """Take ownership of a free slot, waiting up to ``timeout`` seconds"""
+        with self._available:
+            if not self._available.wait_for(lambda: self._free, timeout):
+                raise RingFull(f"All {self.slots} shared memory slots are in use")
+            index = self._free.pop()
+        self.states[index] = SLOT_WRITING
+        return index
+
+    def mark_ready(self, index):
+        self.states[index] = SLOT_READY
+
+    def release(self, index):
+        self.states[index] = SLOT_FREE
+        with self._available:
+            self._free.append(index)
+            self._available.notify()
+
+    def read(self, indices):
+        """Model side: zero-copy views of the READY slots ``indices``"""
+        views = []
+        for index in indices:
+            if self.states[index] != SLOT_READY:
+                raise SlotNotReady(f"Slot {index} of {self.name} is not ready")
+            self.states[index] = SLOT_READING
+            views.append(self.arrays[index])
+        return views
+
+    def finish(self, indices):
+        for index in indices:
+            self.states[index] = SLOT_DONE
+
+    def close(self):
+        # Views into the buffer must go before the segment can be closed
+        self.states = self.arrays = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
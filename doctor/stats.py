@@ -0,0 +1,89 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyPredictionStats, Prediction
+
+
+def _day(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def record_predictions(predictions):
+    """Add freshly inserted ``predictions`` to the daily statistics.
+
+    Call inside the transaction that inserted them, so the counts and the
+    rows are committed together.
+    """
+    groups = defaultdict(lambda: [0, 0, 0.0])
+    for prediction in predictions:
+        group = groups[(_day(prediction.created_at), prediction.predicted_crop, prediction.predicted_disease)]
+        group[0] += 1
+        group[1] += prediction.is_correct is True
+        group[2] += prediction.confidence_score
+
+    for (date, crop, disease), (count, correct, confidence) in groups.items():
+        stats, _ = DailyPredictionStats.objects.get_or_create(
+            date=date, predicted_crop=crop, predicted_disease=disease)
+        # Incremented in SQL: other workers update the same rows concurrently
+        DailyPredictionStats.objects.filter(pk=stats.pk).update(
+            prediction_count=F('prediction_count') + count,
+            correct_count=F('correct_count') + correct,
+            confidence_sum=F('confidence_sum') + confidence,
+        )
+
+
+def record_correction(prediction, was_correct):
+    """Keep ``correct_count`` in step when a prediction is marked (in)correct after it was saved"""
+    delta = (prediction.is_correct is True) - (was_correct is True)
+    if delta:
+        DailyPredictionStats.objects.filter(
+            date=_day(prediction.created_at),
+            predicted_crop=prediction.predicted_crop,
+            predicted_disease=prediction.predicted_disease,
+        ).update(correct_count=F('correct_count') + delta)
+
+
+def totals():
+    """Prediction and correct totals over all days, in one aggregate query"""
+    result = DailyPredictionStats.objects.aggregate(
+        total=Sum('prediction_count', default=0),
+        correct=Sum('correct_count', default=0),
+    )
+    return result['total'], result['correct']
+
+
+def rebuild(prediction_model=Prediction, stats_model=DailyPredictionStats, since=None):
+    """Recompute the statistics from the Prediction table (for days on or after ``since``)"""
+    predictions = prediction_model.objects.all()
+    stats = stats_model.objects.all()
+    if since is not None:
+        predictions = predictions.filter(created_at__date__gte=since)
+        stats = stats.filter(date__gte=since)
+
+    rows = (
+        predictions.annotate(day=TruncDate('created_at'))
+        .values('day', 'predicted_crop', 'predicted_disease')
+        .annotate(
+            count=Count('id'),
+            correct=Count('id', filter=Q(is_correct=True)),
+            confidence=Sum('confidence_score'),
+        )
+        .order_by()
+    )
+    with transaction.atomic():
+        stats.delete()
+        stats_model.objects.bulk_create([
+            stats_model(
+                date=row['day'],
+                predicted_crop=row['predicted_crop'],
+                predicted_disease=row['predicted_disease'],
+                prediction_count=row['count'],
+                correct_count=row['correct'],
+                confidence_sum=row['confidence'] or 0,
+            )
+            for row in rows
+        ], batch_size=500)
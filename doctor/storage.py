@@ -0,0 +1,75 @@
+import hashlib
+import io
+import logging
+import posixpath
+import re
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (128, 128)
+THUMBNAIL_DIR = 'thumbnails'
+
+_HASHED_NAME = re.compile(r'^(?:.*/)?[0-9a-f]{2}/([0-9a-f]{64})\.[^/]*$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage that names every file after the SHA-256 of its content.
+
+    ``predictions/cabbage.jpg`` is stored as ``predictions/3f/3fa1…c2.jpg``, so
+    uploading the same bytes again resolves to the existing file and writes
+    nothing. New images also get a small JPEG thumbnail under ``thumbnails/``.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+
+        directory, basename = posixpath.split(name.replace('\\', '/'))
+        extension = posixpath.splitext(basename)[1].lower()
+        name = posixpath.join(directory, digest[:2], digest + extension)
+        if self.exists(name):
+            return name
+
+        name = super().save(name, content, max_length)
+        self._save_thumbnail(name, content)
+        return name
+
+    def thumbnail_name(self, name):
+        """Name of the thumbnail for ``name``, or None if it isn't content-addressed"""
+        match = _HASHED_NAME.match(name or '')
+        if match is None:
+            return None
+        return posixpath.join(THUMBNAIL_DIR, f"{match.group(1)}.jpg")
+
+    def _save_thumbnail(self, name, content):
+        thumbnail_name = self.thumbnail_name(name)
+        if thumbnail_name is None or self.exists(thumbnail_name):
+            return
+        try:
+            content.seek(0)
+            img = Image.open(content)
+            img.draft('RGB', THUMBNAIL_SIZE)
+            img = img.convert('RGB')
+            img.thumbnail(THUMBNAIL_SIZE)
+            output = io.BytesIO()
+            img.save(output, format='JPEG', quality=80)
+        except Exception as e:
+            logger.warning(f"Could not create thumbnail for {name}: {e}")
+            return
+        self._save(thumbnail_name, ContentFile(output.getvalue()))
+
+
+_prediction_storage = ContentAddressedStorage()
+
+
+def prediction_storage():
+    """Storage used by ``Prediction.image``"""
+    return _prediction_storage
@@ -1,3 +1,1461 @@
-from django.test import TestCase
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from PIL import Image
+
+from .ai_service import AIPredictor
+from .backends import BACKENDS, KerasBackend, _dequantize, _quantize, artifact_path, get_backend
+from .batching import BatchTimeout, BatcherClosed, MicroBatcher
+from .catalogue import CatalogueCache, label_ids
+from .executor import InferenceExecutor
+from .labels import DEFAULT_TREATMENT, TREATMENTS, LabelRegistry, normalize
+from .management.commands.export_model import load_samples
+from .model_registry import ModelManifest, PredictorSlot, _bind_catalogue, activate
+from .model_server import MAGIC, OP_PREDICT, REQUEST_HEADER, ModelClient, ModelServerError
+from .models import Crop, DailyPredictionStats, Disease, Prediction, SearchDocument, ShadowComparison, Treatment
+from .pagination import KeysetPaginator, encode_cursor
+from .persistence import PredictionWriter, save_prediction
+from .stats import rebuild, record_correction
+from .prediction_cache import PredictionCache
+from .search import rebuild as rebuild_search, search
+from .shadow import ShadowEvaluator
+from .shm_ring import SLOT_DONE, SLOT_FREE, SLOT_READING, SLOT_READY, SLOT_WRITING, RingFull, SharedTensorRing, SlotNotReady
+from .storage import THUMBNAIL_SIZE, prediction_storage
+from .preprocessing import BatchBuffer, TARGET_SIZE, preprocess_into
+
+
+def legacy_preprocess(fp):
+    """NumPy port of the previous pipeline: full decode, tf.image.resize
+    (bilinear, half-pixel centers, no antialiasing), then / 255"""
+    pixels = np.asarray(Image.open(fp).convert('RGB'), dtype=np.float32)
+    in_h, in_w = pixels.shape[:2]
+    out_w, out_h = TARGET_SIZE
+
+    def axis(in_size, out_size):
+        src = (np.arange(out_size) + 0.5) * (in_size / out_size) - 0.5
+        src = np.clip(src, 0, in_size - 1)
+        lower = np.floor(src).astype(int)
+        upper = np.minimum(lower + 1, in_size - 1)
+        return lower, upper, (src - lower).astype(np.float32)
+
+    y0, y1, fy = axis(in_h, out_h)
+    x0, x1, fx = axis(in_w, out_w)
+    fx = fx[np.newaxis, :, np.newaxis]
+    top = pixels[y0][:, x0] * (1 - fx) + pixels[y0][:, x1] * fx
+    bottom = pixels[y1][:, x0] * (1 - fx) + pixels[y1][:, x1] * fx
+    fy = fy[:, np.newaxis, np.newaxis]
+    return (top * (1 - fy) + bottom * fy) / 255.0
+
+
+class PreprocessingParityTests(SimpleTestCase):
+    sample_images = sorted(
+        path for path in Path(settings.MEDIA_ROOT).glob('*/*')
+        if path.suffix.lower() in ('.jpg', '.jpeg', '.png')
+    )
+
+    def assertClose(self, actual, expected):
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertLess(float(np.abs(actual - expected).mean()), 0.02)
+
+    def test_sample_photos_match_previous_pipeline(self):
+        self.assertTrue(self.sample_images)
+        out = np.empty((TARGET_SIZE[1], TARGET_SIZE[0], 3), dtype=np.float32)
+        for path in self.sample_images:
+            with self.subTest(image=path.name):
+                self.assertClose(preprocess_into(path, out), legacy_preprocess(path))
+
+    def test_large_jpeg_is_downscaled_while_decoding(self):
+        x = np.linspace(0, 255, 3000, dtype=np.float32)
+        y = np.linspace(0, 255, 4000, dtype=np.float32)[:, np.newaxis]
+        pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1).astype(np.uint8)
+        data = io.BytesIO()
+        Image.fromarray(pixels).save(data, format='JPEG', quality=95)
+
+        data.seek(0)
+        img = Image.open(data)
+        img.draft('RGB', TARGET_SIZE)
+        self.assertLess(img.size[0], 3000)
+
+        data.seek(0)
+        expected = legacy_preprocess(data)
+        data.seek(0)
+        out = np.empty_like(expected)
+        self.assertClose(preprocess_into(data, out), expected)
+
+    def test_batch_buffer_is_reused_and_supports_uint8(self):
+        buffer = BatchBuffer(2)
+        first = buffer.array
+        for index, path in enumerate(self.sample_images[:2]):
+            buffer.fill(index, path)
+        self.assertIs(buffer.array, first)
+        self.assertEqual(buffer.batch(2).dtype, np.float32)
+        self.assertTrue(0.0 <= buffer.batch(2).min() and buffer.batch(2).max() <= 1.0)
+
+        raw = BatchBuffer(1, dtype=np.uint8)
+        raw.fill(0, self.sample_images[0])
+        np.testing.assert_allclose(raw.array[0] / 255.0, buffer.array[0], atol=1e-6)
+
+
+def image_bytes(value, size=(64, 64), format='PNG'):
+    """An image of one flat grey ``value``"""
+    data = io.BytesIO()
+    Image.new('RGB', size, (value, value, value)).save(data, format=format)
+    return data.getvalue()
+
+
+class FakeBackend:
+    """Stands in for the model: an image's mean brightness picks its class"""
+
+    name = 'fake'
+    path = 'fake-model.h5'
+    input_dtype = np.float32
+    is_loaded = True
+
+    def __init__(self, num_classes):
+        self.num_classes = num_classes
+        self.batch_sizes = []
+
+    def load(self):
+        pass
+
+    def predict_proba(self, batch):
+        self.batch_sizes.append(len(batch))
+        means = batch.reshape(len(batch), -1).mean(axis=1) / (255.0 if batch.dtype == np.uint8 else 1.0)
+        probabilities = np.full((len(batch), self.num_classes), 0.01, dtype=np.float32)
+        probabilities[np.arange(len(batch)), self.class_index(means)] = 0.99
+        return probabilities
+
+    def class_index(self, brightness):
+        return np.rint(np.asarray(brightness) * (self.num_classes - 1)).astype(int)
+
+
+def fake_predictor():
+    predictor = AIPredictor(model_path='fake-model.h5')
+    predictor.backend = FakeBackend(len(predictor.labels))
+    return predictor
+
+
+@override_settings(BATCH_CLASSIFY={**settings.BATCH_CLASSIFY, 'MAX_IMAGES': 3})
+class BatchClassifyTests(TransactionTestCase):
+    def setUp(self):
+        self.predictor = fake_predictor()
+        patcher = mock.patch('doctor.model_registry.get_predictor', return_value=self.predictor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def archive(self, members):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            for name, content in members.items():
+                archive.writestr(name, content)
+        data.seek(0)
+        data.name = 'batch.zip'
+        return data
+
+    def test_over_limit_archive_is_refused_before_any_member_is_read(self):
+        upload = self.archive({f'leaf{index}.png': image_bytes(index) for index in range(4)})
+        with mock.patch.object(zipfile.ZipFile, 'read', side_effect=AssertionError("member was read")):
+            response = self.client.post('/classify/batch/', {'images': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at most 3 images', response.json()['error'])
+
+    @override_settings(BATCH_CLASSIFY={**settings.BATCH_CLASSIFY, 'MAX_ARCHIVE_BYTES': 1000})
+    def test_archive_too_large_once_extracted_is_refused(self):
+        upload = self.archive({'big.png': b'\0' * 2000})
+        response = self.client.post('/classify/batch/', {'images': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('too large', response.json()['error'])
+
+    @override_settings(BATCH_CLASSIFY={**settings.BATCH_CLASSIFY, 'MAX_ARCHIVE_BYTES': 1000})
+    def test_plain_files_count_towards_the_byte_limit(self):
+        def upload(name, size):
+            data = io.BytesIO(b'\0' * size)
+            data.name = name
+            return data
+
+        for uploads in ([upload('a.png', 600), upload('b.png', 600)],
+                        [self.archive({'a.png': b'\0' * 600}), upload('b.png', 600)],
+                        [upload('a.png', 600), self.archive({'b.png': b'\0' * 600})]):
+            with self.subTest(uploads=[item.name for item in uploads]):
+                response = self.client.post('/classify/batch/', {'images': uploads})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('too large', response.json()['error'])
+
+    def test_results_stream_from_a_plain_iterator_under_wsgi(self):
+        upload = self.archive({'dark.png': image_bytes(0), 'bright.png': image_bytes(255)})
+        response = self.client.post('/classify/batch/', {'images': upload})
+        self.assertFalse(response.is_async)
+        lines = [json.loads(line) for chunk in response.streaming_content for line in chunk.splitlines()]
+        self.assertEqual([line['name'] for line in lines], ['dark.png', 'bright.png'])
+        self.assertTrue(all(line['success'] for line in lines))
+
+    async def test_results_stream_as_ndjson_in_upload_order(self):
+        dark, bright = image_bytes(0), image_bytes(255)
+        upload = self.archive({'dark.png': dark, 'notes.txt': b'skipped', 'broken.png': b'not an image'})
+        extra = io.BytesIO(bright)
+        extra.name = 'bright.png'
+        response = await self.async_client.post('/classify/batch/', {'images': [upload, extra]})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) async for chunk in response.streaming_content for line in chunk.splitlines()]
+
+        by_name = {line['name']: line for line in lines}
+        self.assertEqual(sorted(line['index'] for line in lines), [0, 1, 2])
+        self.assertEqual(set(by_name), {'dark.png', 'broken.png', 'bright.png'})
+        self.assertFalse(by_name['broken.png']['success'])
+        labels = self.predictor.labels
+        self.assertEqual(by_name['dark.png']['prediction']['class_name'], labels[0].class_name)
+        self.assertEqual(by_name['bright.png']['prediction']['class_name'], labels[len(labels) - 1].class_name)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def make_batcher(self, max_batch_size, max_wait_ms, forward=None, timeout=10.0):
+        sizes = []
+
+        def default_forward(batch):
+            sizes.append(len(batch))
+            # Each row's answer depends only on that row
+            return batch.reshape(len(batch), -1)[:, :1] * 10
+
+        batcher = MicroBatcher(forward or default_forward, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                               timeout=timeout)
+        self.addCleanup(batcher.close)
+        return batcher, sizes
+
+    def submit_concurrently(self, batcher, values):
+        results, errors = {}, {}
+
+        def call(value):
+            try:
+                results[value] = batcher.submit(np.full((2, 2), value, dtype=np.float32))
+            except Exception as e:
+                errors[value] = e
+
+        threads = [threading.Thread(target=call, args=(value,)) for value in values]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+        return results, errors
+
+    def test_every_caller_gets_its_own_row(self):
+        batcher, sizes = self.make_batcher(max_batch_size=4, max_wait_ms=20)
+        results, errors = self.submit_concurrently(batcher, range(10))
+        self.assertFalse(errors)
+        for value, result in results.items():
+            self.assertEqual(float(result[0]), value * 10)
+        self.assertEqual(sum(sizes), 10)
+        self.assertLessEqual(max(sizes), 4)
+
+    def test_full_batch_runs_without_waiting_for_the_window(self):
+        batcher, sizes = self.make_batcher(max_batch_size=4, max_wait_ms=5000)
+        started = time.monotonic()
+        results, _ = self.submit_concurrently(batcher, range(4))
+        self.assertLess(time.monotonic() - started, 2.5)
+        self.assertEqual(sizes, [4])
+        self.assertEqual(len(results), 4)
+
+    def test_partial_batch_runs_when_the_window_closes(self):
+        batcher, sizes = self.make_batcher(max_batch_size=8, max_wait_ms=50)
+        started = time.monotonic()
+        result = batcher.submit(np.full((2, 2), 3, dtype=np.float32))
+        elapsed = time.monotonic() - started
+        self.assertEqual(float(result[0]), 30)
+        self.assertEqual(sizes, [1])
+        self.assertGreaterEqual(elapsed, 0.045)
+        self.assertLess(elapsed, 1.0)
+
+    def test_forward_errors_reach_every_caller_in_the_batch(self):
+        def failing(batch):
+            raise RuntimeError("model failed")
+
+        batcher, _ = self.make_batcher(max_batch_size=4, max_wait_ms=20, forward=failing)
+        with self.assertLogs('doctor.batching', 'ERROR'):
+            results, errors = self.submit_concurrently(batcher, range(3))
+        self.assertFalse(results)
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(all(isinstance(error, RuntimeError) for error in errors.values()))
+
+    def test_close_finishes_queued_requests_then_runs_unbatched(self):
+        release = threading.Event()
+        sizes = []
+
+        def slow(batch):
+            release.wait(5)
+            sizes.append(len(batch))
+            return batch.reshape(len(batch), -1)[:, :1]
+
+        batcher, _ = self.make_batcher(max_batch_size=4, max_wait_ms=1, forward=slow)
+        threads = [threading.Thread(target=batcher.submit, args=(np.zeros((2, 2), np.float32),)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        batcher.close()
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+        batcher._thread.join(timeout=5)
+        self.assertFalse(batcher._thread.is_alive())
+
+        batcher.submit(np.zeros((2, 2), np.float32))
+        self.assertEqual(sum(sizes), 4)
+        self.assertEqual(sizes[-1], 1)
+
+    def test_callers_give_up_after_the_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def stuck(batch):
+            release.wait(5)
+            return batch.reshape(len(batch), -1)[:, :1]
+
+        batcher, _ = self.make_batcher(max_batch_size=4, max_wait_ms=1, forward=stuck, timeout=0.05)
+        started = time.monotonic()
+        with self.assertRaises(BatchTimeout):
+            batcher.submit(np.zeros((2, 2), np.float32))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_close_fails_requests_no_worker_will_run(self):
+        batcher, sizes = self.make_batcher(max_batch_size=4, max_wait_ms=1)
+        errors = []
+
+        def submit():
+            try:
+                batcher.submit(np.zeros((2, 2), np.float32))
+            except Exception as e:
+                errors.append(e)
+
+        # As if the worker thread had died: the request is queued but never picked up
+        with mock.patch.object(batcher, '_ensure_worker'):
+            thread = threading.Thread(target=submit)
+            thread.start()
+            while not batcher._queue.qsize():
+                time.sleep(0.001)
+        batcher.close()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], BatcherClosed)
+        self.assertEqual(sizes, [])
+
+    def test_forked_child_starts_its_own_worker(self):
+        if not hasattr(os, 'fork'):
+            self.skipTest("needs fork()")
+        batcher, _ = self.make_batcher(max_batch_size=4, max_wait_ms=1)
+        self.assertEqual(float(batcher.submit(np.ones((2, 2), np.float32))[0]), 10)
+
+        pid = os.fork()
+        if pid == 0:
+            # The parent's worker thread does not exist here
+            ok = False
+            try:
+                ok = float(batcher.submit(np.full((2, 2), 2, np.float32))[0]) == 20 and batcher._pid == os.getpid()
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(float(batcher.submit(np.full((2, 2), 3, np.float32))[0]), 30)
+
+
+class PredictionCacheTests(SimpleTestCase):
+    result = {'class_name': 'Tomato___healthy', 'confidence': 97.5}
+
+    def test_miss_then_hit(self):
+        cache = PredictionCache(maxsize=8, ttl=60)
+        self.assertIsNone(cache.get('digest', 'model-a'))
+        cache.set('digest', self.result, 'model-a')
+        self.assertEqual(cache.get('digest', 'model-a'), self.result)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_callers_get_their_own_copy(self):
+        cache = PredictionCache(maxsize=8, ttl=60)
+        cache.set('digest', self.result, 'model-a')
+        cache.get('digest', 'model-a')['confidence'] = 0
+        self.assertEqual(cache.get('digest', 'model-a'), self.result)
+
+    def test_results_of_another_model_key_are_not_served(self):
+        cache = PredictionCache(maxsize=8, ttl=60)
+        cache.set('digest', self.result, 'model-a')
+        self.assertIsNone(cache.get('digest', 'model-b'))
+
+    def test_shared_backend_serves_other_workers(self):
+        first = PredictionCache(maxsize=8, ttl=60, backend='default')
+        second = PredictionCache(maxsize=8, ttl=60, backend='default')
+        first.set('shared-digest', self.result, 'model-a')
+        self.assertEqual(second.get('shared-digest', 'model-a'), self.result)
+        self.assertIsNone(second.get('shared-digest', 'model-b'))
+
+    def test_model_key_changes_with_artifact_backend_and_calibration(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'plant_model.h5')
+            with open(path, 'wb') as f:
+                f.write(b'weights')
+            keras = AIPredictor(model_path=path)
+            self.assertEqual(AIPredictor(model_path=path).cache_key, keras.cache_key)
+            self.assertNotEqual(AIPredictor(model_path=path, backend='tflite').cache_key, keras.cache_key)
+
+            # Overwritten in place: same version name, different weights
+            with open(path, 'wb') as f:
+                f.write(b'retrained weights')
+            self.assertNotEqual(AIPredictor(model_path=path).cache_key, keras.cache_key)
+
+            retrained = AIPredictor(model_path=path).cache_key
+            with mock.patch('doctor.ai_service.load_temperature', return_value=1.7):
+                self.assertNotEqual(AIPredictor(model_path=path).cache_key, retrained)
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root = directory.name
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = prediction_storage()
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media_root)
+            for directory, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def test_identical_uploads_share_one_file_and_thumbnail(self):
+        data = image_bytes(120, size=(600, 400), format='JPEG')
+        first = self.storage.save('predictions/leaf.JPG', ContentFile(data))
+        second = self.storage.save('predictions/other name.jpg', ContentFile(data))
+
+        self.assertEqual(first, second)
+        self.assertRegex(first, r'^predictions/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        thumbnail = self.storage.thumbnail_name(first)
+        self.assertEqual(self.stored_files(), sorted([first, thumbnail]))
+        with self.storage.open(first) as f:
+            self.assertEqual(f.read(), data)
+        with self.storage.open(thumbnail) as f:
+            img = Image.open(f)
+            self.assertEqual(img.format, 'JPEG')
+            self.assertLessEqual(max(img.size), max(THUMBNAIL_SIZE))
+
+    def test_different_content_gets_different_files(self):
+        first = self.storage.save('predictions/a.png', ContentFile(image_bytes(10)))
+        second = self.storage.save('predictions/a.png', ContentFile(image_bytes(200)))
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(self.stored_files()), 4)
+
+    def test_unreadable_image_is_stored_without_thumbnail(self):
+        with self.assertLogs('doctor.storage', 'WARNING'):
+            name = self.storage.save('predictions/broken.jpg', ContentFile(b'not an image'))
+        self.assertEqual(self.stored_files(), [name])
+
+
+def make_prediction(disease='healthy', confidence=90.0, **fields):
+    fields.setdefault('reference', uuid.uuid4())
+    return Prediction(predicted_crop='Tomato', predicted_disease=disease, confidence_score=confidence, **fields)
+
+
+class PredictionWriterTests(TransactionTestCase):
+    def record_bulk_creates(self):
+        sizes = []
+        bulk_create = Prediction.objects.bulk_create
+
+        def recording(objs, *args, **kwargs):
+            sizes.append(len(objs))
+            return bulk_create(objs, *args, **kwargs)
+
+        patcher = mock.patch.object(Prediction.objects, 'bulk_create', side_effect=recording)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return sizes
+
+    def test_queued_rows_are_inserted_in_batches(self):
+        sizes = self.record_bulk_creates()
+        writer = PredictionWriter(batch_size=3, flush_interval=0.5)
+        for _ in range(5):
+            writer.enqueue(make_prediction())
+        writer.shutdown()
+
+        self.assertEqual(sizes, [3, 2])
+        self.assertEqual(Prediction.objects.count(), 5)
+        self.assertEqual(writer.stats()['written'], 5)
+        self.assertEqual(DailyPredictionStats.objects.get().prediction_count, 5)
+
+    def test_shutdown_flushes_without_waiting_for_the_window(self):
+        writer = PredictionWriter(batch_size=100, flush_interval=30)
+        references = []
+        for _ in range(2):
+            prediction = make_prediction()
+            references.append(prediction.reference)
+            writer.enqueue(prediction)
+
+        started = time.monotonic()
+        writer.shutdown()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertFalse(writer._thread)
+        self.assertCountEqual(Prediction.objects.values_list('reference', flat=True), references)
+
+    def test_a_bad_row_does_not_lose_the_rest_of_the_batch(self):
+        writer = PredictionWriter()
+        duplicate = uuid.uuid4()
+        with self.assertLogs('doctor.persistence', 'ERROR'):
+            writer.write([make_prediction(reference=duplicate), make_prediction(), make_prediction(reference=duplicate)])
+        self.assertEqual((writer.written, writer.failed), (2, 1))
+        self.assertEqual(Prediction.objects.count(), 2)
+        self.assertEqual(DailyPredictionStats.objects.get().prediction_count, 2)
+
+    @override_settings(PREDICTION_WRITER={**settings.PREDICTION_WRITER, 'ASYNC': False})
+    def test_save_prediction_writes_in_the_request_when_async_writes_are_off(self):
+        prediction = make_prediction()
+        with mock.patch('doctor.persistence.get_prediction_writer') as get_writer:
+            save_prediction(prediction)
+        get_writer.assert_not_called()
+        self.assertIsNotNone(prediction.pk)
+        self.assertEqual(DailyPredictionStats.objects.get().prediction_count, 1)
+
+    @override_settings(PREDICTION_WRITER={**settings.PREDICTION_WRITER, 'ASYNC': True})
+    def test_save_prediction_hands_rows_to_the_writer_when_async_writes_are_on(self):
+        writer = PredictionWriter(flush_interval=0.01)
+        prediction = make_prediction()
+        with mock.patch('doctor.persistence._writer', writer):
+            save_prediction(prediction)
+            writer.shutdown()
+        self.assertTrue(Prediction.objects.filter(reference=prediction.reference).exists())
+        self.assertEqual(writer.written, 1)
+        self.assertEqual(DailyPredictionStats.objects.get().prediction_count, 1)
+
+
+class SharedTensorRingTests(SimpleTestCase):
+    shape = (4, 4, 3)
+
+    def make_ring(self, slots):
+        ring = SharedTensorRing.create(slots, self.shape)
+        self.addCleanup(ring.close)
+        return ring
+
+    def test_released_slots_are_reused(self):
+        ring = self.make_ring(2)
+        first, second = ring.acquire(), ring.acquire()
+        self.assertEqual({first, second}, {0, 1})
+        self.assertEqual(ring.states[first], SLOT_WRITING)
+
+        ring.release(first)
+        self.assertEqual(ring.states[first], SLOT_FREE)
+        self.assertEqual(ring.acquire(timeout=0), first)
+
+    def test_acquire_raises_ring_full_after_the_timeout(self):
+        ring = self.make_ring(1)
+        index = ring.acquire()
+        started = time.monotonic()
+        with self.assertRaises(RingFull):
+            ring.acquire(timeout=0.05)
+        self.assertGreaterEqual(time.monotonic() - started, 0.045)
+
+        threading.Timer(0.05, ring.release, args=(index,)).start()
+        self.assertEqual(ring.acquire(timeout=5), index)
+
+    def test_only_ready_slots_can_be_read(self):
+        ring = self.make_ring(1)
+        index = ring.acquire()
+        with self.assertRaises(SlotNotReady):
+            ring.read([index])
+        ring.mark_ready(index)
+        self.assertEqual(ring.states[index], SLOT_READY)
+        ring.read([index])
+        self.assertEqual(ring.states[index], SLOT_READING)
+
+    def test_another_process_reads_the_pixels_without_copying(self):
+        if not hasattr(os, 'fork'):
+            self.skipTest("needs fork()")
+        ring = self.make_ring(3)
+        indices = [ring.acquire() for _ in range(2)]
+        for value, index in enumerate(indices, start=1):
+            ring.array(index)[:] = value * 10
+            ring.mark_ready(index)
+
+        pid = os.fork()
+        if pid == 0:
+            ok = False
+            try:
+                # A child of the creator shares its resource tracker
+                attached = SharedTensorRing.attach(ring.name, ring.slots, self.shape, track=True)
+                views = attached.read(indices)
+                ok = [int(view.max()) for view in views] == [10, 20] and not any(view.flags.owndata for view in views)
+                attached.finish(indices)
+                views = None
+                attached.close()
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual([ring.states[index] for index in indices], [SLOT_DONE, SLOT_DONE])
+
+        for index in indices:
+            ring.release(index)
+        self.assertEqual(sorted(ring._free), [0, 1, 2])
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class PostprocessTests(SimpleTestCase):
+    def setUp(self):
+        self.predictor = fake_predictor()
+        self.predictor.top_k = 5
+        self.predictor.temperature = 1.0
+        logits = np.random.default_rng(0).normal(scale=3.0, size=(32, len(self.predictor.labels)))
+        self.probabilities = softmax(logits).astype(np.float32)
+
+    def reference(self, temperature):
+        """Full argsort of softmax(log(p) / T), in float64"""
+        calibrated = softmax(np.log(self.probabilities.astype(np.float64)) / temperature)
+        order = np.argsort(-calibrated, axis=1, kind='stable')[:, :self.predictor.top_k]
+        return order, np.take_along_axis(calibrated, order, axis=1)
+
+    def assertMatchesReference(self, results, temperature):
+        order, confidences = self.reference(temperature)
+        labels = self.predictor.labels
+        for result, expected_order, expected in zip(results, order, confidences):
+            self.assertEqual([entry['class_name'] for entry in result['top_k']],
+                             [labels[index].class_name for index in expected_order])
+            np.testing.assert_allclose([entry['confidence'] for entry in result['top_k']], expected * 100, atol=0.011)
+            is_uncertain = expected[0] < self.predictor.confidence_threshold
+            self.assertEqual(result['class_name'], 'Uncertain / Not in dataset' if is_uncertain
+                             else labels[expected_order[0]].class_name)
+
+    def test_top_k_matches_a_full_sort(self):
+        self.predictor.confidence_threshold = float(np.median(self.probabilities.max(axis=1)))
+        results = self.predictor.postprocess_batch(self.probabilities)
+        self.assertEqual(len(results), len(self.probabilities))
+        self.assertMatchesReference(results, 1.0)
+        self.assertTrue(any(result['class_name'] == 'Uncertain / Not in dataset' for result in results))
+
+    def test_temperature_rescales_confidences_without_reordering(self):
+        uncalibrated = self.predictor.postprocess_batch(self.probabilities)
+        for temperature in (0.5, 2.5):
+            with self.subTest(temperature=temperature):
+                self.predictor.temperature = temperature
+                results = self.predictor.postprocess_batch(self.probabilities)
+                self.assertMatchesReference(results, temperature)
+                for before, after in zip(uncalibrated, results):
+                    self.assertEqual([entry['class_name'] for entry in before['top_k']],
+                                     [entry['class_name'] for entry in after['top_k']])
+                    if temperature > 1:
+                        self.assertLessEqual(after['top_k'][0]['confidence'], before['top_k'][0]['confidence'])
+                    else:
+                        self.assertGreaterEqual(after['top_k'][0]['confidence'], before['top_k'][0]['confidence'])
+
+    def test_k_larger_than_the_number_of_classes(self):
+        self.predictor.top_k = len(self.predictor.labels) + 3
+        results = self.predictor.postprocess_batch(self.probabilities[:2])
+        self.assertEqual(len(results[0]['top_k']), len(self.predictor.labels))
+        self.assertAlmostEqual(sum(entry['confidence'] for entry in results[0]['top_k']), 100, delta=0.5)
+
+
+class LabelRegistryTests(SimpleTestCase):
+    class_names = ['Pepper,_bell___Bacterial_spot', 'Tomato___healthy', 'Background_without_leaves']
+
+    def test_check_requires_one_label_per_model_output(self):
+        labels = LabelRegistry(self.class_names)
+        labels.check(3)
+        for num_classes in (2, 4):
+            with self.subTest(num_classes=num_classes), self.assertRaises(ImproperlyConfigured):
+                labels.check(num_classes)
+
+    def test_labels_are_index_aligned(self):
+        labels = LabelRegistry(self.class_names)
+        self.assertEqual([label.index for label in labels], [0, 1, 2])
+        self.assertEqual((labels[0].crop, labels[0].disease), ('Pepper,_bell', 'Bacterial_spot'))
+        self.assertEqual((labels[2].crop, labels[2].disease), ('Background_without_leaves', ''))
+        self.assertIs(labels.get('Tomato___healthy'), labels[1])
+        self.assertIs(labels.lookup('Pepper,_bell', 'Bacterial_spot'), labels[0])
+        self.assertIsNone(labels.get('Tomato___Late_blight'))
+
+    def test_treatments_fall_back_to_the_advice_table(self):
+        labels = LabelRegistry(self.class_names)
+        self.assertIs(labels.treatment('Tomato', 'healthy'), labels[1].treatment)
+        self.assertEqual(labels.treatment('Tomato', 'Late_blight').instructions, TREATMENTS['Tomato___Late_blight'])
+        self.assertEqual(labels.treatment('Unknown', 'Unknown').instructions, DEFAULT_TREATMENT)
+        self.assertEqual(labels[2].treatment.instructions, DEFAULT_TREATMENT)
+
+    def test_normalize_ignores_case_and_separators(self):
+        self.assertEqual(normalize('Pepper,_bell'), normalize('Pepper__bell'))
+        self.assertEqual(normalize('Pepper,_bell___Bacterial_spot'), normalize('pepper bell bacterial-spot'))
+        self.assertEqual(normalize(' Corn (maize) '), 'corn maize')
+        self.assertNotEqual(normalize('Tomato___healthy'), normalize('Potato___healthy'))
+
+
+class LabelCatalogueTests(TransactionTestCase):
+    def test_catalogue_rows_are_matched_by_normalized_name(self):
+        labels = LabelRegistry(LabelRegistryTests.class_names)
+        pepper = Crop.objects.create(name='Pepper, bell')
+        tomato = Crop.objects.create(name='TOMATO')
+        spot = Disease.objects.create(crop=pepper, name='Pepper__bell Bacterial spot')
+        treatment = Treatment.objects.create(disease=spot, title='Copper spray', instructions='Spray weekly.')
+
+        crop_ids = {normalize(crop.name): crop.id for crop in Crop.objects.all()}
+        labels.bind(label_ids(labels, crop_ids))
+        self.assertEqual((labels[0].crop_id, labels[0].disease_id, labels[0].treatment_id),
+                         (pepper.id, spot.id, treatment.id))
+        # No Disease row: the crop still resolves
+        self.assertEqual((labels[1].crop_id, labels[1].disease_id, labels[1].treatment_id), (tomato.id, None, None))
+        self.assertEqual((labels[2].crop_id, labels[2].disease_id), (None, None))
+
+
+@override_settings(PREDICTION_WRITER={**settings.PREDICTION_WRITER, 'ASYNC': False})
+class DailyStatsTests(TransactionTestCase):
+    def snapshot(self):
+        return sorted(
+            (row.date, row.predicted_crop, row.predicted_disease, row.prediction_count, row.correct_count,
+             round(row.confidence_sum, 3))
+            for row in DailyPredictionStats.objects.all()
+        )
+
+    def save_at(self, moment, predictions):
+        with mock.patch('django.utils.timezone.now', return_value=moment):
+            PredictionWriter().write(predictions)
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_incremental_counts_match_a_rebuild(self):
+        late = datetime(2025, 3, 1, 23, 59, 59, tzinfo=dt_timezone.utc)
+        early = datetime(2025, 3, 2, 0, 0, 1, tzinfo=dt_timezone.utc)
+        self.save_at(late, [make_prediction('healthy', 91.5, is_correct=True), make_prediction('healthy', 60.25),
+                            make_prediction('Late_blight', 75.0, is_correct=False)])
+        self.save_at(early, [make_prediction('healthy', 88.0, is_correct=True)])
+        self.save_at(late, [make_prediction('healthy', 70.0, is_correct=True)])
+        with mock.patch('django.utils.timezone.now', return_value=early):
+            save_prediction(make_prediction('Late_blight', 55.5))
+
+        self.assertEqual(DailyPredictionStats.objects.get(date=late.date(), predicted_disease='healthy').prediction_count, 3)
+        self.assertEqual(DailyPredictionStats.objects.get(date=early.date(), predicted_disease='Late_blight').prediction_count, 1)
+        self.assertMatchesRebuild()
+
+    def test_corrections_match_a_rebuild(self):
+        moment = datetime(2025, 3, 1, 12, tzinfo=dt_timezone.utc)
+        self.save_at(moment, [make_prediction(is_correct=True), make_prediction(), make_prediction(is_correct=False)])
+
+        for prediction, is_correct in zip(Prediction.objects.order_by('id'), (False, True, None)):
+            was_correct = prediction.is_correct
+            prediction.is_correct = is_correct
+            prediction.save()
+            record_correction(prediction, was_correct)
+
+        self.assertEqual(DailyPredictionStats.objects.get().correct_count, 1)
+        self.assertMatchesRebuild()
+
+
+class KeysetPaginatorTests(TransactionTestCase):
+    def setUp(self):
+        # Seven rows over three timestamps, so most of them tie on created_at
+        moments = [datetime(2025, 3, day, 12, tzinfo=dt_timezone.utc) for day in (1, 1, 1, 2, 2, 3, 3)]
+        for moment in moments:
+            prediction = make_prediction()
+            prediction.save()
+            Prediction.objects.filter(pk=prediction.pk).update(created_at=moment)
+        self.expected = list(Prediction.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.paginator = KeysetPaginator(Prediction.objects.all(), ('-created_at', '-id'), per_page=3)
+
+    def ids(self, page):
+        return [prediction.id for prediction in page]
+
+    def test_forward_and_backward_cursors_visit_every_row_once(self):
+        pages = [self.paginator.page()]
+        self.assertFalse(pages[0].has_previous)
+        while pages[-1].has_next:
+            pages.append(self.paginator.page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([pk for page in pages for pk in self.ids(page)], self.expected)
+
+        back = [pages[-1]]
+        while back[-1].has_previous:
+            back.append(self.paginator.page(back[-1].previous_cursor))
+        self.assertEqual([self.ids(page) for page in reversed(back)], [self.ids(page) for page in pages])
+        self.assertTrue(back[-1].has_next)
+
+    def test_ties_on_the_leading_column_are_split_by_id(self):
+        first = self.paginator.page()
+        second = self.paginator.page(first.next_cursor)
+        # The page boundary falls between rows with the same created_at
+        self.assertEqual(first.object_list[-1].created_at, second.object_list[0].created_at)
+        self.assertEqual(self.ids(first) + self.ids(second), self.expected[:6])
+
+    def test_tampered_or_malformed_cursors_fall_back_to_the_first_page(self):
+        cursor = self.paginator.page().next_cursor
+        tampered = cursor[:-2] + ('AA' if cursor[-2:] != 'AA' else 'BB')
+        # The last one is a cursor of the diseases list, signed with the same key
+        for bad in (tampered, 'garbage', encode_cursor([1], 'next'), encode_cursor(['Apple', 'Rust', 1], 'next')):
+            with self.subTest(cursor=bad):
+                page = self.paginator.page(bad)
+                self.assertEqual(self.ids(page), self.expected[:3])
+                self.assertFalse(page.has_previous)
+
+    def test_ordering_by_a_related_field(self):
+        crops = [Crop.objects.create(name=name) for name in ('Tomato', 'Apple', 'Corn')]
+        for crop in crops:
+            for name in ('Rust', 'Blight'):
+                Disease.objects.create(crop=crop, name=name)
+        paginator = KeysetPaginator(Disease.objects.all(), ('crop__name', 'name', 'id'), per_page=4)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        names = [(disease.crop.name, disease.name) for page in (first, second) for disease in page]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(set(names)), 6)
+        self.assertFalse(second.has_next)
+
+
+class SearchSyncTests(TransactionTestCase):
+    def setUp(self):
+        self.crop = Crop.objects.create(name='Tomato')
+        self.disease = Disease.objects.create(crop=self.crop, name='Tomato___Late_blight')
+        self.treatment = Treatment.objects.create(disease=self.disease, title='Copper spray',
+                                                  instructions='Spray every seven days.')
+
+    def tearDown(self):
+        if connection.vendor == 'sqlite':
+            # Raises if the FTS index has drifted from doctor_searchdocument
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO doctor_search_fts(doctor_search_fts) VALUES ('integrity-check')")
+
+    def found(self, query):
+        return {(document.kind, document.object_id) for document in search(query)}
+
+    def test_created_rows_are_searchable(self):
+        disease = (SearchDocument.KIND_DISEASE, self.disease.pk)
+        treatment = (SearchDocument.KIND_TREATMENT, self.treatment.pk)
+        self.assertEqual(self.found('late bli'), {disease, treatment})
+        self.assertEqual(self.found('copper'), {treatment})
+        self.assertEqual([document.kind for document in search('late', kinds=[SearchDocument.KIND_DISEASE])],
+                         [SearchDocument.KIND_DISEASE])
+
+    def test_renames_replace_the_old_terms(self):
+        self.disease.name = 'Tomato___Early_blight'
+        self.disease.save()
+        self.treatment.title = 'Mancozeb spray'
+        self.treatment.save()
+        self.crop.name = 'Roma tomato'
+        self.crop.save()
+
+        self.assertEqual(self.found('late'), set())
+        self.assertEqual(self.found('copper'), set())
+        self.assertEqual(self.found('early'), {(SearchDocument.KIND_DISEASE, self.disease.pk),
+                                               (SearchDocument.KIND_TREATMENT, self.treatment.pk)})
+        self.assertEqual(self.found('mancozeb roma'), {(SearchDocument.KIND_TREATMENT, self.treatment.pk)})
+
+    def test_deleted_rows_leave_the_index(self):
+        self.treatment.delete()
+        self.assertEqual(self.found('copper'), set())
+        self.assertEqual(self.found('late'), {(SearchDocument.KIND_DISEASE, self.disease.pk)})
+
+        Treatment.objects.create(disease=self.disease, title='Copper spray', instructions='Weekly.')
+        self.disease.delete()
+        self.assertEqual(self.found('late'), set())
+        self.assertEqual(self.found('copper'), set())
+        self.assertFalse(SearchDocument.objects.exists())
+
+    def test_rebuild_works_with_the_historical_models_of_its_migration(self):
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self.found('late'), set())
+
+        apps = MigrationLoader(connection).project_state(('doctor', '0008_search_documents')).apps
+        count = rebuild_search(*(apps.get_model('doctor', name)
+                                 for name in ('Disease', 'Treatment', 'CropTip', 'SearchDocument')))
+        self.assertEqual(count, 2)
+        self.assertEqual(self.found('late'), {(SearchDocument.KIND_DISEASE, self.disease.pk),
+                                              (SearchDocument.KIND_TREATMENT, self.treatment.pk)})
+
+
+class FakeVersionedPredictor:
+    def __init__(self, manifest, events):
+        self.version = manifest.version
+        self.events = events
+        self.closed = False
+        events.append(('create', self.version))
+
+    def load(self):
+        self.events.append(('load', self.version))
+
+    def warm_up(self):
+        self.events.append(('warm_up', self.version))
+
+    def close(self):
+        self.closed = True
+        self.events.append(('close', self.version))
+
+
+class PredictorSlotTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.model_path = directory.name
+        settings_override = override_settings(MODEL_PATH=self.model_path, MODEL_VERSION=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        for version in ('v1', 'v2', 'v3'):
+            os.makedirs(os.path.join(self.model_path, version))
+            with open(os.path.join(self.model_path, version, 'manifest.json'), 'w') as f:
+                json.dump({'version': version, 'artifact': 'model.h5', 'class_names': ['A___healthy', 'B___rust']}, f)
+        activate('v1')
+
+        self.events = []
+        self.broken = set()
+
+    def factory(self, manifest):
+        if manifest.version in self.broken:
+            raise OSError(f"cannot read {manifest.model_path}")
+        return FakeVersionedPredictor(manifest, self.events)
+
+    def make_slot(self, **kwargs):
+        return PredictorSlot(self.factory, **kwargs)
+
+    def test_first_get_creates_the_active_version_once(self):
+        slot = self.make_slot()
+        self.assertIsNone(slot.current)
+        self.assertEqual(self.events, [])
+
+        predictor = slot.get()
+        self.assertEqual(predictor.version, 'v1')
+        self.assertIs(slot.get(), predictor)
+        self.assertEqual(self.events, [('create', 'v1')])
+
+    def test_activating_another_version_swaps_it_in_once_warm(self):
+        seen_during_prepare = []
+        slot = self.make_slot(reload_interval=0.001, prepare=lambda predictor: seen_during_prepare.append(
+            (predictor.version, slot.current.version)))
+        old = slot.get()
+
+        activate('v2')
+        time.sleep(0.002)
+        # Noticing the change starts the reload; this request still gets the old predictor
+        self.assertIs(slot.get(), old)
+        slot._thread.join(timeout=5)
+
+        new = slot.get()
+        self.assertEqual(new.version, 'v2')
+        self.assertTrue(old.closed)
+        self.assertFalse(new.closed)
+        self.assertEqual(seen_during_prepare, [('v2', 'v1')])
+        self.assertEqual(self.events[1:], [('create', 'v2'), ('load', 'v2'), ('warm_up', 'v2'), ('close', 'v1')])
+        self.assertEqual(slot.stats()['swaps'], 1)
+
+    def test_requests_keep_the_old_predictor_until_the_swap(self):
+        release = threading.Event()
+        preparing = threading.Event()
+
+        def prepare(predictor):
+            preparing.set()
+            release.wait(5)
+
+        slot = self.make_slot(prepare=prepare)
+        old = slot.get()
+        activate('v2')
+        thread = slot.reload()
+        self.assertTrue(preparing.wait(5))
+        self.assertIs(slot.get(), old)
+        self.assertFalse(old.closed)
+        self.assertTrue(slot.stats()['reloading'])
+
+        release.set()
+        thread.join(timeout=5)
+        self.assertEqual(slot.get().version, 'v2')
+        self.assertTrue(old.closed)
+
+    def test_a_failed_version_is_kept_out_until_current_changes(self):
+        slot = self.make_slot()
+        old = slot.get()
+        self.broken.add('v3')
+        activate('v3')
+        with self.assertLogs('doctor.model_registry', 'ERROR'):
+            slot.reload(wait=True)
+        self.assertIs(slot.get(), old)
+        self.assertFalse(old.closed)
+        self.assertEqual(slot.stats()['failed_version'], 'v3')
+
+        # Not retried on every check while CURRENT still names it
+        with mock.patch.object(slot, 'reload') as reload:
+            slot.check()
+        reload.assert_not_called()
+
+        activate('v2')
+        slot.check()
+        slot._thread.join(timeout=5)
+        self.assertEqual(slot.get().version, 'v2')
+        self.assertIsNone(slot.stats()['failed_version'])
+
+        # An explicit reload retries it
+        self.broken.discard('v3')
+        slot.reload('v3', wait=True)
+        self.assertEqual(slot.get().version, 'v3')
+
+    def test_failed_prepare_keeps_the_current_version(self):
+        def prepare(predictor):
+            raise RuntimeError("catalogue unavailable")
+
+        slot = self.make_slot(prepare=prepare)
+        old = slot.get()
+        activate('v2')
+        with self.assertLogs('doctor.model_registry', 'ERROR'):
+            slot.reload(wait=True)
+        self.assertIs(slot.get(), old)
+        self.assertEqual(slot.stats()['swaps'], 0)
+
+
+@override_settings(OPERATIONS_ALLOWED_IPS=['127.0.0.1'], OPERATIONS_TOKEN='s3cret')
+class OperationsEndpointTests(TransactionTestCase):
+    remote = {'REMOTE_ADDR': '203.0.113.7'}
+
+    def test_other_addresses_are_refused_without_the_token(self):
+        for path in ('/metrics', '/inference/stats/'):
+            for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer wrong'}, {'HTTP_AUTHORIZATION': 's3cret'}):
+                with self.subTest(path=path, headers=headers):
+                    response = self.client.get(path, **self.remote, **headers)
+                    self.assertEqual(response.status_code, 403)
+                    self.assertNotIn(b'agrodoctor_', response.content)
+
+    def test_the_token_or_an_allowed_address_gets_in(self):
+        for path in ('/metrics', '/inference/stats/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path, **self.remote, HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+                self.assertEqual(self.client.get(path, REMOTE_ADDR='127.0.0.1').status_code, 200)
+
+    @override_settings(OPERATIONS_TOKEN='')
+    def test_an_empty_token_never_matches(self):
+        response = self.client.get('/metrics', **self.remote, HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_are_prometheus_text(self):
+        with mock.patch('doctor.model_registry.get_predictor', return_value=fake_predictor()):
+            upload = io.BytesIO(image_bytes(128))
+            upload.name = 'leaf.png'
+            self.assertEqual(self.client.post('/classify/', {'image': upload}).status_code, 200)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE agrodoctor_stage_seconds histogram', lines)
+        decode = [line for line in lines if line.startswith('agrodoctor_stage_seconds_bucket{stage="decode"')]
+        self.assertTrue(decode)
+        self.assertTrue(decode[-1].startswith('agrodoctor_stage_seconds_bucket{stage="decode",le="+Inf"} '))
+        self.assertGreaterEqual(float(decode[-1].split()[-1]), 1)
+        self.assertTrue(any(line.startswith('agrodoctor_requests_total{endpoint="classify",status="200"}')
+                            for line in lines))
+        for line in lines:
+            if not line.startswith('#'):
+                float(line.rsplit(' ', 1)[1])
+
+
+# Runs a ModelServer around fake_predictor() in its own interpreter, like `runmodelserver`
+MODEL_SERVER_SCRIPT = """
+import sys
+import django
+django.setup()
+from doctor.model_server import ModelServer
+from doctor.tests import fake_predictor
+ModelServer(sys.argv[1], fake_predictor(), max_batch_size=4).serve_forever()
+"""
+
+
+class ModelServerProtocolTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.socket_path = os.path.join(cls.directory.name, 'model.sock')
+        cls.log_path = os.path.join(cls.directory.name, 'server.log')
+        with open(cls.log_path, 'wb') as log:
+            cls.server = subprocess.Popen(
+                [sys.executable, '-c', MODEL_SERVER_SCRIPT, cls.socket_path], cwd=settings.BASE_DIR,
+                env=dict(os.environ, DJANGO_SETTINGS_MODULE='agrodoctor.settings'), stderr=log,
+            )
+        deadline = time.monotonic() + 30
+        while not os.path.exists(cls.socket_path):
+            if time.monotonic() > deadline or cls.server.poll() is not None:
+                with open(cls.log_path) as log:
+                    output = log.read()
+                cls.tearDownClass()
+                raise RuntimeError(f"Model server did not start:\n{output}")
+            time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait(timeout=10)
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = ModelClient(self.socket_path, timeout=10)
+        self.addCleanup(self.client.close)
+        self.labels = fake_predictor().labels
+
+    def pixels(self, *values, shape=(256, 256, 3)):
+        return np.stack([np.full(shape, value, dtype=np.uint8) for value in values])
+
+    def client_predictor(self, shm_slots=0):
+        predictor = AIPredictor(model_path='fake-model.h5', server_socket=self.socket_path, shm_slots=shm_slots)
+        self.addCleanup(predictor.client.close)
+        return predictor
+
+    def test_pixels_round_trip_as_one_batch(self):
+        probabilities = self.client.predict_proba(self.pixels(0, 255, 0))
+        self.assertEqual(probabilities.shape, (3, len(self.labels)))
+        self.assertEqual(probabilities.argmax(axis=1).tolist(), [0, len(self.labels) - 1, 0])
+
+    def test_mismatched_shape_gets_an_error_frame(self):
+        with self.assertRaisesRegex(ModelServerError, 'the model expects'):
+            self.client.predict_proba(self.pixels(0, shape=(64, 64, 3)))
+        # The server closed that connection; the next request reconnects
+        self.assertEqual(self.client.predict_proba(self.pixels(255)).shape, (1, len(self.labels)))
+
+    def test_oversized_batch_gets_an_error_frame_before_the_payload_is_sent(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(10)
+            conn.connect(self.socket_path)
+            # Claims 100000 images but sends none: refused from the header alone
+            conn.sendall(REQUEST_HEADER.pack(MAGIC, OP_PREDICT, 100000, 256, 256, 3))
+            response = conn.makefile('rb').read()
+        self.assertIn(b'this server accepts 1 to 4', response)
+
+    def test_malformed_header_drops_the_connection(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(10)
+            conn.connect(self.socket_path)
+            conn.sendall(REQUEST_HEADER.pack(b'XXXX', OP_PREDICT, 1, 256, 256, 3))
+            self.assertEqual(conn.recv(1), b'')
+
+    def test_shared_memory_handoff(self):
+        predictor = self.client_predictor(shm_slots=2)
+        self.assertEqual(predictor.predict(io.BytesIO(image_bytes(255)))['class_name'],
+                         self.labels[len(self.labels) - 1].class_name)
+        self.assertEqual(sorted(predictor._ring._free), [0, 1])
+
+    def test_resent_slots_are_marked_ready_again(self):
+        ring = SharedTensorRing.create(1, (256, 256, 3))
+        self.addCleanup(ring.close)
+        index = ring.acquire()
+        ring.array(index)[:] = 255
+        # As if an earlier attempt's connection broke after the server read the slot
+        ring.states[index] = SLOT_READING
+        probabilities = self.client.predict_slots(ring, [index])
+        self.assertEqual(int(probabilities.argmax()), len(self.labels) - 1)
+
+    def test_failed_slot_handoff_falls_back_to_inline_pixels(self):
+        predictor = self.client_predictor(shm_slots=2)
+        for error in (ModelServerError("Slot 0 is not ready"), TimeoutError("timed out")):
+            with self.subTest(error=error):
+                with mock.patch.object(predictor.client, 'predict_slots', side_effect=error), \
+                        self.assertLogs('doctor.ai_service', 'WARNING'):
+                    result = predictor.predict(io.BytesIO(image_bytes(0)))
+                self.assertEqual(result['class_name'], self.labels[0].class_name)
+
+    def test_undecodable_images_are_not_retried_inline(self):
+        predictor = self.client_predictor(shm_slots=2)
+        with self.assertRaises(OSError), mock.patch.object(predictor.client, 'predict_proba') as inline:
+            predictor.predict(io.BytesIO(b'not an image'))
+        inline.assert_not_called()
+
+
+class CatalogueCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.predictor = fake_predictor()
+        patcher = mock.patch('doctor.model_registry.get_predictor', return_value=self.predictor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.catalogue = CatalogueCache(ttl=300)
+        patcher = mock.patch('doctor.catalogue.get_catalogue', return_value=self.catalogue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        crop = Crop.objects.create(name='Tomato')
+        self.disease = Disease.objects.create(crop=crop, name='Tomato___Late_blight')
+        self.treatment = Treatment.objects.create(disease=self.disease, title='Copper spray', instructions='Weekly.')
+
+    def titles(self, crop, disease):
+        return [treatment['title'] for treatment in self.catalogue.fragment(crop, disease)['treatments']]
+
+    def test_treatments_come_from_the_catalogue(self):
+        Treatment.objects.create(disease=self.disease, title='Remove plants', instructions='Burn them.')
+        self.assertEqual(self.titles('Tomato', 'Late_blight'), ['Copper spray', 'Remove plants'])
+        self.assertEqual(self.catalogue.ids('Tomato___Late_blight')[1:], (self.disease.id, self.treatment.id))
+
+    def test_classes_without_treatment_rows_get_the_built_in_advice(self):
+        self.assertEqual(self.titles('Tomato', 'Early_blight'), ['Treatment for Tomato - Early_blight'])
+        self.assertEqual(self.catalogue.fragment('Tomato', 'Early_blight')['treatments'][0]['instructions'],
+                         TREATMENTS['Tomato___Early_blight'])
+
+    def test_edited_treatments_are_served_after_the_save(self):
+        self.assertEqual(self.titles('Tomato', 'Late_blight'), ['Copper spray'])
+        self.treatment.title = 'Copper oxychloride spray'
+        self.treatment.save()
+        self.assertEqual(self.titles('Tomato', 'Late_blight'), ['Copper oxychloride spray'])
+        self.treatment.delete()
+        self.assertEqual(self.titles('Tomato', 'Late_blight'), ['Treatment for Tomato - Late_blight'])
+
+    def test_swapping_in_a_version_drops_the_cached_fragments(self):
+        self.catalogue.fragment('Tomato', 'Late_blight')
+        self.assertTrue(self.catalogue.stats()['fragments'])
+        _bind_catalogue(fake_predictor())
+        self.assertFalse(self.catalogue.stats()['fragments'])
+        self.assertFalse(self.catalogue.stats()['loaded'])
+
+
+class BackfillPredictionLinksTests(TransactionTestCase):
+    def test_links_follow_the_classes_of_the_active_version(self):
+        with tempfile.TemporaryDirectory() as model_path, \
+                override_settings(MODEL_PATH=model_path, MODEL_VERSION=None):
+            os.makedirs(os.path.join(model_path, 'okra'))
+            with open(os.path.join(model_path, 'okra', 'manifest.json'), 'w') as f:
+                json.dump({'artifact': 'model.h5', 'class_names': ['Okra___Leaf_spot', 'Okra___healthy']}, f)
+            activate('okra')
+
+            okra = Crop.objects.create(name='Okra')
+            spot = Disease.objects.create(crop=okra, name='Okra___Leaf_spot')
+            treatment = Treatment.objects.create(disease=spot, title='Neem oil', instructions='Spray.')
+            linked = Prediction.objects.create(predicted_crop='Okra', predicted_disease='Leaf_spot', confidence_score=90)
+            healthy = Prediction.objects.create(predicted_crop='Okra', predicted_disease='healthy', confidence_score=90)
+
+            call_command('backfill_prediction_links', stdout=io.StringIO())
+
+        linked.refresh_from_db()
+        healthy.refresh_from_db()
+        self.assertEqual((linked.crop_id, linked.disease_id, linked.treatment_id), (okra.id, spot.id, treatment.id))
+        self.assertEqual((healthy.crop_id, healthy.disease_id), (okra.id, None))
+
+
+class InferenceExecutorTests(TransactionTestCase):
+    def test_predictions_beyond_the_queue_get_a_503(self):
+        executor = InferenceExecutor(max_workers=1, max_pending=0)
+        release = threading.Event()
+        holder = threading.Thread(target=asyncio.run, args=(executor.run(release.wait),))
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        while not executor.in_flight:
+            time.sleep(0.01)
+
+        with mock.patch('doctor.views.get_inference_executor', return_value=executor), \
+                mock.patch('doctor.model_registry.get_predictor', return_value=fake_predictor()):
+            for path in ('/predict/', '/classify/'):
+                with self.subTest(path=path):
+                    upload = io.BytesIO(image_bytes(128))
+                    upload.name = 'leaf.png'
+                    response = self.client.post(path, {'image': upload})
+                    self.assertEqual(response.status_code, 503)
+                    self.assertFalse(response.json()['success'])
+            # Pages that don't predict are still served
+            self.assertEqual(self.client.get('/').status_code, 200)
+
+        self.assertEqual(executor.stats()['rejected'], 2)
+        self.assertFalse(Prediction.objects.exists())
+        release.set()
+        self.assertTrue(executor.wait_idle(timeout=5))
+
+
+class CountingBackend(FakeBackend):
+    is_loaded = False
+
+    def __init__(self, num_classes):
+        super().__init__(num_classes)
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        self.is_loaded = True
+
+
+# Imports the whole app the way a server does, then reports what got loaded
+LAZY_IMPORT_SCRIPT = """
+import json
+import sys
+import django
+django.setup()
+import agrodoctor.asgi, agrodoctor.wsgi, doctor.urls, doctor.views
+from doctor import model_registry
+print(json.dumps({
+    'predictor': model_registry.current_predictor() is not None,
+    'modules': sorted(name for name in ('tensorflow', 'tflite_runtime', 'onnxruntime') if name in sys.modules),
+}))
+"""
+
+
+class LazyModelLoadingTests(SimpleTestCase):
+    def test_starting_the_app_neither_creates_a_predictor_nor_imports_a_runtime(self):
+        output = subprocess.run(
+            [sys.executable, '-c', LAZY_IMPORT_SCRIPT], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            check=True, env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'agrodoctor.settings'},
+        ).stdout
+        self.assertEqual(json.loads(output.splitlines()[-1]), {'predictor': False, 'modules': []})
+
+    def test_weights_load_once_on_the_first_prediction(self):
+        predictor = AIPredictor(model_path='fake-model.h5')
+        self.assertFalse(predictor.is_loaded)
+        self.assertIsNone(predictor.backend.model)
+        predictor.backend = backend = CountingBackend(len(predictor.labels))
+
+        self.assertEqual(backend.loads, 0)
+        predictor.predict(io.BytesIO(image_bytes(0)))
+        predictor.predict(io.BytesIO(image_bytes(255)))
+        self.assertTrue(predictor.is_loaded)
+        self.assertEqual(backend.loads, 1)
+        self.assertIsNotNone(predictor.model_load_seconds)
+
+
+class InferenceBackendTests(SimpleTestCase):
+    def test_each_backend_loads_its_own_artifact(self):
+        self.assertEqual(artifact_path('/models/v2/model.h5', 'keras'), '/models/v2/model.h5')
+        self.assertEqual(artifact_path('/models/v2/model.h5', 'tflite'), '/models/v2/model.tflite')
+        self.assertEqual(artifact_path('/models/v2/model.h5', 'onnx'), '/models/v2/model.onnx')
+
+    def test_an_unknown_backend_is_refused(self):
+        with self.assertRaisesMessage(ValueError, "Unknown inference backend 'torch'"):
+            get_backend('torch', 'model.h5')
+
+    def test_the_backend_gets_the_manifest_input_shape(self):
+        manifest = ModelManifest('v2', '/models/v2/model.h5', ['Tomato___healthy'], input_size=(224, 192))
+        for name, backend_class in BACKENDS.items():
+            with self.subTest(backend=name):
+                predictor = AIPredictor(manifest=manifest, backend=name)
+                self.assertIsInstance(predictor.backend, backend_class)
+                self.assertEqual(predictor.backend.path, artifact_path(manifest.model_path, name))
+                self.assertEqual(predictor.backend.input_shape, (224, 192, 3))
+                self.assertFalse(predictor.is_loaded)
+
+    def test_export_samples_are_preprocessed_at_the_manifest_input_shape(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name, content in (('a.png', image_bytes(64)), ('broken.jpg', b'not an image'), ('b.png', image_bytes(200))):
+                paths.append(os.path.join(directory, name))
+                Path(paths[-1]).write_bytes(content)
+            kept, batch = load_samples(paths, (224, 192, 3))
+        self.assertEqual(kept, [paths[0], paths[2]])
+        self.assertEqual(batch.shape, (2, 224, 192, 3))
+        self.assertEqual(batch.dtype, np.float32)
+
+    def test_int8_tensors_are_quantized_and_dequantized_with_their_scale(self):
+        details = {'dtype': np.int8, 'quantization': (1 / 255, -128)}
+        batch = np.array([[0.0, 0.4, 1.0, 2.0]], dtype=np.float32)
+        quantized = _quantize(batch, details)
+        self.assertEqual(quantized.dtype, np.int8)
+        self.assertEqual(quantized.tolist(), [[-128, -26, 127, 127]])
+        np.testing.assert_allclose(_dequantize(quantized, details), [[0.0, 0.4, 1.0, 1.0]], atol=1e-6)
+        float_details = {'dtype': np.float32, 'quantization': (0.0, 0)}
+        self.assertIs(_quantize(batch, float_details), batch)
+
+    @skipUnless(importlib.util.find_spec('tensorflow'), 'TensorFlow is not installed')
+    def test_keras_traces_one_graph_for_every_batch_size(self):
+        import tensorflow as tf
+
+        model = tf.keras.Sequential([
+            tf.keras.Input((8, 6, 3)),
+            tf.keras.layers.GlobalAveragePooling2D(),
+            tf.keras.layers.Dense(4, activation='softmax'),
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.h5')
+            model.save(path)
+            backend = KerasBackend(path, (8, 6, 3))
+            backend.load()
+
+        self.assertEqual(backend.num_classes, 4)
+        rng = np.random.default_rng(0)
+        for size in (1, 3, 1, 5):
+            batch = rng.random((size, 8, 6, 3), dtype=np.float32)
+            np.testing.assert_allclose(backend.predict_proba(batch), model(batch, training=False).numpy(), rtol=1e-5)
+        self.assertEqual(backend._infer.experimental_get_tracing_count(), 1)
+
+
+class FakeShadowEvaluator(ShadowEvaluator):
+    """Shadow evaluation against fake_predictor() instead of a registered version"""
+
+    def _load_candidate(self):
+        candidate = fake_predictor()
+        self._buffer = BatchBuffer(self.batch_size, candidate.input_shape[1::-1], candidate.input_dtype)
+        return candidate
+
+
+class ShadowEvaluatorTests(TransactionTestCase):
+    def served(self, class_name, version='v1'):
+        return {'model_version': version, 'class_name': class_name, 'confidence': 80.0}
+
+    def test_uploads_are_sampled_at_the_sample_rate(self):
+        evaluator = FakeShadowEvaluator('v2', sample_rate=0.3, flush_interval=3600)
+        self.addCleanup(evaluator.shutdown)
+        with mock.patch('doctor.shadow.random.random', side_effect=[0.5, 0.1, 0.29, 0.1]):
+            for _ in range(3):
+                evaluator.offer(io.BytesIO(image_bytes(0)), self.served('Tomato___healthy'), 0.02)
+            # The candidate is never compared with itself
+            evaluator.offer(io.BytesIO(image_bytes(0)), self.served('Tomato___healthy', version='v2'), 0.02)
+        self.assertEqual(evaluator.stats()['sampled'], 2)
+
+        never = FakeShadowEvaluator('v2', sample_rate=0.0)
+        never.offer(io.BytesIO(image_bytes(0)), self.served('Tomato___healthy'), 0.02)
+        self.assertEqual(never.stats()['sampled'], 0)
+        self.assertIsNone(never._thread)
+
+    def test_agreement_is_counted_per_class_pair(self):
+        oracle = fake_predictor()
+        dark = oracle.predict(io.BytesIO(image_bytes(0)))['class_name']
+        bright = oracle.predict(io.BytesIO(image_bytes(255)))['class_name']
+
+        evaluator = FakeShadowEvaluator('v2', sample_rate=1.0, flush_interval=3600)
+        evaluator.offer(io.BytesIO(image_bytes(0)), self.served(dark), 0.02)
+        evaluator.offer(io.BytesIO(image_bytes(0)), self.served(dark), 0.04)
+        evaluator.offer(io.BytesIO(image_bytes(255)), self.served(dark), 0.02)
+        evaluator.offer(io.BytesIO(b'not an image'), self.served(dark), 0.02)
+        # The worker gets through the queued uploads before it stops
+        evaluator.shutdown()
+
+        self.assertEqual(evaluator.stats()['compared'], 3)
+        self.assertAlmostEqual(evaluator.stats()['disagreement_rate'], 1 / 3)
+        rows = {(row.primary_class, row.candidate_class): row for row in ShadowComparison.objects.all()}
+        self.assertEqual(set(rows), {(dark, dark), (dark, bright)})
+        agreed = rows[dark, dark]
+        self.assertEqual((agreed.primary_version, agreed.candidate_version, agreed.count), ('v1', 'v2', 2))
+        self.assertAlmostEqual(agreed.primary_seconds_sum, 0.06)
+        self.assertAlmostEqual(agreed.primary_confidence_sum, 160.0)
+        self.assertTrue(agreed.agrees)
+        self.assertFalse(rows[dark, bright].agrees)
+
+    def test_samples_yield_to_live_inference(self):
+        evaluator = FakeShadowEvaluator('v2', sample_rate=1.0, flush_interval=3600, wait_idle=lambda timeout: False)
+        evaluator.offer(io.BytesIO(image_bytes(0)), self.served('Tomato___healthy'), 0.02)
+        evaluator.shutdown()
+        self.assertEqual(evaluator.stats()['dropped'], 1)
+        self.assertEqual(evaluator.stats()['compared'], 0)
+        self.assertFalse(ShadowComparison.objects.exists())
+
+    def test_a_candidate_that_fails_to_load_turns_sampling_off(self):
+        evaluator = ShadowEvaluator('missing', sample_rate=1.0)
+        with self.assertLogs('doctor.shadow', 'ERROR'):
+            evaluator.offer(io.BytesIO(image_bytes(0)), self.served('Tomato___healthy'), 0.02)
+            evaluator._thread.join(5)
+        self.assertEqual(evaluator.sample_rate, 0.0)
+        evaluator.offer(io.BytesIO(image_bytes(0)), self.served('Tomato___healthy'), 0.02)
+        self.assertEqual(evaluator.stats()['sampled'], 1)
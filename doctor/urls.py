@@ -12,6 +12,7 @@ urlpatterns = [
     
     # Prediction functionality
     path('predict/', views.predict_disease, name='predict_disease'),
+    path('predictions/<uuid:reference>/', views.prediction_status, name='prediction_status'),
     path('result/<int:prediction_id>/', views.prediction_result, name='prediction_result'),
     
     # User dashboard
@@ -24,7 +25,11 @@ urlpatterns = [
     # Diseases
     path('diseases/', views.diseases_list, name='diseases_list'),
     path('diseases/<int:disease_id>/', views.disease_detail, name='disease_detail'),
+    path('search/', views.search_suggestions, name='search_suggestions'),
 
     # Plant classification
     path('classify/', classify_plant_image, name='classify_plant_image'),
+    path('classify/batch/', views.classify_batch, name='classify_batch'),
+    path('inference/stats/', views.inference_stats, name='inference_stats'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
 ] 
\ No newline at end of file
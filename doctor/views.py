@@ -1,24 +1,53 @@
-from django.shortcuts import render, redirect
-from django.http import JsonResponse
-from django.contrib.auth.decorators import login_required
-from django.contrib import messages
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
-from django.core.paginator import Paginator
-from django.db.models import Q
+import hmac
+import io
 import json
 import logging
+import uuid
+from functools import wraps
+from time import perf_counter
 
-from .models import Prediction, Crop, Disease, Treatment, CropTip
-# from .ai_service import predictor
 from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import require_http_methods
 
-from .ai_service import AIPredictor
-from django.views.decorators.csrf import ensure_csrf_cookie
+from . import metrics, model_registry, search
+from . import stats as prediction_stats
+from .batch import BatchUploadError, preprocess_parallel, read_uploads
+from .catalogue import get_catalogue
+from .executor import ExecutorBusy, get_inference_executor
+from .metrics import count_prediction, observe_request, timed
+from .models import Prediction, Crop, Disease, SearchDocument
+from .pagination import KeysetPage, KeysetPaginator
+from .persistence import get_prediction_writer, save_prediction
+from .prediction_cache import get_prediction_cache, hash_upload
+from .preprocessing import BatchBuffer
+from .shadow import get_shadow_evaluator
 
 logger = logging.getLogger(__name__)
 
-predictor = AIPredictor()
+
+def run_prediction(image_file):
+    """Predict ``image_file``, reusing the cached result for identical uploads.
+
+    Returns the result together with the uploaded bytes.
+    """
+    with timed('cache'):
+        digest, data = hash_upload(image_file)
+        cache = get_prediction_cache()
+        predictor = model_registry.get_predictor()
+        result = cache.get(digest, predictor.cache_key)
+    if result is None:
+        result = predictor.predict(io.BytesIO(data))
+        cache.set(digest, result, predictor.cache_key)
+    count_prediction(result)
+    return result, data
+
 
 @ensure_csrf_cookie
 def home(request):
@@ -29,101 +58,81 @@ def home(request):
     }
     return render(request, 'doctor/home.html', context)
 
-@require_http_methods(["POST"])
-@csrf_exempt
-# def predict_disease(request):
-#     """Handle image upload and disease prediction"""
-#     try:
-#         if 'image' not in request.FILES:
-#             return JsonResponse({'success': False, 'error': 'No image file provided'}, status=400)
-
-#         image_file = request.FILES['image']
-
-#         # Validate file type
-#         allowed_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif']
-#         if image_file.content_type not in allowed_types:
-#             return JsonResponse({'success': False, 'error': 'Invalid file type. Please upload an image (JPEG, PNG, GIF)'}, status=400)
-
-#         # Validate file size (max 10MB)
-#         if image_file.size > 10 * 1024 * 1024:
-#             return JsonResponse({'success': False, 'error': 'File size too large. Please upload an image smaller than 10MB'}, status=400)
-
-#         # Ensure file pointer is at start
-#         if hasattr(image_file, 'seek'):
-#             image_file.seek(0)
-
-#         # Run AI prediction
-#         result = predict_disease(image_file)
-#         treatments = prediction.get_treatment_recommendations(prediction_result['crop'], prediction_result['disease'])
-
-#         # Save to DB
-#         prediction = Prediction.objects.create(
-#             image=image_file,
-#             predicted_crop=result['crop_name'],
-#             predicted_disease=result['disease_name'],
-#             confidence_score=result['confidence'],
-#             crop=result['crop'],
-#             disease=result['disease'],
-#             treatment=result['treatment']
-#         )
-
-#         return JsonResponse({
-#             'success': True,
-#             'prediction': {
-#                 'crop': result['crop_name'],
-#                 'disease': result['disease_name'],
-#                 'confidence': result['confidence'],
-#                 'class_name': result['predicted_label'],
-#                 'prediction_id': prediction.id
-#             },
-#             'treatments': [
-#                 {
-#                     'title': result['treatment'].title,
-#                     'description': result['treatment'].description,
-#                     'treatment_type': result['treatment'].treatment_type,
-#                     'instructions': result['treatment'].instructions,
-#                     'effectiveness': result['treatment'].effectiveness
-#                 }
-#             ] if result['treatment'] else [],
-#         })
-
-#     except Exception as e:
-#         logger.error(f"Prediction error: {str(e)}")
-#         return JsonResponse({'success': False, 'error': 'An error occurred during prediction. Please try again.'}, status=500)
-
-def predict_disease(request):
-    if request.method == 'POST' and request.FILES.get('image'):
-        image_file = request.FILES['image']
-        result = predictor.predict(image_file)
-        treatments = predictor.get_treatment_recommendations(result['crop'], result['disease'])
-
-        # Save prediction result to DB
-        Prediction.objects.create(
-            image=image_file,
-            predicted_crop=result['crop'],
-            predicted_disease=result['disease'],
-            confidence_score=result['confidence'],
-        )
-
-        # Prepare treatment data
-        treatment_data = [{
-            'title': t.title,
-            'description': getattr(t, 'description', ''),  # Safe for missing field
-            'treatment_type': getattr(t, 'treatment_type', ''),
-            'effectiveness': getattr(t, 'effectiveness', ''),
-            'instructions': t.instructions,
-            
-        } for t in treatments]
+
+def _predict_disease(request):
+    with timed('upload'):
+        image_file = request.FILES.get('image') if request.method == 'POST' else None
+    if image_file:
+        result, data = run_prediction(image_file)
+        with timed('db'):
+            catalogue = get_catalogue()
+            fragment = catalogue.fragment(result['crop'], result['disease'])
+            crop_id, disease_id, treatment_id = catalogue.ids(result['class_name'])
+
+            # Save prediction result to DB (off the request path); the client can
+            # resolve the reference to a prediction id once it has been written
+            reference = uuid.uuid4()
+            save_prediction(Prediction(
+                image=ContentFile(data, name=image_file.name),
+                predicted_crop=result['crop'],
+                predicted_disease=result['disease'],
+                confidence_score=result['confidence'],
+                crop_id=crop_id,
+                disease_id=disease_id,
+                treatment_id=treatment_id,
+                model_version=result['model_version'],
+                reference=reference,
+            ))
 
         # Send prediction and treatment as response
-        return JsonResponse({
-            'success': True,
-            'prediction': result,
-            'treatments': treatment_data
-        })
+        with timed('serialize'):
+            response = JsonResponse({
+                'success': True,
+                'prediction': result,
+                'prediction_reference': str(reference),
+                'treatments': fragment['treatments']
+            })
+        return response
 
     return JsonResponse({'success': False, 'error': 'No image uploaded'})
-    
+
+
+def _busy_response():
+    return JsonResponse({'success': False, 'error': 'Server is busy, please try again shortly'}, status=503)
+
+
+async def _run_timed(endpoint, view, request):
+    """Run ``view`` on the inference pool, recording latency and status code for /metrics"""
+    started = perf_counter()
+    try:
+        response = await get_inference_executor().run(view, request)
+    except ExecutorBusy:
+        response = _busy_response()
+    except Exception:
+        observe_request(endpoint, 500, perf_counter() - started)
+        raise
+    observe_request(endpoint, response.status_code, perf_counter() - started)
+    return response
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+async def predict_disease(request):
+    """Handle image upload and disease prediction"""
+    # Upload parsing, preprocessing, inference and the DB work all run on the
+    # bounded inference pool so the event loop stays free for other pages
+    return await _run_timed('predict', _predict_disease, request)
+
+
+
+def prediction_status(request, reference):
+    """Resolve a prediction reference to its id once the row has been saved"""
+    prediction_id = Prediction.objects.filter(reference=reference).values_list('id', flat=True).first()
+    return JsonResponse({
+        'success': True,
+        'saved': prediction_id is not None,
+        'prediction_id': prediction_id,
+    })
 
 
 def prediction_result(request, prediction_id):
@@ -149,16 +158,35 @@ def prediction_result(request, prediction_id):
         return redirect('home')
 
 
+def page_payload(page, items):
+    """JSON body of a keyset page: its items and the cursors around it"""
+    return {
+        'success': True,
+        'results': items,
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    }
+
+
 @login_required
 def dashboard(request):
     """ dashboard showing prediction history"""
-    predictions = Prediction.objects.all().order_by('-created_at')
-
-    paginator = Paginator(predictions, 10)
-    page_obj = paginator.get_page(request.GET.get('page'))
-
-    total = predictions.count()
-    correct = predictions.filter(is_correct=True).count()
+    paginator = KeysetPaginator(Prediction.objects.all(), ('-created_at', '-id'), per_page=10)
+    page_obj = paginator.page(request.GET.get('cursor'))
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse(page_payload(page_obj, [{
+            'id': prediction.id,
+            'predicted_crop': prediction.predicted_crop,
+            'predicted_disease': prediction.predicted_disease,
+            'confidence_score': prediction.confidence_score,
+            'is_correct': prediction.is_correct,
+            'thumbnail_url': prediction.thumbnail_url,
+            'created_at': prediction.created_at.isoformat(),
+        } for prediction in page_obj]))
+
+    # Totals come from the daily statistics table, not a scan of every prediction
+    total, correct = prediction_stats.totals()
     accuracy = (correct / total * 100) if total > 0 else 0
 
     return render(request, 'doctor/dashboard.html', {
@@ -204,19 +232,26 @@ def diseases_list(request):
     """Display list of diseases"""
     diseases = Disease.objects.select_related('crop').all().order_by('crop__name', 'name')
     
-    # Search functionality
+    # Search functionality: the best full-text matches over diseases and their
+    # treatments, in rank order
     search_query = request.GET.get('search', '')
     if search_query:
-        diseases = diseases.filter(
-            Q(name__icontains=search_query) |
-            Q(crop__name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
-    
-    # Pagination
-    paginator = Paginator(diseases, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        hits = search.search(search_query, limit=100, kinds=[SearchDocument.KIND_DISEASE, SearchDocument.KIND_TREATMENT])
+        disease_ids = list(dict.fromkeys(hit.disease_id for hit in hits))
+        found = diseases.in_bulk(disease_ids)
+        page_obj = KeysetPage([found[pk] for pk in disease_ids if pk in found])
+    else:
+        # Pagination (ordered across the crop join, so not index-backed; the
+        # disease catalogue is small enough for that not to matter)
+        paginator = KeysetPaginator(diseases, ('crop__name', 'name', 'id'), per_page=20)
+        page_obj = paginator.page(request.GET.get('cursor'))
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse(page_payload(page_obj, [{
+            'id': disease.id,
+            'name': disease.name,
+            'crop': disease.crop.name,
+        } for disease in page_obj]))
     
     context = {
         'page_obj': page_obj,
@@ -226,6 +261,20 @@ def diseases_list(request):
     
     return render(request, 'doctor/diseases_list.html', context)
 
+def search_suggestions(request):
+    """Ranked prefix matches for the search box"""
+    hits = search.search(request.GET.get('q', ''), limit=10)
+    return JsonResponse({
+        'success': True,
+        'results': [{
+            'kind': hit.kind,
+            'id': hit.object_id,
+            'title': hit.title,
+            'crop': hit.crop_name,
+            'disease_id': hit.disease_id,
+        } for hit in hits],
+    })
+
 def disease_detail(request, disease_id):
     """Display detailed information about a specific disease"""
     try:
@@ -260,53 +309,246 @@ def contact(request):
     }
     return render(request, 'doctor/contact.html', context)
 
-def classify_plant_image(request):
-    """Alternative API endpoint for prediction"""
-    if request.method == 'POST' and request.FILES.get('image'):
+def _classify_plant_image(request):
+    with timed('upload'):
+        image_file = request.FILES.get('image') if request.method == 'POST' else None
+    if image_file:
         try:
-            image_file = request.FILES['image']
-            result = predictor.predict(image_file)
-
-            # Get treatments
-            treatments = predictor.get_treatment_recommendations(result['crop'], result['disease'])
-
-            # Prepare treatment data
-            treatment_data = [{
-                'title': t.title,
-                'description': getattr(t, 'description', ''),  # Safe for missing field
-                'treatment_type': getattr(t, 'treatment_type', ''),
-                'effectiveness': getattr(t, 'effectiveness', ''),
-                'instructions': t.instructions,
-            } for t in treatments]
-
-            # Get crop tips
-            crop_obj = None
-            try:
-                crop_obj = Crop.objects.get(name__iexact=result['crop'].strip())
-            except Crop.DoesNotExist:
-                pass
-
-            crop_tips = []
-            if crop_obj:
-                crop_tips = [{
-                    'title': tip.title,
-                    'content': tip.content,
-                    'tip_type': tip.tip_type,
-                    'season': tip.season
-                } for tip in crop_obj.tips.all()]
-
-            return JsonResponse({
-                'success': True,
-                'prediction': {
-                    'crop': result['crop'],
-                    'disease': result['disease'],
-                    'confidence': result['confidence'],
-                    'class_name': result['class_name']
-                },
-                'treatments': treatment_data,  # This should always be a list
-                'crop_tips': crop_tips,
-            })
+            result, _ = run_prediction(image_file)
+
+            # Treatments and crop tips come pre-serialized from the catalogue cache
+            with timed('db'):
+                fragment = get_catalogue().fragment(result['crop'], result['disease'])
+
+            with timed('serialize'):
+                response = JsonResponse({
+                    'success': True,
+                    'prediction': {
+                        'crop': result['crop'],
+                        'disease': result['disease'],
+                        'confidence': result['confidence'],
+                        'class_name': result['class_name'],
+                        'top_k': result.get('top_k', []),
+                        'model_version': result.get('model_version'),
+                    },
+                    'treatments': fragment['treatments'],  # This should always be a list
+                    'crop_tips': fragment['crop_tips'],
+                })
+            return response
         except Exception as e:
             logger.error(f"Prediction error: {e}")
             return JsonResponse({'success': False, 'error': 'Failed to predict'}, status=500)
-    return JsonResponse({'success': False, 'error': 'No image uploaded'}, status=400)
\ No newline at end of file
+    return JsonResponse({'success': False, 'error': 'No image uploaded'}, status=400)
+
+
+async def classify_plant_image(request):
+    """Alternative API endpoint for prediction"""
+    return await _run_timed('classify', _classify_plant_image, request)
+
+
+def _batch_results(items):
+    """Yield one NDJSON line per batch item as soon as its result is known"""
+    predictor = model_registry.get_predictor()
+    cache = get_prediction_cache()
+    chunk_size = settings.BATCH_CLASSIFY['CHUNK_SIZE']
+    buffer = BatchBuffer(min(chunk_size, len(items)), predictor.input_shape[1::-1], predictor.input_dtype)
+
+    catalogue = get_catalogue()
+
+    def line(item, result=None, error=None):
+        if error is not None:
+            payload = {'index': item.index, 'name': item.name, 'success': False, 'error': error}
+        else:
+            fragment = catalogue.fragment(result['crop'], result['disease'])
+            count_prediction(result)
+            payload = {
+                'index': item.index,
+                'name': item.name,
+                'success': True,
+                'prediction': result,
+                'treatments': fragment['treatments'],
+                'crop_tips': fragment['crop_tips'],
+            }
+        return json.dumps(payload) + '\n'
+
+    for start in range(0, len(items), chunk_size):
+        # Cached images are answered first; identical images are predicted once
+        duplicates = {}
+        for item in items[start:start + chunk_size]:
+            result = cache.get(item.digest, predictor.cache_key)
+            if result is not None:
+                yield line(item, result)
+            else:
+                duplicates.setdefault(item.digest, []).append(item)
+        if not duplicates:
+            continue
+
+        pending = [group[0] for group in duplicates.values()]
+        errors = preprocess_parallel(buffer, pending)
+        for row, error in errors.items():
+            for item in duplicates[pending[row].digest]:
+                yield line(item, error=error)
+
+        rows = [row for row in range(len(pending)) if row not in errors]
+        if not rows:
+            continue
+        try:
+            results = predictor.predict_arrays(buffer.array[rows] if errors else buffer.batch(len(pending)))
+        except Exception as e:
+            logger.error(f"Batch prediction error: {e}")
+            for row in rows:
+                for item in duplicates[pending[row].digest]:
+                    yield line(item, error='Failed to predict')
+            continue
+
+        for row, result in zip(rows, results):
+            cache.set(pending[row].digest, result, predictor.cache_key)
+            for item in duplicates[pending[row].digest]:
+                yield line(item, result)
+
+
+@require_http_methods(["POST"])
+async def classify_batch(request):
+    """Classify many images (files or a zip archive), streaming NDJSON results"""
+    executor = get_inference_executor()
+    try:
+        items = await executor.run(lambda: read_uploads(request.FILES))
+    except ExecutorBusy:
+        return _busy_response()
+    except BatchUploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    if not items:
+        return JsonResponse({'success': False, 'error': 'No image uploaded'}, status=400)
+
+    results = _batch_results(items)
+    if not isinstance(request, ASGIRequest):
+        # WSGI servers (runserver included) would buffer an async iterator
+        # whole; a plain generator still streams there, one chunk at a time
+        return StreamingHttpResponse(results, content_type='application/x-ndjson')
+
+    async def stream():
+        # Each chunk is computed on the inference pool as the client reads
+        while True:
+            line = await executor.run(next, results, None, admit=False)
+            if line is None:
+                return
+            yield line
+
+    return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+
+
+def operations_only(view):
+    """Limit ``view`` to OPERATIONS_ALLOWED_IPS and holders of OPERATIONS_TOKEN"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = settings.OPERATIONS_TOKEN
+        authorization = request.headers.get('Authorization', '')
+        if request.META.get('REMOTE_ADDR') in settings.OPERATIONS_ALLOWED_IPS or (
+                token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())):
+            return view(request, *args, **kwargs)
+        return JsonResponse({'success': False, 'error': 'Forbidden'}, status=403)
+    return wrapper
+
+
+@operations_only
+def inference_stats(request):
+    """Model versions, shadow evaluation, micro-batcher histograms, caches, writer and executor counters"""
+    # Reporting must not be what triggers loading TensorFlow
+    predictor = model_registry.current_predictor()
+    shadow = get_shadow_evaluator()
+    return JsonResponse({
+        'success': True,
+        'model_loaded': model_registry.is_loaded(),
+        'model': model_registry.stats(),
+        'shadow': shadow.stats() if shadow else None,
+        'batching': predictor.batcher.stats() if predictor else None,
+        'prediction_cache': get_prediction_cache().stats(),
+        'catalogue': get_catalogue().stats(),
+        'prediction_writer': get_prediction_writer().stats(),
+        'executor': get_inference_executor().stats(),
+    })
+
+
+@operations_only
+def prometheus_metrics(request):
+    """This worker's counters, gauges and latency histograms in the Prometheus text format"""
+    # Like inference_stats, scraping must not load the model
+    predictor = model_registry.current_predictor()
+    out = metrics.Exposition()
+
+    out.family('request_seconds', 'histogram', "Time from the request reaching the view until its response, by endpoint")
+    for endpoint, histogram in metrics.request_seconds.items():
+        out.histogram('request_seconds', histogram, {'endpoint': endpoint})
+    out.family('requests_total', 'counter', "Prediction requests by endpoint and status code (503: inference pool full)")
+    out.counter('requests_total', metrics.requests_total)
+    out.family('stage_seconds', 'histogram', "Time spent in each stage of a prediction request")
+    for stage, histogram in metrics.stage_seconds.items():
+        out.histogram('stage_seconds', histogram, {'stage': stage})
+    out.family('predictions_total', 'counter', "Predictions served (cache hits included) by model version and class")
+    out.counter('predictions_total', metrics.predictions_total)
+
+    model = model_registry.stats()
+    out.family('model_info', 'gauge', "The model version served by this worker")
+    if predictor is not None:
+        out.sample('model_info', 1, {'version': predictor.version, 'backend': predictor.backend.name})
+    out.family('model_loaded', 'gauge', "1 once the model weights are loaded")
+    out.sample('model_loaded', model_registry.is_loaded())
+    out.family('model_load_seconds', 'gauge', "Time it took to load the served model")
+    if predictor is not None:
+        out.sample('model_load_seconds', predictor.model_load_seconds, {'version': predictor.version})
+    out.family('model_swaps_total', 'counter', "Model versions swapped in without a restart")
+    out.sample('model_swaps_total', model['swaps'])
+
+    if predictor is not None:
+        batcher = predictor.batcher
+        out.family('batcher_queue_depth', 'gauge', "Requests waiting for the micro-batcher")
+        out.sample('batcher_queue_depth', batcher.stats()['queue_depth'])
+        out.family('batch_size', 'histogram', "Images per forward pass")
+        out.histogram('batch_size', batcher.batch_size_histogram)
+        out.family('batch_queue_wait_seconds', 'histogram', "Time a request waited for its batch to start")
+        out.histogram('batch_queue_wait_seconds', batcher.queue_wait_histogram)
+
+    executor = get_inference_executor().stats()
+    out.family('executor_in_flight', 'gauge', "Requests running or queued on the inference pool")
+    out.sample('executor_in_flight', executor['in_flight'])
+    out.family('executor_capacity', 'gauge', "Requests the inference pool admits before answering 503")
+    out.sample('executor_capacity', executor['max_workers'] + executor['max_pending'])
+    out.family('executor_rejected_total', 'counter', "Requests turned away because the inference pool was full")
+    out.sample('executor_rejected_total', executor['rejected'])
+
+    writer = get_prediction_writer().stats()
+    out.family('prediction_writer_queue_depth', 'gauge', "Predictions waiting to be saved")
+    out.sample('prediction_writer_queue_depth', writer['queue_depth'])
+    out.family('prediction_writer_written_total', 'counter', "Predictions saved by the background writer")
+    out.sample('prediction_writer_written_total', writer['written'])
+    out.family('prediction_writer_failed_total', 'counter', "Predictions the background writer could not save")
+    out.sample('prediction_writer_failed_total', writer['failed'])
+
+    cache = get_prediction_cache().stats()
+    out.family('prediction_cache_lookups_total', 'counter', "Prediction cache lookups by result")
+    out.sample('prediction_cache_lookups_total', cache['hits'], {'result': 'hit'})
+    out.sample('prediction_cache_lookups_total', cache['misses'], {'result': 'miss'})
+    out.family('prediction_cache_hit_ratio', 'gauge', "Share of prediction cache lookups that were hits")
+    out.sample('prediction_cache_hit_ratio', cache['hit_rate'])
+    out.family('prediction_cache_size', 'gauge', "Results held in this worker's prediction cache")
+    out.sample('prediction_cache_size', cache['size'])
+
+    catalogue = get_catalogue().stats()
+    out.family('catalogue_loads_total', 'counter', "Times the treatment and crop tip catalogue was loaded from the database")
+    out.sample('catalogue_loads_total', catalogue['loads'])
+
+    shadow = get_shadow_evaluator()
+    if shadow is not None:
+        shadow = shadow.stats()
+        labels = {'candidate_version': shadow['candidate_version']}
+        out.family('shadow_queue_depth', 'gauge', "Sampled uploads waiting for the candidate model")
+        out.sample('shadow_queue_depth', shadow['queue_depth'], labels)
+        out.family('shadow_compared_total', 'counter', "Uploads run through the candidate model")
+        out.sample('shadow_compared_total', shadow['compared'], labels)
+        out.family('shadow_dropped_total', 'counter', "Sampled uploads dropped because the queue was full or traffic never let up")
+        out.sample('shadow_dropped_total', shadow['dropped'], labels)
+        out.family('shadow_disagreement_ratio', 'gauge', "Share of compared uploads the candidate classified differently")
+        out.sample('shadow_disagreement_ratio', shadow['disagreement_rate'], labels)
+
+    return HttpResponse(out.render(), content_type=out.content_type)
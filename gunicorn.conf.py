@@ -0,0 +1,52 @@
+"""
+Gunicorn configuration for AgroDoctor.
+
+Workers serve the ASGI application through uvicorn, so the async prediction
+views can hand inference to their bounded thread pool while the event loop
+keeps serving other pages. GUNICORN_WORKER_CLASS=sync together with
+agrodoctor.wsgi:application restores the threaded WSGI setup.
+
+The model is never loaded at import time. By default each worker loads it and
+runs a warm-up forward pass right after it has imported the application, so
+the first real request doesn't pay for it.
+
+Set AGRODOCTOR_PRELOAD_MODEL=1 to load the application and the model weights
+once in the master process instead; forked workers then share the weights
+copy-on-write.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 120
+
+preload_app = os.environ.get('AGRODOCTOR_PRELOAD_MODEL', '0') == '1'
+warm_up_workers = os.environ.get('AGRODOCTOR_WARMUP', '1') == '1'
+
+
+def on_starting(server):
+    # With preload_app the Django application is already imported here
+    if preload_app:
+        from doctor import model_registry
+        model_registry.load_model()
+
+
+def post_worker_init(worker):
+    # Runs in the worker after the application is loaded (post_fork runs
+    # before that when the app isn't preloaded)
+    if warm_up_workers:
+        from doctor import model_registry
+        from doctor.catalogue import get_catalogue
+        model_registry.warm_up()
+        get_catalogue().warm()
+
+
+def worker_exit(server, worker):
+    # Write out predictions still waiting in the background writer's queue
+    # and the shadow model comparisons counted since the last flush
+    from doctor import persistence, shadow
+    persistence.shutdown()
+    shadow.shutdown()